@@ -63,7 +63,7 @@ class AddNodesToEtcHosts(ClusterDeployment):
                 deployments.append(AddToEtcHosts(node.public_ips[0], hostnames))
 
         # go through all nodes and add node information of all other nodes to /etc/hosts
-        results = deploy(deployments, nodes, usePrivateIps=usePrivateIps)
+        results = deploy(deployments, nodes, usePrivateIps=usePrivateIps, scriptMode=True)
         if results.numberOfErrors > 0:
             raise DeploymentRunError(nodes[0], results.toJSON(includeClassInfo=True, pretty=True))
 
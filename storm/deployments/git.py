@@ -5,25 +5,129 @@ This project is licensed under the MIT License, see LICENSE
 
 Git related deployments
 """
+import hashlib
 import logging
 import os
 import re
+import subprocess
+import threading
+import time
 
 from c4.utils.logutil import ClassLogger
 
-from ..thunder import (Deployment,
+from ..thunder import (ClusterDeployment,
+                       Deployment,
                        DeploymentRunError,
-                       RemoteTemporaryDirectory)
-from .software import (InstallRPMPackages, isRPMPackageInstalled)
-
+                       RemoteTemporaryDirectory,
+                       deploy)
+from .software import (InstallRPMPackages, RemoteCopy,
+                       isRPMPackageInstalled)
+
+BUILD_PREREQUISITES = [
+    "expat-devel",
+    "gettext-devel",
+    "curl-devel",
+    "perl-devel",
+    "zlib-devel",
+    "openssl-devel"
+]
+# bundles of previous commits may still be uploaded by other node deployments
+BUNDLE_RETENTION_TIME = 3600
+LOCAL_REPOSITORY_CACHE_DIRECTORY = "~/.storm-thunder/git"
+RUNTIME_PREREQUISITES = [
+    "expat",
+    "gettext",
+    "libcurl",
+    "perl",
+    "zlib",
+    "openssl"
+]
 
 log = logging.getLogger(__name__)
 
+# local repositories and bundles are shared between the node deployments,
+# (repository, reference name) to (commit, fetch end time) mapping
+bundleLock = threading.Lock()
+fetchedLocalRepositories = {}
+
+@ClassLogger
+class ClusterInstall(ClusterDeployment):
+    """
+    Install git by building it once on the first node that requires it and then
+    distributing the resulting binary archive to the other nodes.
+
+    This uses a fan-out approach so that the cost of building only occurs once.
+    Note that nodes need to be able to copy files from each other using ``scp``.
+
+    :param directory: remote directory for the binary archive
+    :type directory: str
+    :param includeDocumentation: include documentation (doc, html, info)
+    :type includeDocumentation: bool
+    :param includeManPages: include man pages
+    :type includeManPages: bool
+    :param version: version
+    :type version: str
+    """
+    def __init__(self, directory="/tmp/storm-thunder", includeDocumentation=False, includeManPages=True, version="2.11.0"):
+        super(ClusterInstall, self).__init__()
+        self.directory = directory
+        self.includeDocumentation = includeDocumentation
+        self.includeManPages = includeManPages
+        self.version = version
+
+    def run(self, nodes, clients, usePrivateIps):
+        """
+        Run cluster-wide deployment on speficied nodes
+
+        :param nodes: the nodes
+        :type nodes: [:class:`~libcloud.compute.base.Node` or :class:`~BaseNodeInfo`]
+        :param clients: node name to connected SSH client mapping
+        :type clients: dict
+        :param usePrivateIps: use private ip to connect to nodes instead of the public one
+        :type usePrivateIps: bool
+        :returns: nodes
+        :rtype: [:class:`~libcloud.compute.base.Node` or :class:`~BaseNodeInfo`]
+        """
+        # determine the nodes that still require an installation
+        requiredNodes = [
+            node
+            for node in nodes
+            if not isGitVersionInstalled(node, clients[node.name], self.version)
+        ]
+        if not requiredNodes:
+            return nodes
+
+        # build and install on the first node
+        buildNode = requiredNodes[0]
+        archive = os.path.join(self.directory, "git-{version}.tar.gz".format(version=self.version))
+        Install(
+            archive=archive,
+            includeDocumentation=self.includeDocumentation,
+            includeManPages=self.includeManPages,
+            version=self.version
+        ).run(buildNode, clients[buildNode.name], usePrivateIps)
+
+        # distribute archive from the build node to the remaining nodes
+        if len(requiredNodes) > 1:
+            deployments = [
+                RemoteCopy(buildNode.name, self.directory, archive),
+                InstallArchive(archive, version=self.version)
+            ]
+            results = deploy(deployments, requiredNodes[1:], usePrivateIps=usePrivateIps)
+            if results.numberOfErrors > 0:
+                raise DeploymentRunError(buildNode, results.toJSON(includeClassInfo=True, pretty=True))
+
+        return nodes
+
 @ClassLogger
 class Deploy(Deployment):
     """
     Deploy specified repository
 
+    In bundle mode the repository is fetched only once on the local host and
+    sent to the nodes as a git bundle over the existing connections. Existing
+    repositories on the nodes receive incremental bundles when updating.
+
     :param url: repository url
     :type url: str
     :param branch: branch
@@ -36,13 +140,20 @@ class Deploy(Deployment):
     :type force: bool
     :param tag: tag name
     :type tag: str
+    :param update: incrementally fetch and check out the branch or tag in an existing repository,
+        existing directories that are not repositories are an error unless ``force`` is set
+    :type update: bool
+    :param bundle: fetch once locally and deploy using git bundles instead of cloning on every node
+    :type bundle: bool
     """
-    def __init__(self, url, branch="master", credentialsFile=None, directory="~", force=False, tag=None):
+    def __init__(self, url, branch="master", credentialsFile=None, directory="~", force=False, tag=None, update=False, bundle=False):
         super(Deploy, self).__init__()
         self.branch = branch
+        self.bundle = bundle
         self.directory = directory
         self.force = force
         self.tag = tag
+        self.update = update
         self.url = url
         self.urlWithCredentials = None
         if credentialsFile:
@@ -72,15 +183,28 @@ class Deploy(Deployment):
             raise DeploymentRunError(node, "Could not determine base directory", status, stdout, stderr)
         baseDirectory = stdout.strip()
 
+        branch = self.tag if self.tag else self.branch
+        url = self.urlWithCredentials if self.urlWithCredentials else self.url
+
         if client.exists(baseDirectory):
             if self.force:
                 _, _, status = client.run("rm -rf {0}".format(baseDirectory))
+            elif self.update:
+                if isRepository(client, baseDirectory):
+                    if self.bundle:
+                        self.updateRepositoryFromBundle(node, client, baseDirectory)
+                    else:
+                        self.updateRepository(node, client, baseDirectory, url)
+                    return node
+                # never remove directories that are not repositories unless forced to
+                raise DeploymentRunError(node, "'{0}' is not a valid repository, use force to replace it".format(baseDirectory))
             else:
                 self.log.info("Repository '%s' is already deployed to '%s'", self.url, baseDirectory)
                 return node
 
-        branch = self.tag if self.tag else self.branch
-        url = self.urlWithCredentials if self.urlWithCredentials else self.url
+        if self.bundle:
+            self.cloneRepositoryFromBundle(node, client, baseDirectory)
+            return node
 
         stdout, stderr, status = client.run(
             "git clone --branch {branch} --depth 1 {url} {directory}".format(
@@ -110,6 +234,218 @@ class Deploy(Deployment):
 
         return node
 
+    def cloneRepositoryFromBundle(self, node, client, directory):
+        """
+        Clone the repository on the node from a bundle created on the local host
+
+        :param node: node
+        :type node: :class:`~libcloud.compute.base.Node` or :class:`~BaseNodeInfo`
+        :param client: connected SSH client
+        :type client: :class:`~libcloud.compute.ssh.BaseSSHClient`
+        :param directory: repository directory
+        :type directory: str
+        """
+        branch = self.tag if self.tag else self.branch
+        bundle = self.getBundle(node)
+
+        with RemoteTemporaryDirectory(client) as tmpDirectory:
+            remoteBundle = os.path.join(tmpDirectory, os.path.basename(bundle))
+            if not client.upload(bundle, remoteBundle):
+                raise DeploymentRunError(node, "Could not upload bundle '{0}'".format(bundle))
+
+            stdout, stderr, status = client.run(
+                "git clone --branch {branch} {bundle} {directory}".format(
+                    branch=branch,
+                    bundle=remoteBundle,
+                    directory=directory
+                )
+            )
+            if status != 0:
+                errorString = "Could not deploy '{branch}' of repository '{url}' to '{directory}'".format(
+                    branch=branch,
+                    url=self.url,
+                    directory=directory
+                )
+                raise DeploymentRunError(node, errorString, status, stdout, stderr)
+
+        # point the remote to the actual repository instead of the bundle
+        stdout, stderr, status = client.run(
+            "cd {directory} && git remote set-url origin {url}".format(
+                directory=directory,
+                url=self.url
+            )
+        )
+        if status != 0:
+            raise DeploymentRunError(node, "Could not reset repository remote url", status, stdout, stderr)
+
+    def getBundle(self, node, basis=None):
+        """
+        Get a local bundle for the branch or tag, creating it if necessary
+
+        :param node: node
+        :type node: :class:`~libcloud.compute.base.Node` or :class:`~BaseNodeInfo`
+        :param basis: commit that the node already has, used to create an incremental bundle
+        :type basis: str
+        :returns: bundle path or ``None`` if the node is already up to date
+        :rtype: str
+        """
+        repository, refName, commit = self.getLocalRepository(node)
+
+        with bundleLock:
+
+            # only create an incremental bundle if the basis is known locally
+            if basis:
+                if basis == commit:
+                    return None
+                try:
+                    runLocalGitCommand(node, repository, "cat-file", "-e", "{0}^{{commit}}".format(basis))
+                except DeploymentRunError:
+                    self.log.debug("'%s' is not known locally, creating full bundle", basis)
+                    basis = None
+
+            bundleDirectory = os.path.join(repository, "bundles")
+            if not os.path.isdir(bundleDirectory):
+                os.makedirs(bundleDirectory)
+            if basis:
+                bundle = os.path.join(bundleDirectory, "{0}-{1}.bundle".format(commit, basis))
+            else:
+                bundle = os.path.join(bundleDirectory, "{0}.bundle".format(commit))
+
+            if not os.path.exists(bundle):
+                arguments = ["bundle", "create", bundle + ".tmp", refName]
+                if basis:
+                    arguments.append("^{0}".format(basis))
+                runLocalGitCommand(node, repository, *arguments)
+                os.rename(bundle + ".tmp", bundle)
+                self.log.debug("Created bundle '%s'", bundle)
+
+        return bundle
+
+    def getLocalRepository(self, node):
+        """
+        Get the local repository for the url and fetch the branch or tag unless a fetch
+        finished after this request was made, such that the nodes of one deployment
+        share a fetch while subsequent deployments see new upstream commits
+
+        :param node: node
+        :type node: :class:`~libcloud.compute.base.Node` or :class:`~BaseNodeInfo`
+        :returns: local repository path, full reference name, commit
+        :rtype: (str, str, str)
+        """
+        refName = self.getRefName()
+        url = self.urlWithCredentials if self.urlWithCredentials else self.url
+        repository = os.path.join(
+            os.path.expanduser(LOCAL_REPOSITORY_CACHE_DIRECTORY),
+            "{0}.git".format(hashlib.sha1(self.url).hexdigest()))
+
+        requestTime = time.time()
+        with bundleLock:
+            key = (repository, refName)
+            if key not in fetchedLocalRepositories or fetchedLocalRepositories[key][1] < requestTime:
+                if not os.path.isdir(repository):
+                    os.makedirs(repository)
+                    runLocalGitCommand(node, repository, "init", "--bare")
+                self.log.info("Fetching '%s' of repository '%s'", refName, self.url)
+                runLocalGitCommand(node, repository, "fetch", "--force", url, "+{0}:{0}".format(refName))
+                commit = runLocalGitCommand(node, repository, "rev-parse", "{0}^{{commit}}".format(refName)).strip()
+
+                # remove old bundles of previous commits
+                bundleDirectory = os.path.join(repository, "bundles")
+                if os.path.isdir(bundleDirectory):
+                    for bundle in os.listdir(bundleDirectory):
+                        bundlePath = os.path.join(bundleDirectory, bundle)
+                        if not bundle.startswith(commit) and os.path.getmtime(bundlePath) < requestTime - BUNDLE_RETENTION_TIME:
+                            os.remove(bundlePath)
+
+                fetchedLocalRepositories[key] = (commit, time.time())
+
+            return repository, refName, fetchedLocalRepositories[key][0]
+
+    def getRefName(self):
+        """
+        Get the full reference name of the branch or tag
+
+        :returns: full reference name
+        :rtype: str
+        """
+        if self.tag:
+            return "refs/tags/{0}".format(self.tag)
+        return "refs/heads/{0}".format(self.branch)
+
+    def updateRepository(self, node, client, directory, url, ref=None, depth=1):
+        """
+        Update an existing repository by fetching only the changes for the branch
+        or tag and checking it out
+
+        :param node: node
+        :type node: :class:`~libcloud.compute.base.Node` or :class:`~BaseNodeInfo`
+        :param client: connected SSH client
+        :type client: :class:`~libcloud.compute.ssh.BaseSSHClient`
+        :param directory: repository directory
+        :type directory: str
+        :param url: url or path to fetch from
+        :type url: str
+        :param ref: reference to fetch, defaults to the branch or tag
+        :type ref: str
+        :param depth: fetch depth, ``None`` fetches all missing history
+        :type depth: int
+        """
+        branch = self.tag if self.tag else self.branch
+
+        # fetch directly from the url so that credentials are not stored in the remote configuration
+        stdout, stderr, status = client.run(
+            "cd {directory} && git fetch {depth}{url} {ref}".format(
+                directory=directory,
+                depth="--depth {0} ".format(depth) if depth else "",
+                url=url,
+                ref=ref or branch
+            )
+        )
+        if status != 0:
+            errorString = "Could not fetch '{branch}' of repository '{url}' into '{directory}'".format(
+                branch=branch,
+                url=self.url,
+                directory=directory
+            )
+            raise DeploymentRunError(node, errorString, status, stdout, stderr)
+
+        # tags are checked out as detached head the same way a clone would do it
+        if self.tag:
+            checkoutCommand = "cd {directory} && git checkout --force FETCH_HEAD"
+        else:
+            checkoutCommand = "cd {directory} && git checkout --force -B {branch} FETCH_HEAD"
+        stdout, stderr, status = client.run(checkoutCommand.format(directory=directory, branch=branch))
+        if status != 0:
+            raise DeploymentRunError(node, "Could not check out '{0}' in '{1}'".format(branch, directory), status, stdout, stderr)
+
+        self.log.info("Updated repository '%s' in '%s' to '%s'", self.url, directory, branch)
+
+    def updateRepositoryFromBundle(self, node, client, directory):
+        """
+        Update an existing repository on the node from an incremental bundle
+        created on the local host
+
+        :param node: node
+        :type node: :class:`~libcloud.compute.base.Node` or :class:`~BaseNodeInfo`
+        :param client: connected SSH client
+        :type client: :class:`~libcloud.compute.ssh.BaseSSHClient`
+        :param directory: repository directory
+        :type directory: str
+        """
+        stdout, _, status = client.run("cd {directory} && git rev-parse HEAD".format(directory=directory))
+        basis = stdout.strip() if status == 0 else None
+
+        bundle = self.getBundle(node, basis=basis)
+        if not bundle:
+            self.log.info("Repository '%s' in '%s' is already up to date", self.url, directory)
+            return
+
+        with RemoteTemporaryDirectory(client) as tmpDirectory:
+            remoteBundle = os.path.join(tmpDirectory, os.path.basename(bundle))
+            if not client.upload(bundle, remoteBundle):
+                raise DeploymentRunError(node, "Could not upload bundle '{0}'".format(bundle))
+            self.updateRepository(node, client, directory, remoteBundle, ref=self.getRefName(), depth=None)
+
 @ClassLogger
 class Install(Deployment):
     """
@@ -121,9 +457,13 @@ class Install(Deployment):
     :type includeManPages: bool
     :param version: version
     :type version: str
+    :param archive: remote path of an archive to create from the installed files
+        so that it can be distributed to other nodes using :class:`~InstallArchive`
+    :type archive: str
     """
-    def __init__(self, includeDocumentation=False, includeManPages=True, version="2.11.0"):
+    def __init__(self, includeDocumentation=False, includeManPages=True, version="2.11.0", archive=None):
         super(Install, self).__init__()
+        self.archive = archive
         self.includeDocumentation = includeDocumentation
         self.includeManPages = includeManPages
         self.version = version
@@ -141,34 +481,11 @@ class Install(Deployment):
         :returns: node
         :rtype: :class:`~libcloud.compute.base.Node` or :class:`~BaseNodeInfo`
         """
-        versionParts = self.version.split(".")
-        stdout, _, status = client.run("git --version")
-        if status == 0:
-            installedVersion = re.search(r"(?P<version>\d+\.\d+.+)", stdout).group("version")
-            installedVersionParts = installedVersion.split(".")
-
-            if installedVersionParts == versionParts:
-                self.log.info("Git version '%s' already installed", installedVersion)
-                return node
-
-            if installedVersionParts > versionParts:
-                self.log.info("Newer git version '%s' already installed", installedVersion)
-                return node
-
-            gitPackageName = "git-{version}".format(version=installedVersion)
-            if any(isRPMPackageInstalled(client, gitPackageName).values()):
-                raise DeploymentRunError(node, "Found existing git rpm package. Please uninstall first")
+        if not self.archive and isGitVersionInstalled(node, client, self.version):
+            return node
 
         self.log.debug("Installing prerequisite packages")
-        prerequisites = [
-            "expat-devel",
-            "gettext-devel",
-            "curl-devel",
-            "perl-devel",
-            "zlib-devel",
-            "openssl-devel"
-        ]
-        InstallRPMPackages(*prerequisites).run(node, client, usePrivateIps)
+        InstallRPMPackages(*BUILD_PREREQUISITES).run(node, client, usePrivateIps)
 
         if self.includeDocumentation:
             self.log.debug("Installing documentation prerequisite packages")
@@ -185,14 +502,32 @@ class Install(Deployment):
 
         with RemoteTemporaryDirectory(client) as tmpDirectory:
 
-            stdout, stderr, status = client.run(
+            # man pages are part of the documentation so only install if specifically requested and not already installed
+            installManPages = self.includeManPages and not self.includeDocumentation
+
+            # download source and man pages at the same time
+            downloadCommands = [
                 "wget --directory-prefix {directory} https://www.kernel.org/pub/software/scm/git/git-{version}.tar.gz".format(
                     directory=tmpDirectory,
                     version=self.version
                 )
-            )
+            ]
+            if installManPages:
+                downloadCommands.append(
+                    "wget --directory-prefix {directory}/manpages https://www.kernel.org/pub/software/scm/git/git-manpages-{version}.tar.gz".format(
+                        directory=tmpDirectory,
+                        version=self.version
+                    )
+                )
+            downloadResults = client.runMany(downloadCommands)
+
+            stdout, stderr, status = downloadResults[0]
             if status != 0:
                 raise DeploymentRunError(node, "Could not download version '{version}'".format(version=self.version), status=status, stdout=stdout, stderr=stderr)
+            if installManPages:
+                stdout, stderr, status = downloadResults[1]
+                if status != 0:
+                    raise DeploymentRunError(node, "Could not download man pages for '{version}'".format(version=self.version), status=status, stdout=stdout, stderr=stderr)
 
             stdout, stderr, status = client.run("cd {directory} && tar -zxf *.tar.gz --strip 1".format(directory=tmpDirectory))
             if status != 0:
@@ -210,38 +545,186 @@ class Install(Deployment):
                 buildCommand = "cd {directory} && make all doc man info".format(directory=tmpDirectory)
             else:
                 buildCommand = "cd {directory} && make all".format(directory=tmpDirectory)
-            stdout, stderr, status = client.run(buildCommand)
+            # the build takes a while so run it detached instead of keeping a channel open
+            stdout, stderr, status = client.startJob(buildCommand).wait()
             if status != 0:
                 if re.search(r"docbook2x-texi: command not found", stderr, re.MULTILINE):
                     self.log.warn("Could not build all of the documentation")
                 else:
                     raise DeploymentRunError(node, "Could not build git", status=status, stdout=stdout, stderr=stderr)
 
+            # when creating an archive install into a staging directory first
+            if self.archive:
+                stagingDirectory = os.path.join(tmpDirectory, "staging")
+                destination = "DESTDIR={0}".format(stagingDirectory)
+            else:
+                stagingDirectory = ""
+                destination = ""
+
             if self.includeDocumentation:
-                installCommand = "cd {directory} && make install install-doc install-man install-html install-info".format(directory=tmpDirectory)
+                installCommand = "cd {directory} && make {destination} install install-doc install-man install-html install-info".format(
+                    directory=tmpDirectory,
+                    destination=destination)
             else:
-                installCommand = "cd {directory} && make install".format(directory=tmpDirectory)
+                installCommand = "cd {directory} && make {destination} install".format(
+                    directory=tmpDirectory,
+                    destination=destination)
             stdout, stderr, status = client.run(installCommand)
             if status != 0:
                 raise DeploymentRunError(node, "Could not install git", status=status, stdout=stdout, stderr=stderr)
 
-            # man pages are part of the documentation so only install if specifically requested and not already installed
-            if self.includeManPages and not self.includeDocumentation:
+            if installManPages:
                 stdout, stderr, status = client.run(
-                    "wget --directory-prefix {directory} https://www.kernel.org/pub/software/scm/git/git-manpages-{version}.tar.gz".format(
+                    "mkdir -p {staging}/usr/local/share/man && cd {directory}/manpages && tar -zxf git-manpages-*.tar.gz -C {staging}/usr/local/share/man".format(
                         directory=tmpDirectory,
-                        version=self.version
+                        staging=stagingDirectory
                     )
                 )
                 if status != 0:
-                    raise DeploymentRunError(node, "Could not download man pages for '{version}'".format(version=self.version), status=status, stdout=stdout, stderr=stderr)
+                    raise DeploymentRunError(node, "Could not install man pages for '{version}'".format(version=self.version), status=status, stdout=stdout, stderr=stderr)
 
+            if self.archive:
                 stdout, stderr, status = client.run(
-                    "cd {directory} && tar -zxf git-manpages-*.tar.gz -C /usr/local/share/man".format(
-                        directory=tmpDirectory
+                    "mkdir -p {archiveDirectory} && tar -czf {archive} -C {staging} usr".format(
+                        archive=self.archive,
+                        archiveDirectory=os.path.dirname(self.archive),
+                        staging=stagingDirectory
                     )
                 )
                 if status != 0:
-                    raise DeploymentRunError(node, "Could not install man pages for '{version}'".format(version=self.version), status=status, stdout=stdout, stderr=stderr)
+                    raise DeploymentRunError(node, "Could not create archive '{0}'".format(self.archive), status=status, stdout=stdout, stderr=stderr)
+
+                InstallArchive(self.archive, version=self.version).run(node, client, usePrivateIps)
+
+        return node
+
+@ClassLogger
+class InstallArchive(Deployment):
+    """
+    Install git from an archive created by :class:`~Install` on a node with
+    the same operating system release
+
+    :param archive: remote path of the archive
+    :type archive: str
+    :param version: version
+    :type version: str
+    """
+    def __init__(self, archive, version="2.11.0"):
+        super(InstallArchive, self).__init__()
+        self.archive = archive
+        self.version = version
+
+    def run(self, node, client, usePrivateIps):
+        """
+        Runs this deployment task on node using the client provided.
+
+        :param node: node
+        :type node: :class:`~libcloud.compute.base.Node` or :class:`~BaseNodeInfo`
+        :param client: connected SSH client
+        :type client: :class:`~libcloud.compute.ssh.BaseSSHClient`
+        :param usePrivateIps: use private ip to connect to nodes instead of the public one
+        :type usePrivateIps: bool
+        :returns: node
+        :rtype: :class:`~libcloud.compute.base.Node` or :class:`~BaseNodeInfo`
+        """
+        if isGitVersionInstalled(node, client, self.version):
+            return node
+
+        self.log.debug("Installing runtime prerequisite packages")
+        InstallRPMPackages(*RUNTIME_PREREQUISITES).run(node, client, usePrivateIps)
+
+        # keep ownership and permissions of existing directories such as /usr intact
+        stdout, stderr, status = client.run("tar -xzf {archive} --no-overwrite-dir -C /".format(archive=self.archive))
+        if status != 0:
+            raise DeploymentRunError(node, "Could not extract archive '{0}'".format(self.archive), status=status, stdout=stdout, stderr=stderr)
 
         return node
+
+def getInstalledGitVersion(client):
+    """
+    Get the installed git version
+
+    :param client: connected SSH client
+    :type client: :class:`~libcloud.compute.ssh.BaseSSHClient`
+    :returns: version or ``None`` if git is not installed
+    :rtype: str
+    """
+    stdout, _, status = client.run("git --version")
+    if status != 0:
+        return None
+    match = re.search(r"(?P<version>\d+\.\d+.+)", stdout)
+    if not match:
+        return None
+    return match.group("version").strip()
+
+def isGitVersionInstalled(node, client, version):
+    """
+    Determine if the specified or a newer git version is already installed
+
+    :param node: node
+    :type node: :class:`~libcloud.compute.base.Node` or :class:`~BaseNodeInfo`
+    :param client: connected SSH client
+    :type client: :class:`~libcloud.compute.ssh.BaseSSHClient`
+    :param version: version
+    :type version: str
+    :returns: bool
+    :raises DeploymentRunError: if an older git version is installed from an rpm package
+    """
+    installedVersion = getInstalledGitVersion(client)
+    if not installedVersion:
+        return False
+
+    versionParts = version.split(".")
+    installedVersionParts = installedVersion.split(".")
+
+    if installedVersionParts == versionParts:
+        log.info("Git version '%s' already installed", installedVersion)
+        return True
+
+    if installedVersionParts > versionParts:
+        log.info("Newer git version '%s' already installed", installedVersion)
+        return True
+
+    gitPackageName = "git-{version}".format(version=installedVersion)
+    if any(isRPMPackageInstalled(client, gitPackageName).values()):
+        raise DeploymentRunError(node, "Found existing git rpm package. Please uninstall first")
+
+    return False
+
+def isRepository(client, directory):
+    """
+    Determine if the specified directory is the top level directory of a valid repository
+
+    :param client: connected SSH client
+    :type client: :class:`~libcloud.compute.ssh.BaseSSHClient`
+    :param directory: directory
+    :type directory: str
+    :returns: bool
+    """
+    # the path from the directory to the top level directory is empty at the top level,
+    # which unlike comparing paths also works for directories reached through symbolic links
+    stdout, _, status = client.run("cd {directory} && git rev-parse --show-cdup".format(directory=directory))
+    if status != 0:
+        return False
+    return stdout.strip() == ""
+
+def runLocalGitCommand(node, repository, *arguments):
+    """
+    Run git command on the local host against the specified repository
+
+    :param node: node on whose behalf the command is run
+    :type node: :class:`~libcloud.compute.base.Node` or :class:`~BaseNodeInfo`
+    :param repository: local bare repository path
+    :type repository: str
+    :param arguments: git arguments
+    :type arguments: [str]
+    :returns: standard output
+    :rtype: str
+    :raises DeploymentRunError: if the command failed
+    """
+    command = ["git", "--git-dir", repository] + list(arguments)
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    stdout, stderr = process.communicate()
+    if process.returncode != 0:
+        raise DeploymentRunError(node, "Could not run local '{0}'".format(" ".join(arguments[:2])), process.returncode, stdout, stderr)
+    return stdout
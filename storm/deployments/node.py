@@ -6,19 +6,46 @@ This project is licensed under the MIT License, see LICENSE
 Common deployments and utility functions for node information
 """
 import collections
+import datetime
 import logging
+from multiprocessing.dummy import Pool as ThreadPool
+import pipes
 import re
 
 from c4.utils.logutil import ClassLogger
 
-from ..thunder import (Deployment,
-                       DeploymentRunError)
+from ..thunder import (ClusterDeployment,
+                       Deployment, DeploymentErrorResult, DeploymentResult, DeploymentRunError,
+                       getEnsureLineCommand,
+                       waitForReconnect)
+from ..thunder.client import quotePath
+from ..thunder.transfer import (CollectionArchive,
+                                collectFiles)
 
 
 log = logging.getLogger(__name__)
 
 OperatingSystemInformation = collections.namedtuple("OperatingSystemInformation", ["name", "release", "releaseType"])
 
+# exits successfully if a PATH assignment in the file already contains the path
+PATH_IN_PROFILE_AWK_PROGRAM = r"""
+BEGIN { path = ENVIRON["STORM_PATH"] }
+/^[ \t]*#/ { next }
+/PATH=/ {
+    value = $0
+    sub(/.*PATH=/, "", value)
+    gsub(/["\047{}]/, "", value)
+    sub(/[ \t;].*/, "", value)
+    numberOfPaths = split(value, paths, ":")
+    for (i = 1; i <= numberOfPaths; i++) {
+        if (paths[i] == path) {
+            found = 1
+        }
+    }
+}
+END { exit !found }
+"""
+
 @ClassLogger
 class AddPathsToBashProfile(Deployment):
     """
@@ -33,6 +60,24 @@ class AddPathsToBashProfile(Deployment):
         self.profilePath = profilePath
         self.paths = paths
 
+    def buildScript(self, node, builder):
+        """
+        Add the commands of this deployment to the script builder
+
+        :param node: node
+        :type node: :class:`~libcloud.compute.base.Node` or :class:`~BaseNodeInfo`
+        :param builder: script builder
+        :type builder: :class:`~storm.thunder.script.ScriptBuilder`
+        """
+        for path in self.paths:
+            builder.addCommand("ls {0}".format(path), "'{0}' is not a valid path".format(path))
+        for path in self.paths:
+            builder.addCommand("{0} || {{ {1}; }}".format(
+                                   getPathInProfileCommand(self.profilePath, path, builder=builder),
+                                   getEnsureLineCommand(self.profilePath, "export PATH=$PATH:{0}".format(path), builder=builder)),
+                               "Unable to add '{0}' to {1} file".format(path, self.profilePath))
+        builder.addCommand(". {0}".format(self.profilePath), "Unable to source {0} file".format(self.profilePath))
+
     def run(self, node, client, usePrivateIps):
         """
         Runs this deployment task on node using the client provided.
@@ -52,32 +97,115 @@ class AddPathsToBashProfile(Deployment):
             if status != 0:
                 raise DeploymentRunError(node, "'{0}' is not a valid path".format(path), status, stdout, stderr)
 
-        # determine profile path and content
+        # determine profile path
         stdout, stderr, status = client.run("echo {0}".format(self.profilePath))
         fullProfilePath = stdout.strip()
-        profile = client.read(fullProfilePath)
-
-        # check for PATH and adjust accordingly
-        match = re.search(r"(?P<path>PATH=(?P<existingPaths>.*)$)", profile, re.MULTILINE)
-        if match:
-            existingPathVariable = match.group("path")
-            paths = match.group("existingPaths").split(":")
-            for newPath in self.paths:
-                if newPath in paths:
-                    self.log.debug("'%s' already in PATH variable", newPath)
-                else:
-                    paths.append(newPath)
-            newPathVariable = "PATH={0}".format(":".join(paths))
-            profile = profile.replace(existingPathVariable, newPathVariable)
-        else:
-            self.log.debug("Adding PATH to profile")
-            profile += "\nPATH=$PATH:{0}\nexport PATH\n".format(":".join(self.paths))
-        client.put(fullProfilePath, contents=profile)
+
+        # add a line for each path that is not in the profile yet
+        for path in self.paths:
+            _, _, status = client.run(getPathInProfileCommand(fullProfilePath, path))
+            if status != 0 and client.ensureLine(fullProfilePath, "export PATH=$PATH:{0}".format(path)):
+                self.log.debug("Added '%s' to PATH", path)
+            else:
+                self.log.debug("'%s' already in PATH variable", path)
 
         stdout, stderr, status = client.run(". {0}".format(fullProfilePath))
         if status != 0:
             raise DeploymentRunError(node, "Unable to source {0} file".format(fullProfilePath), status, stdout, stderr)
 
+@ClassLogger
+class CollectFiles(ClusterDeployment):
+    """
+    Collect files such as logs from all nodes in parallel into a local tar archive
+    with a directory per node. Files with the same content on multiple nodes are
+    only stored once.
+
+    :param archive: local archive file name, compressed if it ends with ``.gz`` or ``.tgz``
+    :type archive: str
+    :param patterns: remote glob patterns of files and directories to collect
+    :type patterns: [str]
+    :param numberOfParallelCollections: number of nodes to collect from at the same time
+    :type numberOfParallelCollections: int
+    """
+    def __init__(self, archive, patterns, numberOfParallelCollections=10):
+        super(CollectFiles, self).__init__()
+        self.archive = archive
+        self.numberOfParallelCollections = numberOfParallelCollections
+        self.patterns = patterns
+
+    def run(self, nodes, clients, usePrivateIps):
+        """
+        Run cluster-wide deployment on speficied nodes
+
+        :param nodes: the nodes
+        :type nodes: [:class:`~libcloud.compute.base.Node` or :class:`~BaseNodeInfo`]
+        :param clients: node name to connected SSH client mapping
+        :type clients: dict
+        :param usePrivateIps: use private ip to connect to nodes instead of the public one
+        :type usePrivateIps: bool
+        :returns: deployment result per node
+        :rtype: [:class:`~storm.thunder.base.DeploymentResult`]
+        """
+        def collect(node):
+            """
+            Collect the files of the node into the archive
+            """
+            start = datetime.datetime.utcnow()
+            try:
+                statistics = collectFiles(clients[node.name], self.patterns, archive, node.name)
+                if statistics["errors"]:
+                    raise DeploymentRunError(node, "Could not collect all files", stderr="\n".join(statistics["errors"]))
+                return DeploymentResult(self, node, start, datetime.datetime.utcnow())
+            except Exception as exception:
+                self.log.error("Could not collect files from '%s': %s", node.name, exception)
+                return DeploymentErrorResult(self, node, start, datetime.datetime.utcnow(), exception)
+
+        with CollectionArchive(self.archive) as archive:
+            pool = ThreadPool(processes=max(1, min(self.numberOfParallelCollections, len(nodes))))
+            try:
+                results = pool.map(collect, nodes)
+            finally:
+                pool.close()
+                pool.join()
+            self.log.info("Collected files from %d nodes into '%s', %d bytes of duplicate content stored as links",
+                          len(nodes), self.archive, archive.duplicateSize)
+        return results
+
+@ClassLogger
+class Reboot(ClusterDeployment):
+    """
+    Reboot nodes in waves and reconnect their clients as soon as the nodes are
+    back up such that subsequent deployments can continue on them
+
+    :param timeout: timeout in seconds for the nodes of a wave to come back up
+    :type timeout: int
+    :param waveSize: number of nodes to reboot at the same time
+    :type waveSize: int
+    """
+    def __init__(self, timeout=600, waveSize=10):
+        super(Reboot, self).__init__()
+        self.timeout = timeout
+        self.waveSize = waveSize
+
+    def run(self, nodes, clients, usePrivateIps):
+        """
+        Run cluster-wide deployment on speficied nodes
+
+        :param nodes: the nodes
+        :type nodes: [:class:`~libcloud.compute.base.Node` or :class:`~BaseNodeInfo`]
+        :param clients: node name to connected SSH client mapping
+        :type clients: dict
+        :param usePrivateIps: use private ip to connect to nodes instead of the public one
+        :type usePrivateIps: bool
+        :returns: nodes
+        :rtype: [:class:`~libcloud.compute.base.Node` or :class:`~BaseNodeInfo`]
+        """
+        for start in range(0, len(nodes), self.waveSize):
+            wave = nodes[start:start + self.waveSize]
+            self.log.info("Rebooting '%s'", ",".join(node.name for node in wave))
+            rebootNodes(wave, clients, timeout=self.timeout)
+        return nodes
+
 @ClassLogger
 class SetKernelParameters(Deployment):
     """
@@ -87,6 +215,25 @@ class SetKernelParameters(Deployment):
         super(SetKernelParameters, self).__init__()
         self.parameters = parameters
 
+    def buildScript(self, node, builder):
+        """
+        Add the commands of this deployment to the script builder
+
+        :param node: node
+        :type node: :class:`~libcloud.compute.base.Node` or :class:`~BaseNodeInfo`
+        :param builder: script builder
+        :type builder: :class:`~storm.thunder.script.ScriptBuilder`
+        """
+        # only reload the kernel parameters if any of them changed
+        modifiedFileName = builder.getStateFileName("modified")
+        for name, value in sorted(self.parameters.items()):
+            command = getEnsureLineCommand("/etc/sysctl.conf", "{0} = {1}".format(name, value), key=name, builder=builder)
+            builder.addCommand('output=$({0}) && echo "$output" && if [ "$output" = changed ]; then touch {1}; fi'.format(command, modifiedFileName),
+                               "Could not set kernel parameter '{0}'".format(name))
+        if self.parameters:
+            builder.addCommand("if [ -e {0} ]; then sysctl -p; fi".format(modifiedFileName),
+                               "Could reload the kernel parameters", ignoreStderrContaining="is an unknown key")
+
     def run(self, node, client, usePrivateIps):
         """
         Runs this deployment task on node using the client provided.
@@ -101,28 +248,14 @@ class SetKernelParameters(Deployment):
         :rtype: :class:`~libcloud.compute.base.Node` or :class:`~BaseNodeInfo`
         """
         modified = False
-        config = client.read("/etc/sysctl.conf")
         for name, value in sorted(self.parameters.items()):
-
-            match = re.search(r"{name}\s*=\s*(?P<value>.*)".format(name=name), config, re.MULTILINE)
-            if match:
-                if match.group("value") == str(value):
-                    self.log.debug("sysctl.conf already contains value '%s' for parameter '%s'", match.group("value"), name)
-                else:
-                    self.log.debug("Setting value '%s' for parameter '%s'", value, name)
-                    config = re.sub(
-                        r"{name}\s*=\s*(?P<value>.*)".format(name=name),
-                        "{name} = {value}".format(name=name, value=value),
-                        config,
-                        flags=re.MULTILINE)
-                    modified = True
-            else:
-                self.log.debug("Adding value '%s' for parameter '%s' to sysctl.conf", value, name)
-                config = "\n".join([config, "{name} = {value}".format(name=name, value=value)])
+            if client.setKeyValue("/etc/sysctl.conf", name, value):
+                self.log.debug("Setting value '%s' for parameter '%s'", value, name)
                 modified = True
+            else:
+                self.log.debug("sysctl.conf already contains value '%s' for parameter '%s'", value, name)
 
         if modified:
-            client.put("/etc/sysctl.conf", contents=config)
             stdout, stderr, status = client.run("sysctl -p")
             if status != 0:
                 unknownParameters = re.findall(r"error: \"([^\"]+)\" is an unknown key", stderr, re.MULTILINE)
@@ -133,6 +266,21 @@ class SetKernelParameters(Deployment):
 
         return node
 
+def getBootId(client):
+    """
+    Get the boot id which changes with every boot of the node
+
+    :param client: connected SSH client
+    :type client: :class:`~libcloud.compute.ssh.BaseSSHClient`
+    :returns: boot id
+    :rtype: str
+    """
+    stdout, stderr, status = client.run("cat /proc/sys/kernel/random/boot_id")
+    if status != 0:
+        log.error(stderr)
+        return None
+    return stdout.strip()
+
 def getKernelRelease(client):
     """
     Get kernel release as a string.
@@ -167,3 +315,102 @@ def getOperatingSystemInformation(client):
     info = OperatingSystemInformation(match.group("name"), match.group("release"), match.group("releaseType"))
     log.debug(info)
     return info
+
+def getPathInProfileCommand(profilePath, path, builder=None):
+    """
+    Get shell command that succeeds if a ``PATH`` assignment in the profile already contains the path
+
+    :param profilePath: profile path, a leading ``~/`` refers to the home directory
+    :type profilePath: str
+    :param path: path
+    :type path: str
+    :param builder: optional script builder that defines the awk program once in its script header
+    :type builder: :class:`~storm.thunder.script.ScriptBuilder`
+    :returns: command
+    :rtype: str
+    """
+    if builder:
+        program = builder.addDefinition("STORM_PATH_IN_PROFILE_AWK_PROGRAM", PATH_IN_PROFILE_AWK_PROGRAM)
+    else:
+        program = pipes.quote(PATH_IN_PROFILE_AWK_PROGRAM)
+    return "STORM_PATH={0} awk {1} {2} 2>/dev/null".format(pipes.quote(path), program, quotePath(profilePath))
+
+def rebootNodes(nodes, clients, timeout=600):
+    """
+    Reboot the specified nodes at the same time and reconnect their clients
+    as soon as the nodes are back up. Nodes that could not be rebooted are
+    reported after all others have been reconnected.
+
+    :param nodes: the nodes
+    :type nodes: [:class:`~libcloud.compute.base.Node` or :class:`~BaseNodeInfo`]
+    :param clients: node name to connected SSH client mapping
+    :type clients: dict
+    :param timeout: timeout in seconds for the nodes to come back up
+    :type timeout: int
+    :raises DeploymentRunError: if nodes could not be rebooted
+    """
+    if not nodes:
+        return
+
+    def reboot(node):
+        """
+        Reboot node in the background such that the command itself returns
+
+        :param node: node
+        :type node: :class:`~libcloud.compute.base.Node` or :class:`~BaseNodeInfo`
+        :returns: boot id before the reboot
+        :rtype: str
+        """
+        client = clients[node.name]
+        bootId = getBootId(client)
+        stdout, stderr, status = client.run("nohup sh -c 'sleep 2; /sbin/reboot' > /dev/null 2>&1 &")
+        if status != 0:
+            raise DeploymentRunError(node, "Error while rebooting", status, stdout, stderr)
+        client.close()
+        return bootId
+
+    def tryReboot(node):
+        """
+        Reboot node and keep the error such that the other nodes are still waited for
+        """
+        try:
+            return reboot(node), None
+        except Exception as exception:
+            log.error("Could not reboot '%s': %s", node.name, exception)
+            return None, exception
+
+    pool = ThreadPool(processes=len(nodes))
+    try:
+        rebootResults = pool.map(tryReboot, nodes)
+    finally:
+        pool.close()
+        pool.join()
+    bootIds = {
+        node.name: bootId
+        for node, (bootId, error) in zip(nodes, rebootResults)
+        if error is None
+    }
+    errors = {
+        node.name: error
+        for node, (bootId, error) in zip(nodes, rebootResults)
+        if error is not None
+    }
+
+    def verify(name, client):
+        """
+        Make sure the node actually rebooted
+        """
+        return getBootId(client) != bootIds[name]
+
+    failed = []
+    if bootIds:
+        failed = waitForReconnect(
+            {name: clients[name] for name in bootIds},
+            timeout=timeout,
+            verify=verify,
+            delay=5)
+    if errors or failed:
+        failedNames = sorted(set(errors.keys()) | set(failed))
+        failedNode = [node for node in nodes if node.name == failedNames[0]][0]
+        raise DeploymentRunError(failedNode, "Unable to reboot '{0}'".format(",".join(failedNames)),
+                                 stderr="\n".join("{0}: {1}".format(name, error) for name, error in sorted(errors.items())) or None)
@@ -7,7 +7,9 @@ Software related deployments
 """
 import glob
 import logging
+from multiprocessing.dummy import Pool as ThreadPool
 import os
+import pipes
 import re
 
 from c4.utils.logutil import ClassLogger
@@ -15,8 +17,13 @@ from c4.utils.logutil import ClassLogger
 from ..thunder import (ClusterDeployment,
                        Deployment,
                        DeploymentRunError,
-                       RemoteTemporaryDirectory,
-                       deploy)
+                       RemoteArtifactCache, RemoteTemporaryDirectory,
+                       deploy,
+                       syncDirectory)
+from .node import rebootNodes
+
+PYTHON_PACKAGE_FILE_NAME_REGEX = re.compile(r"(?P<name>.+?)-(?P<version>\d[^-]*?)(-.+)?\.(whl|egg|tar\.gz|tar\.bz2|tgz|zip)$")
+YUM_MIRROR_ERROR = "[Errno 256] No more mirrors to try."
 
 
 log = logging.getLogger(__name__)
@@ -79,18 +86,73 @@ class ClusterDeployToDirectory(ClusterDeployment):
 
         return nodes
 
+@ClassLogger
+class ClusterUpdateKernel(ClusterDeployment):
+    """
+    Update kernel on nodes in waves and reboot the nodes of a wave together
+
+    Rebooted nodes are watched by a single readiness prober and their clients are
+    reconnected as soon as they are back up such that subsequent deployments can continue
+
+    :param timeout: timeout in seconds for the nodes of a wave to come back up
+    :type timeout: int
+    :param waveSize: number of nodes to update and reboot at the same time
+    :type waveSize: int
+    """
+    def __init__(self, timeout=600, waveSize=10):
+        super(ClusterUpdateKernel, self).__init__()
+        self.timeout = timeout
+        self.waveSize = waveSize
+
+    def run(self, nodes, clients, usePrivateIps):
+        """
+        Run cluster-wide deployment on speficied nodes
+
+        :param nodes: the nodes
+        :type nodes: [:class:`~libcloud.compute.base.Node` or :class:`~BaseNodeInfo`]
+        :param clients: node name to connected SSH client mapping
+        :type clients: dict
+        :param usePrivateIps: use private ip to connect to nodes instead of the public one
+        :type usePrivateIps: bool
+        :returns: nodes
+        :rtype: [:class:`~libcloud.compute.base.Node` or :class:`~BaseNodeInfo`]
+        """
+        pool = ThreadPool(processes=min(self.waveSize, len(nodes)))
+        try:
+            for start in range(0, len(nodes), self.waveSize):
+                wave = nodes[start:start + self.waveSize]
+                updated = pool.map(lambda node: updateKernel(node, clients[node.name]), wave)
+                rebootRequired = [
+                    node
+                    for node, nodeUpdated in zip(wave, updated)
+                    if nodeUpdated
+                ]
+                if rebootRequired:
+                    self.log.info("Rebooting '%s' to get the updated kernel", ",".join(node.name for node in rebootRequired))
+                    rebootNodes(rebootRequired, clients, timeout=self.timeout)
+        finally:
+            pool.close()
+            pool.join()
+
+        return nodes
+
 @ClassLogger
 class DeployPythonPackages(Deployment):
     """
     Upload and install Python package
 
+    Packages whose exact version is already installed are skipped unless ``force`` is specified
+
     :param packages: the paths to packages
     :type packages: [str]
     :param pip: path to pip to use
     :type pip: str
+    :param force: upload and reinstall all packages regardless of the installed versions
+    :type force: bool
     """
-    def __init__(self, packages, pip="/usr/bin/pip"):
+    def __init__(self, packages, pip="/usr/bin/pip", force=False):
         super(DeployPythonPackages, self).__init__()
+        self.force = force
         self.packages = [
             packagePath.strip()
             for packagePath in packages
@@ -110,22 +172,58 @@ class DeployPythonPackages(Deployment):
         :returns: node
         :rtype: :class:`~libcloud.compute.base.Node` or :class:`~BaseNodeInfo`
         """
+        if self.force:
+            packages = self.packages
+        else:
+            installedPackages = getInstalledPythonPackages(client, pip=self.pip)
+            packages = []
+            for packagePath in self.packages:
+                try:
+                    name, version = getPythonPackageInfo(packagePath)
+                except ValueError:
+                    self.log.info("Skipping the version check of '%s' because its file name has no version", packagePath)
+                    packages.append(packagePath)
+                    continue
+                if installedPackages.get(name) == version:
+                    self.log.debug("Python package '%s' version '%s' already installed", name, version)
+                else:
+                    packages.append(packagePath)
+
+            if not packages:
+                self.log.info("All Python packages already installed")
+                return node
 
         with RemoteTemporaryDirectory(client) as tmpDirectory:
 
-            # upload packages
-            uploadedPackages = [
-                re.sub(r"-\d.*", r"", os.path.basename(packageName))
-                for packageName in client.upload(self.packages, tmpDirectory)
-            ]
-            if len(uploadedPackages) != len(self.packages):
-                raise DeploymentRunError(node, "Could not deploy Python packages")
+            # materialize packages from the artifact cache, uploading only the missing ones
+            try:
+                uploadedPackages = RemoteArtifactCache(client).materialize(packages, tmpDirectory)
+            except Exception as exception:
+                raise DeploymentRunError(node, "Could not deploy Python packages: {0}".format(exception))
 
             # install uploaded packages
-            stdout, stderr, status = client.run("{pip} install --upgrade --force-reinstall --pre --no-index --find-links {tmpDirectory} {packages}".format(
-                pip=self.pip,
-                tmpDirectory=tmpDirectory,
-                packages=" ".join(uploadedPackages)))
+            if self.force:
+                command = "{pip} install --upgrade --force-reinstall --pre --no-index --find-links {tmpDirectory} {packages}".format(
+                    pip=self.pip,
+                    tmpDirectory=tmpDirectory,
+                    packages=" ".join(
+                        re.sub(r"-\d.*", r"", os.path.basename(packageName))
+                        for packageName in uploadedPackages
+                    ))
+            else:
+                # pin the exact versions so that changed packages can also be downgraded,
+                # packages without a version in their file name are installed from their file
+                requirements = []
+                for packageName in uploadedPackages:
+                    try:
+                        requirements.append("{0}=={1}".format(*getPythonPackageInfo(packageName)))
+                    except ValueError:
+                        requirements.append(packageName)
+                command = "{pip} install --upgrade --pre --no-index --find-links {tmpDirectory} {packages}".format(
+                    pip=self.pip,
+                    tmpDirectory=tmpDirectory,
+                    packages=" ".join(requirements))
+            stdout, stderr, status = client.run(command)
             if status != 0:
                 raise DeploymentRunError(node, "Could not deploy Python packages", status, stdout, stderr)
 
@@ -175,7 +273,7 @@ class InstallLocalRPMPackages(Deployment):
         # upload and install the missing packages
         with RemoteTemporaryDirectory(client) as tmpDirectory:
             uploadToDirectory = UploadToDirectory(tmpDirectory, *missingRPMs)
-            uploadToDirectory.run(node, client)
+            uploadToDirectory.run(node, client, usePrivateIps=usePrivateIps)
             InstallRPMPackages(*uploadToDirectory.remoteFileNames).run(node, client, usePrivateIps=usePrivateIps)
 
         return node
@@ -192,6 +290,20 @@ class InstallRPMPackages(Deployment):
         super(InstallRPMPackages, self).__init__()
         self.rpms = rpms
 
+    def buildScript(self, node, builder):
+        """
+        Add the commands of this deployment to the script builder
+
+        :param node: node
+        :type node: :class:`~libcloud.compute.base.Node` or :class:`~BaseNodeInfo`
+        :param builder: script builder
+        :type builder: :class:`~storm.thunder.script.ScriptBuilder`
+        """
+        if self.rpms:
+            builder.addCommand(getYumCommand("install --assumeyes {0}".format(" ".join(self.rpms)), builder),
+                               "Could not yum install '{0}' packages.".format(",".join(self.rpms)),
+                               ignoreStderrContaining="Nothing to do")
+
     def run(self, node, client, usePrivateIps):
         """
         Runs this deployment task on node using the client provided.
@@ -209,7 +321,7 @@ class InstallRPMPackages(Deployment):
             return node
         for attempt in range(3):
             stdout, stderr, status = client.run("yum install --assumeyes {0}".format(" ".join(self.rpms)))
-            if status != 0 and "[Errno 256] No more mirrors to try." in stderr:
+            if status != 0 and YUM_MIRROR_ERROR in stderr:
                 self.log.debug("Encountered yum cache mirror problem in attempt %d", attempt+1)
                 client.run("yum clean all")
             else:
@@ -286,6 +398,19 @@ class RemoveRPMPackages(Deployment):
         super(RemoveRPMPackages, self).__init__()
         self.rpms = rpms
 
+    def buildScript(self, node, builder):
+        """
+        Add the commands of this deployment to the script builder
+
+        :param node: node
+        :type node: :class:`~libcloud.compute.base.Node` or :class:`~BaseNodeInfo`
+        :param builder: script builder
+        :type builder: :class:`~storm.thunder.script.ScriptBuilder`
+        """
+        if self.rpms:
+            builder.addCommand(getYumCommand("erase --assumeyes {0}".format(" ".join(self.rpms)), builder),
+                               "Could not yum erase '{0}' packages.".format(",".join(self.rpms)))
+
     def run(self, node, client, usePrivateIps):
         """
         Runs this deployment task on node using the client provided.
@@ -303,7 +428,7 @@ class RemoveRPMPackages(Deployment):
             return node
         for attempt in range(3):
             stdout, stderr, status = client.run("yum erase --assumeyes {0}".format(" ".join(self.rpms)))
-            if status != 0 and "[Errno 256] No more mirrors to try." in stderr:
+            if status != 0 and YUM_MIRROR_ERROR in stderr:
                 self.log.debug("Encountered yum cache mirror problem in attempt %d", attempt+1)
                 client.run("yum clean all")
             else:
@@ -315,6 +440,46 @@ class RemoveRPMPackages(Deployment):
 
         return node
 
+@ClassLogger
+class SyncDirectory(Deployment):
+    """
+    Synchronize a local directory tree to the node, only transferring added or changed files
+
+    :param localDirectory: local directory
+    :type localDirectory: str
+    :param remoteDirectory: remote directory
+    :type remoteDirectory: str
+    :param delete: delete remote files that do not exist in the local directory
+    :type delete: bool
+    """
+    def __init__(self, localDirectory, remoteDirectory, delete=False):
+        super(SyncDirectory, self).__init__()
+        if not os.path.isdir(localDirectory):
+            raise ValueError("'{0}' is an invalid directory".format(localDirectory))
+        self.localDirectory = localDirectory
+        self.remoteDirectory = remoteDirectory
+        self.delete = delete
+
+    def run(self, node, client, usePrivateIps):
+        """
+        Runs this deployment task on node using the client provided.
+
+        :param node: node
+        :type node: :class:`~libcloud.compute.base.Node` or :class:`~BaseNodeInfo`
+        :param client: connected SSH client
+        :type client: :class:`~libcloud.compute.ssh.BaseSSHClient`
+        :param usePrivateIps: use private ip to connect to nodes instead of the public one
+        :type usePrivateIps: bool
+        :returns: node
+        :rtype: :class:`~libcloud.compute.base.Node` or :class:`~BaseNodeInfo`
+        """
+        try:
+            syncDirectory(client, self.localDirectory, self.remoteDirectory, delete=self.delete)
+        except RuntimeError as exception:
+            raise DeploymentRunError(node, "Could not synchronize '{0}' to '{1}': {2}".format(
+                self.localDirectory, self.remoteDirectory, exception))
+        return node
+
 @ClassLogger
 class UpdateLocalRPMPackages(Deployment):
     """
@@ -376,7 +541,7 @@ class UpdateRPMPackages(Deployment):
             return node
         for attempt in range(3):
             stdout, stderr, status = client.run("yum update --assumeyes {0}".format(" ".join(self.rpms)))
-            if status != 0 and "[Errno 256] No more mirrors to try." in stderr:
+            if status != 0 and YUM_MIRROR_ERROR in stderr:
                 self.log.debug("Encountered yum cache mirror problem in attempt %d", attempt+1)
                 client.run("yum clean all")
             else:
@@ -413,13 +578,7 @@ class UpdateKernel(Deployment):
         :rtype: :class:`~libcloud.compute.base.Node` or :class:`~BaseNodeInfo`
         """
 
-        ## update kernel
-        stdout, stderr, status = client.run("/usr/bin/yum update kernel --assumeyes")
-        if status != 0:
-            raise DeploymentRunError(
-                node, "Could not update kernel", status, stdout, stderr)
-
-        if "No Packages marked for Update" in stdout:
+        if not updateKernel(node, client):
             return node
 
         ## reboot node to get the updated kernel
@@ -432,6 +591,13 @@ class UpdateKernel(Deployment):
             raise DeploymentRunError(
                 node, "Unable to reboot the system")
 
+        # the old connection does not survive the reboot
+        try:
+            client.reconnect()
+        except Exception as exception:
+            raise DeploymentRunError(
+                node, "Unable to reconnect after reboot: {0}".format(exception))
+
         return node
 
 @ClassLogger
@@ -474,18 +640,81 @@ class UploadToDirectory(Deployment):
         """
         if not self.fileNames:
             return node
-        client.mkdir(self.directory)
-        self.remoteFileNames = []
+        fileNames = []
         for fileName in self.fileNames:
-            remoteFileName = os.path.join(self.directory, os.path.basename(fileName))
-            if client.isFile(remoteFileName):
+            if client.isFile(os.path.join(self.directory, os.path.basename(fileName))):
                 self.log.debug("'%s' already uploaded", fileName)
             else:
-                if not client.upload(fileName.strip(), remoteFileName):
-                    raise DeploymentRunError(node, "Could not upload '{0}'".format(fileName))
-                self.remoteFileNames.append(remoteFileName)
+                fileNames.append(fileName.strip())
+        if not fileNames:
+            return node
+        # files are only uploaded if their content is not in the artifact cache of the node yet
+        try:
+            self.remoteFileNames = RemoteArtifactCache(client).materialize(fileNames, self.directory)
+        except Exception as exception:
+            raise DeploymentRunError(node, "Could not upload files to '{0}': {1}".format(self.directory, exception))
         return node
 
+def getInstalledPythonPackages(client, pip="/usr/bin/pip"):
+    """
+    Get the installed Python packages and their versions using a single ``pip freeze`` call
+
+    :param client: connected SSH client
+    :type client: :class:`~libcloud.compute.ssh.BaseSSHClient`
+    :param pip: path to pip to use
+    :type pip: str
+    :returns: mapping of normalized package names to versions
+    :rtype: dict
+    """
+    stdout, stderr, status = client.run("{pip} freeze".format(pip=pip))
+    if status != 0:
+        log.error(stderr)
+        return {}
+    installed = {}
+    for line in stdout.splitlines():
+        match = re.match(r"(?P<name>[^\s=]+)==(?P<version>\S+)", line.strip())
+        if match:
+            installed[normalizePythonPackageName(match.group("name"))] = match.group("version")
+    return installed
+
+def getPythonPackageInfo(path):
+    """
+    Get normalized name and version of a Python package based on its
+    wheel or source distribution file name
+
+    :param path: package file path
+    :type path: str
+    :returns: normalized package name, version
+    :rtype: (str, str)
+    """
+    fileName = os.path.basename(path)
+    match = PYTHON_PACKAGE_FILE_NAME_REGEX.match(fileName)
+    if not match:
+        raise ValueError("'{0}' is not a valid Python package file name".format(fileName))
+    return normalizePythonPackageName(match.group("name")), match.group("version")
+
+def getYumCommand(arguments, builder):
+    """
+    Get shell command for script mode that runs yum with the arguments and, like the deployments
+    do, retries up to three times after cleaning the yum cache if yum ran out of mirrors
+
+    :param arguments: yum arguments
+    :type arguments: str
+    :param builder: script builder
+    :type builder: :class:`~storm.thunder.script.ScriptBuilder`
+    :returns: command
+    :rtype: str
+    """
+    return ("for attempt in 1 2 3; do "
+            "yum {arguments} > {stdout} 2> {stderr}; status=$?; "
+            "if [ $status -eq 0 ] || ! grep -qF -- {error} {stderr}; then break; fi; "
+            "yum clean all > /dev/null 2>&1; "
+            "done; cat {stdout}; cat {stderr} >&2; exit $status").format(
+                arguments=arguments,
+                error=pipes.quote(YUM_MIRROR_ERROR),
+                stderr=builder.getStateFileName("yum-stderr"),
+                stdout=builder.getStateFileName("yum-stdout"))
+
 def isRPMPackageInstalled(client, *rpms):
     """
     Determine if the specified rpm packages are installed
@@ -513,3 +742,33 @@ def isRPMPackageInstalled(client, *rpms):
         else:
             installed[line] = True
     return installed
+
+def normalizePythonPackageName(name):
+    """
+    Normalize Python package name such that names from package file names
+    and ``pip`` can be compared
+
+    :param name: package name
+    :type name: str
+    :returns: normalized package name
+    :rtype: str
+    """
+    return re.sub(r"[-_.]+", "-", name).lower()
+
+def updateKernel(node, client):
+    """
+    Update kernel using yum repositories
+
+    :param node: node
+    :type node: :class:`~libcloud.compute.base.Node` or :class:`~BaseNodeInfo`
+    :param client: connected SSH client
+    :type client: :class:`~libcloud.compute.ssh.BaseSSHClient`
+    :returns: whether the kernel was updated and the node requires a reboot
+    :rtype: bool
+    """
+    stdout, stderr, status = client.run("/usr/bin/yum update kernel --assumeyes")
+    if status != 0:
+        raise DeploymentRunError(
+            node, "Could not update kernel", status, stdout, stderr)
+
+    return "No Packages marked for Update" not in stdout
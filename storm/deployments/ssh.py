@@ -11,9 +11,9 @@ import re
 import subprocess
 
 from c4.utils.logutil import ClassLogger
-from c4.utils.util import EtcHosts
 
-from ..thunder import Deployment
+from ..thunder import (Deployment,
+                       getEnsureHostsEntryCommand)
 
 
 log = logging.getLogger(__name__)
@@ -112,31 +112,17 @@ class AddKnownHost(Deployment):
         :returns: node
         :rtype: :class:`~libcloud.compute.base.Node` or :class:`~BaseNodeInfo`
         """
-        network = client.read("/etc/sysconfig/network")
-        hostname = re.findall("HOSTNAME=(.+)", network)[0]
-
         sshDirectory = os.path.join(self.userHome, ".ssh")
         client.mkdir(sshDirectory)
         knownHostsPath = os.path.join(sshDirectory, "known_hosts")
-        if not client.isFile(knownHostsPath):
-            client.touch(knownHostsPath)
-
-        # check if host public key already known
-        knownHosts = client.read(knownHostsPath)
-        alreadyKnown = False
-        for knownHost in knownHosts.splitlines():
-            if knownHost.startswith(self.host):
-                self.log.debug("'%s' already knows host '%s'", hostname, self.host)
-                self.log.debug(knownHost)
-                alreadyKnown = True
-                break
 
-        if not alreadyKnown:
-            knownHostEntry = "{0} {1}".format(self.host, self.hostPublicKey)
-            client.put(knownHostsPath, contents=knownHostEntry, mode="a")
-            if "." in self.host:
-                knownShortHostEntry = "{0} {1}".format(self.host[0:self.host.index(".")], self.hostPublicKey)
-                client.put(knownHostsPath, contents=knownShortHostEntry, mode="a")
+        # add the host public key for the long and short host name or replace an existing one
+        hosts = [self.host]
+        if "." in self.host:
+            hosts.append(self.host[0:self.host.index(".")])
+        for host in hosts:
+            if not client.ensureLine(knownHostsPath, "{0} {1}".format(host, self.hostPublicKey), key=host, separator=" "):
+                self.log.debug("'%s' already knows host '%s'", node.name, host)
 
         # make sure that ssh directory has correct owner
         if self.user != "root":
@@ -159,6 +145,18 @@ class AddToEtcHosts(Deployment):
         self.hostnames = hostnames
         self.ip = ip
 
+    def buildScript(self, node, builder):
+        """
+        Add the commands of this deployment to the script builder
+
+        :param node: node
+        :type node: :class:`~libcloud.compute.base.Node` or :class:`~BaseNodeInfo`
+        :param builder: script builder
+        :type builder: :class:`~storm.thunder.script.ScriptBuilder`
+        """
+        builder.addCommand(getEnsureHostsEntryCommand("/etc/hosts", self.ip, self.hostnames, builder=builder),
+                           "Could not add '{0}' to /etc/hosts".format(self.ip))
+
     def run(self, node, client, usePrivateIps):
         """
         Runs this deployment task on node using the client provided.
@@ -172,12 +170,8 @@ class AddToEtcHosts(Deployment):
         :returns: node
         :rtype: :class:`~libcloud.compute.base.Node` or :class:`~BaseNodeInfo`
         """
-        etcHosts = EtcHosts.fromString(client.read("/etc/hosts"))
-        for hostname in self.hostnames:
-            etcHosts.add(hostname, self.ip, replace=True)
-
-        entry = etcHosts.toString()
-        client.put("/etc/hosts", contents=entry)
+        # move the hostnames to the entry of the ip
+        client.ensureHostsEntry("/etc/hosts", self.ip, self.hostnames)
 
         return node
 
@@ -11,11 +11,27 @@ from ._version import get_versions
 from .base import (BaseNodeInfo,
                    ClusterDeployment,
                    Datetime, Deployment, DeploymentErrorResult, DeploymentResult, DeploymentResults, DeploymentRunError,
+                   FlushFiles,
                    NodesInfoMap,
+                   ScriptDeployment,
                    deploy,
                    getDeployments)
+from .cache import (RemoteArtifactCache,
+                    getFileHash)
 from .client import (AdvancedSSHClient,
-                     RemoteTemporaryDirectory)
+                     FileTransaction,
+                     JobPoller, JumpHost,
+                     RemoteHelper, RemoteJob, RemoteTemporaryDirectory,
+                     getEnsureBlockCommand, getEnsureHostsEntryCommand, getEnsureLineCommand, getJobPoller, getJumpHost,
+                     releaseJumpHost)
+from .connection import (AdmissionController,
+                         ReadinessEvent, ReadinessProber,
+                         checkReachability, selectAddresses,
+                         waitForReconnect)
+from .script import (CommandResult,
+                     ScriptBuilder)
+from .transfer import (syncDirectory,
+                       uploadDelta)
 
 
 __path__ = extend_path(__path__, __name__)
@@ -0,0 +1,348 @@
+"""
+Copyright (c) IBM 2015-2017. All Rights Reserved.
+Project name: storm-thunder
+This project is licensed under the MIT License, see LICENSE
+
+Remote helper agent that performs file and command operations on a node
+
+The agent is sent to the node as a self-contained script that only depends on the
+Python standard library of either Python 2 or 3. It reads framed requests from
+standard input and writes framed responses to standard output. Each frame consists
+of a 4 byte big-endian length followed by a UTF-8 encoded JSON document.
+
+Requests have the form ``{"id": 1, "operation": "isFile", "arguments": {"path": "/etc/hosts"}}``
+and responses either ``{"id": 1, "result": true}`` or ``{"id": 1, "error": "..."}``.
+File contents and command output are base64 encoded.
+
+Requests are processed in order such that clients can pipeline many requests
+before reading the responses.
+"""
+import base64
+import errno
+import hashlib
+import json
+import os
+import struct
+import subprocess
+import sys
+import zlib
+
+
+def chmod(path, mode):
+    """
+    Change the mode (permissions) of a file
+    """
+    os.chmod(path, mode)
+
+def chown(path, user=None, group=None):
+    """
+    Change owner and group of a file
+    """
+    import grp
+    import pwd
+    uid = pwd.getpwnam(user).pw_uid if user else -1
+    gid = grp.getgrnam(group).gr_gid if group else -1
+    os.chown(path, uid, gid)
+
+def definesKey(line, key, separator="="):
+    """
+    Check if the line defines the key, i.e., it starts with the key followed by the separator
+    or by whitespace if the separator is only whitespace
+    """
+    text = line.lstrip(" \t")
+    if not text.startswith(key):
+        return False
+    rest = text[len(key):]
+    separator = separator.strip()
+    if not separator:
+        return rest[:1] in (" ", "\t")
+    return rest.lstrip(" \t").startswith(separator)
+
+def ensureBlock(path, block, marker="storm-thunder"):
+    """
+    Make sure that the file contains the block between marker lines
+    """
+    path = os.path.expanduser(path)
+    lines = readLines(path)
+    if not ensureBlockInLines(lines, block, marker=marker):
+        return False
+    writeLines(path, lines)
+    return True
+
+def ensureBlockInLines(lines, block, marker="storm-thunder"):
+    """
+    Make sure that the lines contain the block between marker lines, modifies the lines in place
+    """
+    begin = "# BEGIN {0}".format(marker)
+    end = "# END {0}".format(marker)
+    newLines = [begin] + (block.split("\n") if block else []) + [end]
+    if begin in lines and end in lines[lines.index(begin):]:
+        start = lines.index(begin)
+        stop = lines.index(end, start)
+        if lines[start:stop + 1] == newLines:
+            return False
+        lines[start:stop + 1] = newLines
+    else:
+        lines.extend(newLines)
+    return True
+
+def ensureHostsEntry(path, ip, hostnames):
+    """
+    Make sure that the hosts file maps the hostnames to the ip address
+    """
+    path = os.path.expanduser(path)
+    lines = readLines(path)
+    if not ensureHostsEntryInLines(lines, ip, hostnames):
+        return False
+    writeLines(path, lines)
+    return True
+
+def ensureHostsEntryInLines(lines, ip, hostnames):
+    """
+    Make sure that the hosts file lines map the hostnames to the ip address, modifies the lines in place.
+    The hostnames are added to the first line of the ip address and removed from all other lines,
+    lines without hostnames left are removed.
+    """
+    found = False
+    modified = False
+    newLines = []
+    for line in lines:
+        entry, hashMark, comment = line.partition("#")
+        fields = entry.split()
+        if not fields:
+            newLines.append(line)
+            continue
+        if fields[0] == ip and not found:
+            found = True
+            names = fields[1:] + [hostname for hostname in hostnames if hostname not in fields[1:]]
+        else:
+            names = [name for name in fields[1:] if name not in hostnames]
+        if names == fields[1:]:
+            newLines.append(line)
+            continue
+        modified = True
+        if names:
+            newLines.append(" ".join([fields[0]] + names) + (" " + hashMark + comment if hashMark else ""))
+    if not found:
+        newLines.append(" ".join([ip] + list(hostnames)))
+        modified = True
+    lines[:] = newLines
+    return modified
+
+def ensureLine(path, line, key=None, separator="="):
+    """
+    Make sure that the file contains the line, replacing the first line that defines the key
+    """
+    path = os.path.expanduser(path)
+    lines = readLines(path)
+    if not ensureLineInLines(lines, line, key=key, separator=separator):
+        return False
+    writeLines(path, lines)
+    return True
+
+def ensureLineInLines(lines, line, key=None, separator="="):
+    """
+    Make sure that the lines contain the line, modifies the lines in place
+    """
+    if line in lines:
+        return False
+    for index, existingLine in enumerate(lines):
+        if key and definesKey(existingLine, key, separator):
+            lines[index] = line
+            break
+    else:
+        lines.append(line)
+    return True
+
+def exists(path):
+    """
+    Check if the specified path exists
+    """
+    return os.path.exists(path)
+
+def getBlockSignatures(path, blockSize):
+    """
+    Get weak (Adler-32) and strong (MD5) checksums of the full blocks of the file, a missing file has no signatures
+    """
+    if not os.path.isfile(path):
+        return None
+    signatures = []
+    with open(path, "rb") as f:
+        while True:
+            block = f.read(blockSize)
+            if len(block) < blockSize:
+                return signatures
+            signatures.append([zlib.adler32(block) & 0xffffffff, hashlib.md5(block).hexdigest()])
+
+def isFile(path):
+    """
+    Check if the file specified by the path is a file
+    """
+    return os.path.isfile(path)
+
+def mkdir(path):
+    """
+    Create directory specified by the path including its parents
+    """
+    try:
+        os.makedirs(path)
+    except OSError as exception:
+        if exception.errno != errno.EEXIST:
+            raise
+
+def patch(path, basePath, blockSize, delta, append=True):
+    """
+    Write delta instructions to the file, block ranges ``[index, count]`` are copied
+    from the base file while strings are base64 encoded literal data
+    """
+    with open(basePath, "rb") as base:
+        with open(path, "ab" if append else "wb") as f:
+            for instruction in delta:
+                if isinstance(instruction, list):
+                    index, count = instruction
+                    base.seek(index * blockSize)
+                    f.write(base.read(count * blockSize))
+                else:
+                    f.write(base64.b64decode(instruction))
+
+def put(path, content="", mode="w", chmod=None):
+    """
+    Create file with the specified base64 encoded contents
+    """
+    with open(path, mode.replace("b", "") + "b") as f:
+        f.write(base64.b64decode(content))
+    if chmod is not None:
+        os.chmod(path, chmod)
+    return path
+
+def read(path):
+    """
+    Read contents of the file specified by the path
+    """
+    with open(path, "rb") as f:
+        return base64.b64encode(f.read()).decode("ascii")
+
+def readFrame(stream):
+    """
+    Read a single frame from the stream
+
+    :returns: decoded JSON document or ``None`` if the stream was closed
+    """
+    header = stream.read(4)
+    if len(header) < 4:
+        return None
+    length = struct.unpack(">I", header)[0]
+    return json.loads(stream.read(length).decode("utf-8"))
+
+def readLines(path):
+    """
+    Read lines of the file specified by the path, a missing file has no lines
+    """
+    if not os.path.exists(path):
+        return []
+    with open(path, "rb") as f:
+        return f.read().decode("utf-8").splitlines()
+
+def remove(path):
+    """
+    Remove the file specified by the path if it exists
+    """
+    if os.path.exists(path):
+        os.remove(path)
+
+def replace(path, temporaryPath, sha256):
+    """
+    Replace the file with the temporary file if its SHA-256 hash matches, keeping mode and owner
+    """
+    digest = hashlib.sha256()
+    with open(temporaryPath, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    if digest.hexdigest() != sha256:
+        os.remove(temporaryPath)
+        raise ValueError("Checksum mismatch for '{0}'".format(path))
+    if os.path.exists(path):
+        fileInfo = os.stat(path)
+        os.chmod(temporaryPath, fileInfo.st_mode & 0o7777)
+        try:
+            os.chown(temporaryPath, fileInfo.st_uid, fileInfo.st_gid)
+        except OSError:
+            pass
+    os.rename(temporaryPath, path)
+
+def run(command):
+    """
+    Run the specified command in a shell, its standard input is closed such that it
+    cannot read the requests of the client
+    """
+    with open(os.devnull, "rb") as devnull:
+        process = subprocess.Popen(command, shell=True, stdin=devnull, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        stdout, stderr = process.communicate()
+    return {
+        "stdout": base64.b64encode(stdout).decode("ascii"),
+        "stderr": base64.b64encode(stderr).decode("ascii"),
+        "status": process.returncode
+    }
+
+def touch(path):
+    """
+    Touch file specified by path
+    """
+    with open(path, "a"):
+        os.utime(path, None)
+
+def writeFrame(stream, document):
+    """
+    Write a single frame to the stream
+    """
+    data = json.dumps(document).encode("utf-8")
+    stream.write(struct.pack(">I", len(data)) + data)
+    stream.flush()
+
+def writeLines(path, lines):
+    """
+    Write lines to the file specified by the path in place such that its permissions are kept
+    """
+    with open(path, "wb") as f:
+        f.write("".join(line + "\n" for line in lines).encode("utf-8"))
+
+OPERATIONS = {
+    "chmod": chmod,
+    "chown": chown,
+    "ensureBlock": ensureBlock,
+    "ensureHostsEntry": ensureHostsEntry,
+    "ensureLine": ensureLine,
+    "exists": exists,
+    "getBlockSignatures": getBlockSignatures,
+    "isFile": isFile,
+    "mkdir": mkdir,
+    "patch": patch,
+    "put": put,
+    "read": read,
+    "remove": remove,
+    "replace": replace,
+    "run": run,
+    "touch": touch
+}
+
+def main():
+    """
+    Process requests until standard input is closed
+    """
+    inputStream = getattr(sys.stdin, "buffer", sys.stdin)
+    outputStream = getattr(sys.stdout, "buffer", sys.stdout)
+    while True:
+        request = readFrame(inputStream)
+        if request is None:
+            return 0
+        response = {"id": request.get("id")}
+        try:
+            operation = OPERATIONS[request["operation"]]
+            arguments = dict((str(key), value) for key, value in request.get("arguments", {}).items())
+            response["result"] = operation(**arguments)
+        except Exception as exception:
+            response["error"] = "{0}: {1}".format(type(exception).__name__, exception)
+        writeFrame(outputStream, response)
+
+if __name__ == "__main__":
+    sys.exit(main())
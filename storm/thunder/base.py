@@ -20,8 +20,13 @@ from c4.utils.jsonutil import JSONSerializable
 from c4.utils.util import (getFullModuleName, getModuleClasses,
                            naturalSortKey)
 
-from .client import AdvancedSSHClient
+from .client import AdvancedSSHClient, getJumpHost, releaseJumpHost
+from .connection import (AdmissionController,
+                         checkReachability, selectAddresses)
+from .script import ScriptBuilder
+from .transfer import runWithInput
 
+DEFAULT_NUMBER_OF_PARALLEL_CONNECTS = 10
 DEFAULT_NUMBER_OF_PARALLEL_DEPLOYMENTS = 20
 PARAMETER_DOC_REGEX = re.compile(r"\s*:(?P<docType>\w+)\s+(?P<name>\w+):\s+(?P<description>.+)", re.MULTILINE)
 
@@ -50,14 +55,19 @@ class BaseNodeInfo(JSONSerializable):
     :type privateIp: str
     :param password: SSH password
     :type password: str
+    :param jumpHost: jump host through which the node is reachable, either ``[username@]hostname[:port]``
+        or a dictionary with ``hostname`` and optional ``port``, ``username`` and ``password`` keys
+    :type jumpHost: str or dict
     """
-    def __init__(self, name, publicIp, privateIp=None, password=None):
+    def __init__(self, name, publicIp, privateIp=None, password=None, jumpHost=None):
         self.name = name
         self.public_ips = [publicIp]
         self.private_ips = [privateIp] if privateIp else []
         self.extra = {}
         if password:
             self.extra["password"] = password
+        if jumpHost:
+            self.extra["jumpHost"] = jumpHost
 
 class ClusterDeployment(BaseDeployment):
     """
@@ -79,8 +89,8 @@ class ClusterDeployment(BaseDeployment):
         :type clients: dict
         :param usePrivateIps: use private ip to connect to nodes instead of the public one
         :type usePrivateIps: bool
-        :returns: nodes
-        :rtype: [:class:`~libcloud.compute.base.Node` or :class:`~BaseNodeInfo`]
+        :returns: nodes or a deployment result per node
+        :rtype: [:class:`~libcloud.compute.base.Node` or :class:`~BaseNodeInfo`] or [:class:`~DeploymentResult`]
         """
 
 # TODO: add JSONSerializable date to c4.utils
@@ -213,6 +223,7 @@ class DeploymentResults(JSONSerializable):
     :type end: :class:`datetime.datetime`
     """
     def __init__(self, start=None, end=None):
+        self.preflight = {}
         self.steps = []
         self.start = Datetime(start) if start else Datetime(datetime.datetime.utcnow())
         self.end = Datetime(end) if start else Datetime(datetime.datetime.utcnow())
@@ -229,6 +240,28 @@ class DeploymentResults(JSONSerializable):
         else:
             raise ValueError("'{0}' needs to be of type '{1}' or {2}".format(result, DeploymentResult, DeploymentErrorResult))
 
+    def addPreflightResults(self, nodes, reachable):
+        """
+        :param nodes: the nodes that were checked
+        :type nodes: [:class:`~libcloud.compute.base.Node` or :class:`~BaseNodeInfo`]
+        :param reachable: node name to readiness event mapping for reachable nodes
+        :type reachable: dict
+        """
+        for node in nodes:
+            event = reachable.get(node.name)
+            if event:
+                self.preflight[node.name] = {
+                    "address": event.hostname,
+                    "banner": event.banner,
+                    "elapsed": round(event.elapsed, 3),
+                    "latency": round(event.latency, 3) if event.latency is not None else None,
+                    "reachable": True
+                }
+            else:
+                self.preflight[node.name] = {
+                    "reachable": False
+                }
+
     def addResults(self, results):
         """
         :param results: deployment results
@@ -292,6 +325,30 @@ class DeploymentRunError(libcloud.compute.types.DeploymentError, JSONSerializabl
             self.value,
             self.driver)
 
+class FlushFiles(Deployment):
+    """
+    Barrier that writes the pending edits of the file transaction of each node,
+    see :meth:`~storm.thunder.client.AdvancedSSHClient.beginFileTransaction`
+    """
+    def __init__(self):
+        super(FlushFiles, self).__init__()
+
+    def run(self, node, client, usePrivateIps):
+        """
+        Runs this deployment task on node using the client provided.
+
+        :param node: node
+        :type node: :class:`~libcloud.compute.base.Node` or :class:`~BaseNodeInfo`
+        :param client: connected SSH client
+        :type client: :class:`~libcloud.compute.ssh.BaseSSHClient`
+        :param usePrivateIps: use private ip to connect to nodes instead of the public one
+        :type usePrivateIps: bool
+        :returns: node
+        :rtype: :class:`~libcloud.compute.base.Node` or :class:`~BaseNodeInfo`
+        """
+        client.flushFiles()
+        return node
+
 class NodeDeploymentException(BaseDeployment):
     """
     Generic node deployment exception used for example to capture client connection issues
@@ -348,7 +405,8 @@ class NodesInfoMap(JSONSerializable):
                 node.name,
                 node.public_ips[0] if node.public_ips else "",
                 privateIp=node.private_ips[0] if node.private_ips else None,
-                password=node.extra.get("password"))
+                password=node.extra.get("password"),
+                jumpHost=node.extra.get("jumpHost"))
 
     def getNodesByNames(self, names):
         """
@@ -382,10 +440,119 @@ class NodesInfoMap(JSONSerializable):
 
         return nodes
 
-def deploy(deploymentOrDeploymentList, nodeOrNodes, timeout=60, usePrivateIps=False, numberOfParallelDeployments=DEFAULT_NUMBER_OF_PARALLEL_DEPLOYMENTS):
+class ScriptDeployment(Deployment):
+    """
+    Deployment that combines deployments which provide a ``buildScript(node, builder)`` method
+    into a single remote script per node instead of running their commands one by one
+
+    :param deployments: deployments that support script mode
+    :type deployments: [:class:`~Deployment`]
+    """
+    def __init__(self, deployments):
+        super(ScriptDeployment, self).__init__()
+        self.deployments = deployments
+
+    def run(self, node, client, usePrivateIps):
+        """
+        Runs this deployment task on node using the client provided.
+
+        :param node: node
+        :type node: :class:`~libcloud.compute.base.Node` or :class:`~BaseNodeInfo`
+        :param client: connected SSH client
+        :type client: :class:`~libcloud.compute.ssh.BaseSSHClient`
+        :param usePrivateIps: use private ip to connect to nodes instead of the public one
+        :type usePrivateIps: bool
+        :returns: node
+        :rtype: :class:`~libcloud.compute.base.Node` or :class:`~BaseNodeInfo`
+        """
+        for _, error in self.runScript(node, client):
+            if error:
+                raise error
+        return node
+
+    def runScript(self, node, client):
+        """
+        Run the combined script on the node and split its output into the results of the deployments
+
+        :param node: node
+        :type node: :class:`~libcloud.compute.base.Node` or :class:`~BaseNodeInfo`
+        :param client: connected SSH client
+        :type client: :class:`~libcloud.compute.ssh.BaseSSHClient`
+        :returns: deployment and error or ``None`` for each deployment that ran, the script stops at the first error
+        :rtype: [(:class:`~Deployment`, :class:`~DeploymentRunError`)]
+        """
+        builder = ScriptBuilder()
+        for deployment in self.deployments:
+            builder.addStep(deployment.typeAsString)
+            deployment.buildScript(node, builder)
+
+        stdout, stderr, status = runWithInput(client, builder.getCommand(), builder.build())
+
+        results = []
+        for deployment, commands, commandResults in zip(self.deployments, builder.steps, builder.parseOutput(stdout)):
+            failedCommandResults = [commandResult for commandResult in commandResults if commandResult.failed]
+            if failedCommandResults:
+                commandResult = failedCommandResults[0]
+                results.append((deployment, DeploymentRunError(node, commandResult.errorMessage, commandResult.status, commandResult.stdout, commandResult.stderr)))
+                break
+            if len(commandResults) < len(commands):
+                results.append((deployment, DeploymentRunError(node, "Script stopped unexpectedly", status, stdout, stderr)))
+                break
+            results.append((deployment, None))
+        return results
+
+def combineScriptDeployments(deployments):
+    """
+    Combine consecutive deployments that support script mode into :class:`~ScriptDeployment` objects
+
+    :param deployments: deployments
+    :type deployments: [:class:`~BaseDeployment`]
+    :returns: deployments
+    :rtype: [:class:`~BaseDeployment`]
+    """
+    combinedDeployments = []
+    scriptDeployments = []
+    for deployment in list(deployments) + [None]:
+        if isinstance(deployment, Deployment) and hasattr(deployment, "buildScript"):
+            scriptDeployments.append(deployment)
+            continue
+        if len(scriptDeployments) > 1:
+            combinedDeployments.append(ScriptDeployment(scriptDeployments))
+        else:
+            combinedDeployments.extend(scriptDeployments)
+        scriptDeployments = []
+        if deployment is not None:
+            combinedDeployments.append(deployment)
+    return combinedDeployments
+
+def deploy(deploymentOrDeploymentList, nodeOrNodes, timeout=60, usePrivateIps=False, numberOfParallelDeployments=DEFAULT_NUMBER_OF_PARALLEL_DEPLOYMENTS,
+           preflightTimeout=None, selectAddress=False, numberOfParallelConnects=DEFAULT_NUMBER_OF_PARALLEL_CONNECTS,
+           callback=None, useHelper=False, scriptMode=False, fileTransactions=False):
     """
     Run specified deployment on the nodes
 
+    Before any SSH handshakes are started all nodes are checked at once for reachability
+    using non-blocking connects and SSH banner reads. The results are part of the
+    deployment results.
+
+    When ``selectAddress`` is enabled the check races connects to all public and private
+    addresses of each node and the fastest responsive address is used for the node.
+
+    In script mode consecutive deployments that provide a ``buildScript`` method are
+    combined into a single remote script per node, see :class:`~ScriptDeployment`.
+
+    With ``fileTransactions`` enabled the file edits of consecutive deployments on a node
+    are collected and each modified file is written once at the next barrier, i.e., a
+    :class:`~FlushFiles` deployment, any other file or command operation on the node or
+    the end of the deployments. The final flush also happens if a deployment failed.
+
+    Nodes with a ``jumpHost`` in their ``extra`` information are connected through
+    ``direct-tcpip`` channels of a single shared connection to that jump host.
+
+    SSH handshakes start with ``numberOfParallelConnects`` concurrent connects. The number
+    of concurrent connects then adapts to the observed handshake latency and failures
+    so that large numbers of nodes do not trip server-side limits such as ``MaxStartups``.
+
     :param deploymentOrDeploymentList: single deployment or deployment list
     :type deploymentOrDeploymentList: :class:`~libcloud.compute.deployment.Deployment` or [:class:`~libcloud.compute.deployment.Deployment`]
     :param nodeOrNodes: node or list of nodes
@@ -396,6 +563,20 @@ def deploy(deploymentOrDeploymentList, nodeOrNodes, timeout=60, usePrivateIps=Fa
     :type usePrivateIps: bool
     :param numberOfParallelDeployments: number of deployments to run in parallel
     :type numberOfParallelDeployments: int
+    :param preflightTimeout: timeout in seconds for the reachability check, defaults to ``timeout``, ``0`` disables the check
+    :type preflightTimeout: int
+    :param selectAddress: connect to the fastest responsive address of each node instead of using ``usePrivateIps``
+    :type selectAddress: bool
+    :param numberOfParallelConnects: initial number of SSH handshakes to perform in parallel
+    :type numberOfParallelConnects: int
+    :param callback: optional function that is called with the node name to result mapping of each step as soon as it is available
+    :type callback: func(dict)
+    :param useHelper: perform file and command operations through a remote helper agent on each node
+    :type useHelper: bool
+    :param scriptMode: combine consecutive deployments that support it into a single remote script per node
+    :type scriptMode: bool
+    :param fileTransactions: collect file edits of consecutive deployments and write each file once
+    :type fileTransactions: bool
     :returns: deployment results
     :rtype: :class:`~DeploymentResults`
     """
@@ -423,117 +604,253 @@ def deploy(deploymentOrDeploymentList, nodeOrNodes, timeout=60, usePrivateIps=Fa
         return DeploymentResults(totalStart, totalEnd)
 
     deploymentNames = [deployment.typeAsString for deployment in deployments]
-
-    # TODO: determine if we want to switch to regular process pool or keep using threads while assuming most of the processing is done on the nodes
-    pool = ThreadPool(processes=max([numberOfParallelDeployments, len(nodes)]))
-
-    def connectClient(node):
-        """
-        Connect SSH client to the specified node
-
-        :param node: node
-        :type node: :class:`~libcloud.compute.base.Node` or :class:`~BaseNodeInfo`
-        :returns: node, connected client
-        :rtype: (:class:`~libcloud.compute.base.Node` or :class:`~BaseNodeInfo`, :class:`~libcloud.compute.ssh.BaseSSHClient`)
-        """
-        client = AdvancedSSHClient(node.private_ips[0] if usePrivateIps else node.public_ips[0],
-                                   password=node.extra.get("password"),
-                                   timeout=timeout)
-        try:
-            client.connect()
-        except Exception as exception:
-            log.error("Could not connect to node '%s': %s", node.name, exception)
-            return node, None
-        return node, client
-
-    connectedClients = pool.map(connectClient, nodes)
-
-    # check for errors in case we could not connect
-    if any([not client for _, client in connectedClients]):
-        log.error("Found problems connecting to the nodes, stopping deployments")
-        totalEnd = datetime.datetime.utcnow()
-        deploymentResults = DeploymentResults(totalStart, totalEnd)
-        deploymentResults.addResult(DeploymentErrorResult(NodeDeploymentException(), nodes[0], totalStart, totalEnd, "Found problems connecting to the nodes, stopping deployments"))
-        return deploymentResults
-
-    clients = {
-        node.name: client
-        for node, client in connectedClients
+    if scriptMode:
+        deployments = combineScriptDeployments(deployments)
+    finalFlush = None
+    if fileTransactions:
+        finalFlush = FlushFiles()
+        deployments = list(deployments) + [finalFlush]
+
+    if preflightTimeout is None:
+        preflightTimeout = timeout
+
+    addresses = {
+        node.name: getNodeAddress(node, usePrivateIps)
+        for node in nodes
     }
 
-    for deployment in deployments:
-
-        deploymentStart = datetime.datetime.utcnow()
-
-        if isinstance(deployment, ClusterDeployment):
-
+    # nodes behind jump hosts share one connection to their jump host
+    jumpHosts = {
+        node.name: getJumpHost(node.extra["jumpHost"], timeout=timeout)
+        for node in nodes
+        if node.extra.get("jumpHost")
+    }
+    # release the jump hosts however the deployments end
+    try:
+        directNodes = [node for node in nodes if node.name not in jumpHosts]
+
+        if selectAddress:
+            reachable, unreachable = selectAddresses(
+                {
+                    node.name: node.public_ips + node.private_ips
+                    for node in directNodes
+                },
+                timeout=preflightTimeout or timeout)
+            for name, event in reachable.items():
+                addresses[name] = event.hostname
+        elif preflightTimeout:
+            reachable, unreachable = checkReachability(
+                {
+                    node.name: (addresses[node.name], 22)
+                    for node in directNodes
+                },
+                timeout=preflightTimeout)
+
+        if jumpHosts and (selectAddress or preflightTimeout):
+            # nodes behind jump hosts cannot be checked directly so check their jump hosts instead
+            jumpHostsReachable, _ = checkReachability(
+                {
+                    (jumpHost.hostname, jumpHost.port): (jumpHost.hostname, jumpHost.port)
+                    for jumpHost in jumpHosts.values()
+                },
+                timeout=preflightTimeout or timeout)
+            for name, jumpHost in jumpHosts.items():
+                event = jumpHostsReachable.get((jumpHost.hostname, jumpHost.port))
+                if event:
+                    reachable[name] = event
+                else:
+                    unreachable.append(name)
+
+        if selectAddress or preflightTimeout:
+            deploymentResults.addPreflightResults(nodes, reachable)
+
+            # do not start any handshakes if some of the nodes are not reachable
+            if unreachable:
+                log.error("Could not reach nodes '%s', stopping deployments", ",".join(unreachable))
+                totalEnd = datetime.datetime.utcnow()
+                deploymentResults.addResults([
+                    DeploymentErrorResult(NodeDeploymentException(), node, totalStart, totalEnd, "Could not reach node within {0} seconds".format(preflightTimeout or timeout))
+                    for node in nodes
+                    if node.name in unreachable
+                ])
+                deploymentResults.end = Datetime(totalEnd)
+                if callback:
+                    callback(deploymentResults.steps[-1])
+                return deploymentResults
+
+        # TODO: determine if we want to switch to regular process pool or keep using threads while assuming most of the processing is done on the nodes
+        pool = ThreadPool(processes=max([numberOfParallelDeployments, len(nodes)]))
+        admissionController = AdmissionController(initialLimit=numberOfParallelConnects,
+                                                  maximumLimit=max([numberOfParallelDeployments, len(nodes)]))
+
+        def connectClient(node):
+            """
+            Connect SSH client to the specified node
+
+            :param node: node
+            :type node: :class:`~libcloud.compute.base.Node` or :class:`~BaseNodeInfo`
+            :returns: node, connected client
+            :rtype: (:class:`~libcloud.compute.base.Node` or :class:`~BaseNodeInfo`, :class:`~libcloud.compute.ssh.BaseSSHClient`)
+            """
+            client = AdvancedSSHClient(addresses[node.name],
+                                       password=node.extra.get("password"),
+                                       timeout=timeout,
+                                       proxy=jumpHosts.get(node.name),
+                                       useHelper=useHelper)
             try:
-                deployment.run(nodes, clients, usePrivateIps)
-                deploymentEnd = datetime.datetime.utcnow()
-                deploymentResults.addResult(DeploymentResult(deployment, nodes[0], deploymentStart, deploymentEnd))
-            except DeploymentRunError as deploymentRunError:
-                deploymentEnd = datetime.datetime.utcnow()
-                deploymentResults.addResult(DeploymentErrorResult(deployment, deploymentRunError.node, deploymentStart, deploymentEnd, deploymentRunError))
-                log.error("Could not run '%s' on '%s': %s",
-                          deployment.typeAsString, ",".join(node.name for node in nodes), deploymentRunError)
+                admissionController.call(client.connect)
             except Exception as exception:
-                deploymentEnd = datetime.datetime.utcnow()
-                deploymentResults.addResult(DeploymentErrorResult(deployment, nodes[0], deploymentStart, deploymentEnd, exception))
-                log.error("Could not run '%s' on '%s': %s",
-                          deployment.typeAsString, ",".join(node.name for node in nodes), exception)
-                log.exception(exception)
+                log.error("Could not connect to node '%s': %s", node.name, exception)
+                return node, None
+            if fileTransactions:
+                client.beginFileTransaction()
+            return node, client
+
+        connectedClients = pool.map(connectClient, nodes)
+
+        # check for errors in case we could not connect
+        if any([not client for _, client in connectedClients]):
+            log.error("Found problems connecting to the nodes, stopping deployments")
+            for _, client in connectedClients:
+                if client:
+                    client.close()
+            pool.close()
+            pool.join()
+            totalEnd = datetime.datetime.utcnow()
+            deploymentResults.end = Datetime(totalEnd)
+            deploymentResults.addResult(DeploymentErrorResult(NodeDeploymentException(), nodes[0], totalStart, totalEnd, "Found problems connecting to the nodes, stopping deployments"))
+            if callback:
+                callback(deploymentResults.steps[-1])
+            return deploymentResults
+
+        clients = {
+            node.name: client
+            for node, client in connectedClients
+        }
+
+        stopped = False
+        for deployment in deployments:
+
+            # only the final flush of pending file edits runs after a failed deployment
+            if stopped and deployment is not finalFlush:
+                continue
+
+            deploymentStart = datetime.datetime.utcnow()
+            numberOfSteps = len(deploymentResults.steps)
+
+            if isinstance(deployment, ClusterDeployment):
 
-        else:
-            def nodeDeploy(nodeClientTuple):
-                """
-                Individual worker function performing the deployment on the specified node
-                """
-                node, client = nodeClientTuple
-                nodeStart = datetime.datetime.utcnow()
                 try:
-                    deployment.run(node, client, usePrivateIps)
-                    nodeEnd = datetime.datetime.utcnow()
-                    result = DeploymentResult(deployment, node, nodeStart, nodeEnd)
-                    log.info("Running '%s' on '%s' took %s",
-                             deployment.typeAsString, node.name, nodeEnd-nodeStart)
-
+                    results = deployment.run(nodes, clients, usePrivateIps)
+                    deploymentEnd = datetime.datetime.utcnow()
+                    if isinstance(results, list) and results and all(isinstance(result, DeploymentResult) for result in results):
+                        # cluster deployments that report a result per node
+                        deploymentResults.addResults(results)
+                    else:
+                        deploymentResults.addResult(DeploymentResult(deployment, nodes[0], deploymentStart, deploymentEnd))
+                except DeploymentRunError as deploymentRunError:
+                    deploymentEnd = datetime.datetime.utcnow()
+                    deploymentResults.addResult(DeploymentErrorResult(deployment, deploymentRunError.node, deploymentStart, deploymentEnd, deploymentRunError))
+                    log.error("Could not run '%s' on '%s': %s",
+                              deployment.typeAsString, ",".join(node.name for node in nodes), deploymentRunError)
                 except Exception as exception:
-                    nodeEnd = datetime.datetime.utcnow()
-                    result = DeploymentErrorResult(deployment, node, nodeStart, nodeEnd, exception)
+                    deploymentEnd = datetime.datetime.utcnow()
+                    deploymentResults.addResult(DeploymentErrorResult(deployment, nodes[0], deploymentStart, deploymentEnd, exception))
                     log.error("Could not run '%s' on '%s': %s",
-                              deployment.typeAsString, node.name, exception)
+                              deployment.typeAsString, ",".join(node.name for node in nodes), exception)
                     log.exception(exception)
-                return result
 
-            nodeDeploymentResults = pool.map(nodeDeploy, connectedClients)
+            elif isinstance(deployment, ScriptDeployment):
+                def nodeScriptDeploy(nodeClientTuple):
+                    """
+                    Individual worker function running the combined script on the specified node
+                    """
+                    node, client = nodeClientTuple
+                    nodeStart = datetime.datetime.utcnow()
+                    try:
+                        scriptResults = deployment.runScript(node, client)
+                    except Exception as exception:
+                        log.exception(exception)
+                        scriptResults = [(deployment.deployments[0], exception)]
+                    nodeEnd = datetime.datetime.utcnow()
+                    results = []
+                    for scriptDeployment, error in scriptResults:
+                        if error:
+                            log.error("Could not run '%s' on '%s': %s", scriptDeployment.typeAsString, node.name, error)
+                            results.append(DeploymentErrorResult(scriptDeployment, node, nodeStart, nodeEnd, error))
+                        else:
+                            results.append(DeploymentResult(scriptDeployment, node, nodeStart, nodeEnd))
+                    return results
+
+                nodeScriptDeploymentResults = pool.map(nodeScriptDeploy, connectedClients)
+
+                # split into one step per deployment, nodes stop at their first error
+                for index in range(len(deployment.deployments)):
+                    step = [results[index] for results in nodeScriptDeploymentResults if len(results) > index]
+                    if step:
+                        deploymentResults.addResults(step)
+                deploymentEnd = datetime.datetime.utcnow()
+                log.info("Running '%s' on %d nodes took %s",
+                         ",".join(scriptDeployment.typeAsString for scriptDeployment in deployment.deployments), len(nodes), deploymentEnd-deploymentStart)
 
-            deploymentEnd = datetime.datetime.utcnow()
-            deploymentResults.addResults(nodeDeploymentResults)
-            log.info("Running '%s' on %d nodes took %s", deployment.typeAsString, len(nodes), deploymentEnd-deploymentStart)
+            else:
+                def nodeDeploy(nodeClientTuple):
+                    """
+                    Individual worker function performing the deployment on the specified node
+                    """
+                    node, client = nodeClientTuple
+                    nodeStart = datetime.datetime.utcnow()
+                    try:
+                        deployment.run(node, client, usePrivateIps)
+                        nodeEnd = datetime.datetime.utcnow()
+                        result = DeploymentResult(deployment, node, nodeStart, nodeEnd)
+                        log.info("Running '%s' on '%s' took %s",
+                                 deployment.typeAsString, node.name, nodeEnd-nodeStart)
+
+                    except Exception as exception:
+                        nodeEnd = datetime.datetime.utcnow()
+                        result = DeploymentErrorResult(deployment, node, nodeStart, nodeEnd, exception)
+                        log.error("Could not run '%s' on '%s': %s",
+                                  deployment.typeAsString, node.name, exception)
+                        log.exception(exception)
+                    return result
+
+                nodeDeploymentResults = pool.map(nodeDeploy, connectedClients)
 
-        if deploymentResults.numberOfErrors:
-            log.error("Found deployment with errors, stopping subsequent deployments")
-            break
+                deploymentEnd = datetime.datetime.utcnow()
+                deploymentResults.addResults(nodeDeploymentResults)
+                log.info("Running '%s' on %d nodes took %s", deployment.typeAsString, len(nodes), deploymentEnd-deploymentStart)
 
-    def closeClient(client):
-        """
-        Close/disconnect client
+            if callback:
+                for step in deploymentResults.steps[numberOfSteps:]:
+                    callback(step)
 
-        :param client: connected SSH client
-        :type client: :class:`~libcloud.compute.ssh.BaseSSHClient`
-        """
-        client.close()
-    pool.map(closeClient, [nodeClient[1] for nodeClient in connectedClients])
+            if deploymentResults.numberOfErrors and not stopped:
+                log.error("Found deployment with errors, stopping subsequent deployments")
+                stopped = True
 
-    pool.close()
-    pool.join()
+        def closeClient(client):
+            """
+            Close/disconnect client
 
-    totalEnd = datetime.datetime.utcnow()
-    # adjust end time
-    deploymentResults.end = Datetime(totalEnd)
-    if len(deployments) > 1:
-        log.info("Running '%s' on %d nodes took %s", ",".join(deploymentNames), len(nodes), totalEnd-totalStart)
-    return deploymentResults
+            :param client: connected SSH client
+            :type client: :class:`~libcloud.compute.ssh.BaseSSHClient`
+            """
+            client.close()
+        pool.map(closeClient, [nodeClient[1] for nodeClient in connectedClients])
+
+        pool.close()
+        pool.join()
+
+        totalEnd = datetime.datetime.utcnow()
+        # adjust end time
+        deploymentResults.end = Datetime(totalEnd)
+        if len(deployments) > 1:
+            log.info("Running '%s' on %d nodes took %s", ",".join(deploymentNames), len(nodes), totalEnd-totalStart)
+        return deploymentResults
+    finally:
+        for jumpHost in jumpHosts.values():
+            releaseJumpHost(jumpHost)
 
 def getDeployments():
     """
@@ -551,6 +868,19 @@ def getDeployments():
         deployments["{0}.{1}".format(moduleName, deployment.__name__)] = deployment
     return deployments
 
+def getNodeAddress(node, usePrivateIps=False):
+    """
+    Get the address to connect to for the specified node
+
+    :param node: node
+    :type node: :class:`~libcloud.compute.base.Node` or :class:`~BaseNodeInfo`
+    :param usePrivateIps: use private ip to connect to nodes instead of the public one
+    :type usePrivateIps: bool
+    :returns: address
+    :rtype: str
+    """
+    return node.private_ips[0] if usePrivateIps else node.public_ips[0]
+
 def getDocumentation(item):
     """
     Get documentation information on the specified item
@@ -0,0 +1,191 @@
+"""
+Copyright (c) IBM 2015-2017. All Rights Reserved.
+Project name: storm-thunder
+This project is licensed under the MIT License, see LICENSE
+
+Persistent content-addressed artifact cache on the nodes
+
+Files are stored under their SHA-256 hash in a cache directory on each node such that
+the same file only needs to be transferred once, regardless of how many deployments
+or runs use it. Deployments then materialize the files from the cache into their
+target directories as copies, such that editing them does not affect the cache entries.
+Users that cannot write to the system cache directory use a cache in their home directory.
+"""
+import hashlib
+import logging
+import os
+import pipes
+import threading
+import uuid
+
+from c4.utils.logutil import ClassLogger
+
+
+DEFAULT_CACHE_DIRECTORY = "/var/cache/storm-thunder"
+DEFAULT_CACHE_MAXIMUM_SIZE = 2 * 1024 * 1024 * 1024
+DEFAULT_FALLBACK_CACHE_DIRECTORY = "~/.cache/storm-thunder"
+
+log = logging.getLogger(__name__)
+
+# (path, size, modification time) to SHA-256 hash mapping of local files
+fileHashes = {}
+fileHashesLock = threading.Lock()
+
+@ClassLogger
+class RemoteArtifactCache(object):
+    """
+    Content-addressed artifact cache on a node with least recently used eviction
+
+    .. code-block:: python
+
+        cache = RemoteArtifactCache(client)
+        remoteFileNames = cache.materialize(["dist/package-1.0.rpm"], "/tmp/packages")
+
+    :param client: connected ssh client
+    :type client: :class:`~storm.thunder.client.AdvancedSSHClient`
+    :param directory: cache directory on the node
+    :type directory: str
+    :param maximumSize: maximum size of the cache in bytes
+    :type maximumSize: int
+    :param fallbackDirectory: cache directory on the node in case the user cannot write to ``directory``,
+        a leading ``~/`` refers to the home directory, ``None`` disables the fallback
+    :type fallbackDirectory: str
+    """
+    def __init__(self, client, directory=DEFAULT_CACHE_DIRECTORY, maximumSize=DEFAULT_CACHE_MAXIMUM_SIZE,
+                 fallbackDirectory=DEFAULT_FALLBACK_CACHE_DIRECTORY):
+        self.client = client
+        self.directory = directory
+        self.fallbackDirectory = fallbackDirectory
+        self.maximumSize = maximumSize
+
+    def getEvictCommand(self):
+        """
+        Get command that removes the least recently used cache entries until the cache
+        fits into its maximum size as well as abandoned uploads
+
+        :returns: command
+        :rtype: str
+        """
+        return (
+            "find {directory} -maxdepth 1 -type f -name '*.upload-*' -mmin +60 -delete 2>/dev/null; "
+            "find {directory} -maxdepth 1 -type f -regextype posix-extended -regex '.*/[0-9a-f]{{64}}' -printf '%T@ %s %p\\n' 2>/dev/null | "
+            "sort -n | "
+            "awk -v maximumSize={maximumSize} "
+            "'{{ total += $2; sizes[NR] = $2; paths[NR] = $3 }} END {{ for (i = 1; i <= NR && total > maximumSize; i++) {{ print paths[i]; total -= sizes[i] }} }}' | "
+            "xargs -r rm -f"
+        ).format(directory=pipes.quote(self.directory), maximumSize=self.maximumSize)
+
+    def getMissingHashes(self, hashes):
+        """
+        Get the hashes that are not in the cache yet and mark the others as recently used.
+        The cache directory is switched to the fallback directory if the user cannot write
+        to it.
+
+        :param hashes: hashes
+        :type hashes: [str]
+        :returns: missing hashes
+        :rtype: set
+        """
+        directories = [self.directory]
+        if self.fallbackDirectory:
+            directories.append(self.fallbackDirectory)
+        stdout, stderr, status = self.client.run(
+            "for directory in {directories}; do "
+            "if mkdir -p \"$directory\" 2>/dev/null && [ -w \"$directory\" ]; then "
+            "cd \"$directory\" && pwd && "
+            "for hash in {hashes}; do if [ -f $hash ]; then touch $hash; else echo $hash; fi; done; exit $?; "
+            "fi; done; echo 'No writable cache directory' >&2; exit 1".format(
+                directories=" ".join(quotePath(directory) for directory in directories),
+                hashes=" ".join(sorted(set(hashes)))))
+        if status != 0:
+            raise RuntimeError("Could not check artifact cache '{0}'".format(self.directory), status, stdout, stderr)
+        lines = stdout.splitlines()
+        if lines[0] != self.directory:
+            self.log.debug("%s: using artifact cache '%s' instead of '%s'", self.client.hostname, lines[0], self.directory)
+            self.directory = lines[0]
+        return set(lines[1:])
+
+    def materialize(self, fileNames, directory):
+        """
+        Make the local files available in the remote directory, only uploading
+        files whose content is not in the cache yet
+
+        :param fileNames: local file names
+        :type fileNames: [str]
+        :param directory: remote directory
+        :type directory: str
+        :returns: remote file names
+        :rtype: [str]
+        """
+        hashes = [getFileHash(fileName) for fileName in fileNames]
+        missingHashes = self.getMissingHashes(hashes)
+
+        commands = []
+        for fileName, fileHash in zip(fileNames, hashes):
+            if fileHash not in missingHashes:
+                self.log.debug("%s: '%s' already cached", self.client.hostname, fileName)
+                continue
+            missingHashes.remove(fileHash)
+            temporaryFileName = os.path.join(self.directory, "{0}.upload-{1}".format(fileHash, uuid.uuid4().hex[:8]))
+            if not self.client.upload(fileName, temporaryFileName):
+                raise RuntimeError("Could not upload '{0}'".format(fileName))
+            # only complete and correct uploads become cache entries
+            commands.append(
+                "{{ echo {hash}'  '{temporaryFileName} | sha256sum --check --status && mv -f {temporaryFileName} {cacheFileName} || "
+                "{{ rm -f {temporaryFileName}; echo 'Checksum mismatch for {fileName}' >&2; false; }}; }}".format(
+                    hash=fileHash,
+                    temporaryFileName=pipes.quote(temporaryFileName),
+                    cacheFileName=pipes.quote(os.path.join(self.directory, fileHash)),
+                    fileName=os.path.basename(fileName).replace("'", "")))
+
+        remoteFileNames = []
+        commands.append("mkdir -p {0}".format(pipes.quote(directory)))
+        for fileName, fileHash in zip(fileNames, hashes):
+            remoteFileName = os.path.join(directory, os.path.basename(fileName))
+            # copies instead of hard links such that modifying the files does not corrupt the cache
+            commands.append("cp -f {cacheFileName} {remoteFileName}".format(
+                cacheFileName=pipes.quote(os.path.join(self.directory, fileHash)),
+                remoteFileName=pipes.quote(remoteFileName)))
+            remoteFileNames.append(remoteFileName)
+
+        stdout, stderr, status = self.client.run("{0}; {1}".format(" && ".join(commands), self.getEvictCommand()))
+        if status != 0:
+            raise RuntimeError("Could not materialize files in '{0}'".format(directory), status, stdout, stderr)
+        return remoteFileNames
+
+def getFileHash(fileName):
+    """
+    Get the SHA-256 hash of a local file, hashes are remembered as long as the file does not change
+
+    :param fileName: file name
+    :type fileName: str
+    :returns: hex digest
+    :rtype: str
+    """
+    fileInfo = os.stat(fileName)
+    key = (os.path.abspath(fileName), fileInfo.st_size, fileInfo.st_mtime)
+    with fileHashesLock:
+        if key in fileHashes:
+            return fileHashes[key]
+
+    sha256 = hashlib.sha256()
+    with open(fileName, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            sha256.update(chunk)
+    with fileHashesLock:
+        fileHashes[key] = sha256.hexdigest()
+    return fileHashes[key]
+
+# this is a duplicate of client.quotePath since the client depends on this module
+def quotePath(path):
+    """
+    Quote the path for the shell while keeping a leading ``~/`` expandable
+
+    :param path: path
+    :type path: str
+    :returns: quoted path
+    :rtype: str
+    """
+    if path.startswith("~/"):
+        return '"$HOME"/{0}'.format(pipes.quote(path[2:]))
+    return pipes.quote(path)
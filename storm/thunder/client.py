@@ -5,23 +5,217 @@ This project is licensed under the MIT License, see LICENSE
 
 Functionality to connect to and manage remote nodes
 """
+import base64
+import collections
 import inspect
+import json
 import logging
+from multiprocessing.dummy import Pool as ThreadPool
 import os
+import pipes
 import types
+import select
 import socket
 import stat
 import string
 import StringIO
+import struct
+import threading
 import time
 import traceback
+import uuid
+import zlib
 
 from functools import wraps
 
 from libcloud.compute.ssh import ParamikoSSHClient, SSHCommandTimeoutError
+import paramiko
+
+from . import agent, transfer
+from .connection import ReadinessProber
 
 log = logging.getLogger(__name__)
 
+# replaces the block between the marker lines or appends it, prints nothing if the block is already present
+ENSURE_BLOCK_AWK_PROGRAM = r"""
+BEGIN {
+    block = ENVIRON["STORM_BLOCK"]
+    begin = "# BEGIN " ENVIRON["STORM_MARKER"]
+    end = "# END " ENVIRON["STORM_MARKER"]
+}
+{ lines[NR] = $0 }
+$0 == begin && !start { start = NR }
+$0 == end && start && !stop { stop = NR }
+END {
+    if (start && stop) {
+        current = ""
+        for (i = start + 1; i < stop; i++) {
+            current = current (i > start + 1 ? "\n" : "") lines[i]
+        }
+        if (current == block) {
+            exit
+        }
+    }
+    for (i = 1; i <= NR; i++) {
+        if (start && stop && i == start) {
+            break
+        }
+        print lines[i]
+    }
+    print begin
+    if (block != "") {
+        print block
+    }
+    print end
+    if (start && stop) {
+        for (i = stop + 1; i <= NR; i++) {
+            print lines[i]
+        }
+    }
+}
+"""
+
+# adds the hostnames to the first line of the ip address and removes them from all other lines
+# like agent.ensureHostsEntryInLines, prints nothing if the hostnames are already mapped to the ip address
+ENSURE_HOSTS_ENTRY_AWK_PROGRAM = r"""
+BEGIN {
+    ip = ENVIRON["STORM_IP"]
+    count = split(ENVIRON["STORM_HOSTNAMES"], hostnames, " ")
+    for (i = 1; i <= count; i++) {
+        wanted[hostnames[i]] = 1
+    }
+}
+{ lines[NR] = $0 }
+END {
+    for (i = 1; i <= NR; i++) {
+        entry = lines[i]
+        comment = ""
+        position = index(entry, "#")
+        if (position) {
+            comment = substr(entry, position)
+            entry = substr(entry, 1, position - 1)
+        }
+        numberOfFields = split(entry, fields, " ")
+        if (numberOfFields == 0) {
+            output[++numberOfLines] = lines[i]
+            continue
+        }
+        names = ""
+        numberOfNames = 0
+        changed = 0
+        if (fields[1] == ip && !found) {
+            found = 1
+            split("", present)
+            for (j = 2; j <= numberOfFields; j++) {
+                names = names " " fields[j]
+                present[fields[j]] = 1
+                numberOfNames++
+            }
+            for (j = 1; j <= count; j++) {
+                if (!(hostnames[j] in present)) {
+                    names = names " " hostnames[j]
+                    present[hostnames[j]] = 1
+                    numberOfNames++
+                    changed = 1
+                }
+            }
+        } else {
+            for (j = 2; j <= numberOfFields; j++) {
+                if (fields[j] in wanted) {
+                    changed = 1
+                } else {
+                    names = names " " fields[j]
+                    numberOfNames++
+                }
+            }
+        }
+        if (!changed) {
+            output[++numberOfLines] = lines[i]
+            continue
+        }
+        modified = 1
+        if (numberOfNames) {
+            output[++numberOfLines] = fields[1] names (comment != "" ? " " comment : "")
+        }
+    }
+    if (!found) {
+        names = ""
+        for (j = 1; j <= count; j++) {
+            names = names " " hostnames[j]
+        }
+        output[++numberOfLines] = ip names
+        modified = 1
+    }
+    if (!modified) {
+        exit
+    }
+    for (i = 1; i <= numberOfLines; i++) {
+        print output[i]
+    }
+}
+"""
+
+# replaces the first line that defines the key or appends the line, prints nothing if the line is already present
+ENSURE_LINE_AWK_PROGRAM = r"""
+function definesKey(text,    rest) {
+    sub(/^[ \t]+/, "", text)
+    if (substr(text, 1, length(key)) != key) {
+        return 0
+    }
+    rest = substr(text, length(key) + 1)
+    if (separator == "") {
+        return rest ~ /^[ \t]/
+    }
+    sub(/^[ \t]+/, "", rest)
+    return substr(rest, 1, length(separator)) == separator
+}
+BEGIN {
+    line = ENVIRON["STORM_LINE"]
+    key = ENVIRON["STORM_KEY"]
+    separator = ENVIRON["STORM_SEPARATOR"]
+}
+{ lines[NR] = $0 }
+$0 == line { present = 1 }
+END {
+    if (present) {
+        exit
+    }
+    for (i = 1; i <= NR; i++) {
+        if (!replaced && key != "" && definesKey(lines[i])) {
+            print line
+            replaced = 1
+        } else {
+            print lines[i]
+        }
+    }
+    if (!replaced) {
+        print line
+    }
+}
+"""
+
+DEFAULT_JOB_TIMEOUT = 4 * 60 * 60
+
+# runs an edit program on a locked file and replaces its contents in place if the program printed any
+EDIT_COMMAND = (
+    "path={path}; exec 9>>\"$path\" || exit 1; "
+    "if command -v flock > /dev/null; then flock 9; fi; "
+    "{environment} awk {program} \"$path\" > \"$path.storm-thunder\" && "
+    "if [ -s \"$path.storm-thunder\" ]; then cat \"$path.storm-thunder\" > \"$path\" && echo changed; else echo unchanged; fi; "
+    "status=$?; rm -f \"$path.storm-thunder\"; exit $status"
+)
+
+# exceptions that indicate a potential loss of the underlying transport
+TRANSPORT_EXCEPTIONS = (EOFError, socket.error, paramiko.SSHException)
+
+# detached jobs of all nodes are polled by a shared poller
+jobPoller = None
+jobPollerLock = threading.Lock()
+
+# (username, hostname, port) to shared jump host mapping
+jumpHosts = {}
+jumpHostsLock = threading.Lock()
+
 # TODO: this is a duplicate since we don't want a dependency here, the whole function should probably be moved into storm.utils
 def getFormattedArgumentString(arguments, keyValueArguments):
     """
@@ -118,21 +312,106 @@ def MethodExcecutionLogger(cls):
     for name, method in inspect.getmembers(cls, inspect.ismethod):
         if not name.startswith("_") and name != "connect":
             setattr(cls, name, methodLogger(cls, method))
-        if name.startswith("run"):
+        # TRICKY: runMany returns a list of results so it only gets the default method logger
+        if name.startswith("run") and name != "runMany":
             setattr(cls, name, runMethodLogger(cls, method))
     return cls
 
+def flushing(method):
+    """
+    Decorator that writes the pending edits of the file transaction before running the method
+    since the method might depend on the edited files
+    """
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        """
+        Actual flushing decorator
+        """
+        if self.fileTransaction and not self.fileTransaction.busy:
+            self.flushFiles()
+        return method(self, *args, **kwargs)
+    return wrapper
+
+def reconnecting(method):
+    """
+    Decorator that makes sure that the client is connected before running the method
+    """
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        """
+        Actual reconnecting decorator
+        """
+        self.ensureConnected()
+        return method(self, *args, **kwargs)
+    return wrapper
+
+def resumable(method):
+    """
+    Decorator for idempotent methods that makes sure that the client is connected
+    and replays the method once in case the transport was lost while running it
+    """
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        """
+        Actual resuming decorator
+        """
+        self.ensureConnected()
+        try:
+            return method(self, *args, **kwargs)
+        except TRANSPORT_EXCEPTIONS as exception:
+            if self.isConnected():
+                raise
+            self.log.warn("%s: lost connection during '%s': %s", self.hostname, method.func_name, exception)
+            self.ensureConnected()
+            return method(self, *args, **kwargs)
+    return wrapper
+
 @MethodExcecutionLogger
 class AdvancedSSHClient(ParamikoSSHClient):
     """
     Advanced SSH client that extends functionality of the base Paramiko client
+
+    If the transport is lost, e.g., because the node rebooted, the client transparently
+    reconnects using the original connection parameters. Idempotent operations
+    such as ``exists``, ``isFile`` and ``read`` are additionally replayed when the
+    transport is lost while they are running.
+
+    :param reconnectAttempts: number of reconnect attempts after the transport was lost
+    :type reconnectAttempts: int
+    :param reconnectDelay: initial delay in seconds between reconnect attempts, doubled after each attempt
+    :type reconnectDelay: float
+    :param proxy: optional jump host through which the connection to the node is established
+    :type proxy: :class:`~JumpHost`
+    :param useHelper: perform file and command operations through a :class:`~RemoteHelper`
+        instead of separate channels and SFTP sessions
+    :type useHelper: bool
     """
     def __init__(self, hostname, port=22, username='root', password=None,
-                 key=None, key_files=None, key_material=None, timeout=None):
+                 key=None, key_files=None, key_material=None, timeout=None,
+                 reconnectAttempts=3, reconnectDelay=2, proxy=None, useHelper=False):
         super(AdvancedSSHClient, self).__init__(
             hostname, port, username, password,
             key, key_files, key_material, timeout)
+        self.reconnectAttempts = reconnectAttempts
+        self.reconnectDelay = reconnectDelay
+        self.proxy = proxy
+        self.useHelper = useHelper
+        self.helper = None
+        self.fileTransaction = None
+
+    def beginFileTransaction(self):
+        """
+        Start a file transaction. Edits through :meth:`~ensureLine`, :meth:`~ensureBlock`
+        and :meth:`~setKeyValue` are then applied to a copy of each file that is read once,
+        and each modified file is written once when the edits are flushed.
 
+        Pending edits are flushed by :meth:`~flushFiles` and :meth:`~endFileTransaction` as
+        well as before any other file or command operation since it might depend on the files.
+        """
+        self.fileTransaction = FileTransaction(self)
+
+    @flushing
+    @resumable
     def chmod(self, path, mode):
         """
         Change the mode (permissions) of a file
@@ -142,17 +421,42 @@ class AdvancedSSHClient(ParamikoSSHClient):
         :param mode: permissions
         :type mode: int
         """
+        if self.useHelper:
+            try:
+                self.getHelper().call("chmod", path=path, mode=mode)
+            except RuntimeError as e:
+                if not self.isConnected():
+                    raise
+                log.error("Could not chmod '%s' to '%s' on '%s'", path, mode, self.hostname)
+                log.error(e)
+            return
+
         extra = {'_path': path}
         self.logger.debug('chmod', extra=extra)
         sftp = self.client.open_sftp()
         try:
             sftp.chmod(path, mode)
         except Exception as e:
+            # let transport errors through such that the call is replayed after reconnecting
+            if not self.isConnected():
+                raise
             log.error("Could not chmod '%s' to '%s' on '%s'", path, mode, self.hostname)
             log.error(e)
         finally:
             sftp.close()
 
+    def close(self):
+        """
+        Close the connection including the remote helper if it was started
+
+        :returns: close successful
+        :rtype: bool
+        """
+        if self.helper:
+            self.helper.close()
+            self.helper = None
+        return super(AdvancedSSHClient, self).close()
+
     def connect(self):
         """
         Connect
@@ -181,6 +485,9 @@ class AdvancedSSHClient(ParamikoSSHClient):
         if self.timeout:
             conninfo['timeout'] = self.timeout
 
+        if self.proxy:
+            conninfo['sock'] = self.proxy.openChannel(self.hostname, self.port)
+
         extra = {'_hostname': self.hostname, '_port': self.port,
                  '_username': self.username, '_timeout': self.timeout}
         self.logger.debug('Connecting to server', extra=extra)
@@ -188,7 +495,9 @@ class AdvancedSSHClient(ParamikoSSHClient):
         self.client.connect(**conninfo)
         return True
 
-    def download(self, remotepath, localpath=None, callback=None):
+    @flushing
+    @resumable
+    def download(self, remotepath, localpath=None, callback=None, compress=False):
         """
         Download a remote file to the local host
         :param remotepath: remote file to copy
@@ -197,6 +506,11 @@ class AdvancedSSHClient(ParamikoSSHClient):
         :type localpath: str
         :param callback: optional function that accepts the bytes transferred so far and the total bytes to be transferred
         :type form: func(int, int)
+        :param compress: compress files without a compressed file extension during the transfer,
+            only used without callback, see :func:`~storm.thunder.transfer.downloadCompressed`
+        :type compress: bool
+        :returns: number of bytes transferred or ``None`` if the file could not be downloaded
+        :rtype: int
         """
 
         if remotepath is None:
@@ -204,15 +518,137 @@ class AdvancedSSHClient(ParamikoSSHClient):
         if localpath is None:
             localpath = os.path.join(os.getcwd(), os.path.basename(remotepath))
 
+        if compress and callback is None and not transfer.hasCompressedExtension(remotepath):
+            try:
+                return transfer.downloadCompressed(self, remotepath, localpath)
+            except TRANSPORT_EXCEPTIONS:
+                raise
+            except Exception as e:
+                log.warning("Compressed download of '%s' from '%s' failed, downloading the uncompressed file: %s", remotepath, self.hostname, e)
+
         sftp = self.client.open_sftp()
         try:
+            # large files are transferred in bulk in order to keep the link busy
+            if sftp.stat(remotepath).st_size >= transfer.BULK_TRANSFER_SIZE:
+                return transfer.downloadBulk(self, remotepath, localpath, callback)
             sftp.get(remotepath, localpath, callback)
+            return os.path.getsize(localpath)
         except IOError, e:
             log.error("Couldn't download '{0}'".format(remotepath))
             log.error(e)
+            return None
         finally:
             sftp.close()
 
+    def endFileTransaction(self):
+        """
+        Flush the pending edits and end the file transaction, see :meth:`~beginFileTransaction`
+        """
+        self.flushFiles()
+        self.fileTransaction = None
+
+    def ensureBlock(self, path, block, marker="storm-thunder"):
+        """
+        Make sure that the file contains the block of lines between ``# BEGIN <marker>``
+        and ``# END <marker>`` lines. An existing block with the same marker is replaced,
+        otherwise the block is appended. The check and the edit happen on the node.
+
+        :param path: file path
+        :type path: str
+        :param block: block of lines
+        :type block: str
+        :param marker: marker that identifies the block
+        :type marker: str
+        :returns: whether the file was modified
+        :rtype: bool
+        """
+        block = block.rstrip("\n")
+        if self.fileTransaction:
+            return self.fileTransaction.ensureBlock(path, block, marker=marker)
+        if self.useHelper:
+            return self.getHelper().call("ensureBlock", path=path, block=block, marker=marker)
+
+        stdout, stderr, status = self.run(getEnsureBlockCommand(path, block, marker=marker))
+        if status != 0:
+            raise RuntimeError("Could not edit '{0}'".format(path), status, stdout, stderr)
+        return stdout.strip() == "changed"
+
+    def ensureConnected(self):
+        """
+        Make sure that the client is connected by reconnecting with exponential backoff
+        in case the transport was lost
+
+        :returns: connection successful
+        :rtype: bool
+        """
+        if self.isConnected():
+            return True
+        delay = self.reconnectDelay
+        for attempt in range(1, self.reconnectAttempts + 1):
+            try:
+                self.log.info("%s: transport lost, reconnecting (attempt %d of %d)", self.hostname, attempt, self.reconnectAttempts)
+                return self.reconnect()
+            except Exception as exception:
+                if attempt == self.reconnectAttempts:
+                    raise
+                self.log.debug("%s: could not reconnect: %s", self.hostname, exception)
+                time.sleep(delay)
+                delay *= 2
+
+    def ensureHostsEntry(self, path, ip, hostnames):
+        """
+        Make sure that the hosts file maps the hostnames to the ip address. The hostnames are
+        added to the first line of the ip address, or a new line, and removed from the lines
+        of other ip addresses. The check and the edit happen on the node.
+
+        :param path: hosts file path, usually ``/etc/hosts``
+        :type path: str
+        :param ip: ip address
+        :type ip: str
+        :param hostnames: hostnames
+        :type hostnames: [str]
+        :returns: whether the file was modified
+        :rtype: bool
+        """
+        if self.fileTransaction:
+            return self.fileTransaction.ensureHostsEntry(path, ip, hostnames)
+        if self.useHelper:
+            return self.getHelper().call("ensureHostsEntry", path=path, ip=ip, hostnames=list(hostnames))
+
+        stdout, stderr, status = self.run(getEnsureHostsEntryCommand(path, ip, hostnames))
+        if status != 0:
+            raise RuntimeError("Could not edit '{0}'".format(path), status, stdout, stderr)
+        return stdout.strip() == "changed"
+
+    def ensureLine(self, path, line, key=None, separator="="):
+        """
+        Make sure that the file contains the line. If a key is specified the first line
+        that defines the key, i.e., starts with the key followed by the separator, is
+        replaced, otherwise the line is appended. The check and the edit happen on the node.
+
+        :param path: file path
+        :type path: str
+        :param line: line
+        :type line: str
+        :param key: optional key of the line
+        :type key: str
+        :param separator: separator between key and value, whitespace only separators match any whitespace
+        :type separator: str
+        :returns: whether the file was modified
+        :rtype: bool
+        """
+        if self.fileTransaction:
+            return self.fileTransaction.ensureLine(path, line, key=key, separator=separator)
+        if self.useHelper:
+            return self.getHelper().call("ensureLine", path=path, line=line, key=key, separator=separator)
+
+        stdout, stderr, status = self.run(getEnsureLineCommand(path, line, key=key, separator=separator))
+        if status != 0:
+            raise RuntimeError("Could not edit '{0}'".format(path), status, stdout, stderr)
+        return stdout.strip() == "changed"
+
+    @flushing
+    @resumable
     def exists(self, path):
         """
         Check if the specified path exists
@@ -221,17 +657,52 @@ class AdvancedSSHClient(ParamikoSSHClient):
         :type path: str
         :returns: bool
         """
+        if self.useHelper:
+            return self.getHelper().call("exists", path=path)
+
         extra = {'_path': path}
         self.logger.debug('exists', extra=extra)
         sftp = self.client.open_sftp()
         try:
             sftp.stat(path)
         except:
+            if not self.isConnected():
+                raise
             return False
         finally:
             sftp.close()
         return True
 
+    def flushFiles(self):
+        """
+        Write the files with pending edits of the file transaction, see :meth:`~beginFileTransaction`
+        """
+        if self.fileTransaction:
+            self.fileTransaction.flush()
+
+    def getHelper(self):
+        """
+        Get the remote helper of the current session, starting it if necessary
+
+        :returns: remote helper
+        :rtype: :class:`~RemoteHelper`
+        """
+        if self.helper is None or not self.helper.isActive():
+            self.helper = RemoteHelper(self)
+            self.helper.start()
+        return self.helper
+
+    def isConnected(self):
+        """
+        Check if the client has an active transport
+
+        :returns: bool
+        """
+        transport = self.client.get_transport() if self.client else None
+        return transport is not None and transport.is_active()
+
+    @flushing
+    @resumable
     def isFile(self, path):
         """
         Check if the file specified by the path is a file
@@ -240,17 +711,23 @@ class AdvancedSSHClient(ParamikoSSHClient):
         :type path: str
         :returns: bool
         """
+        if self.useHelper:
+            return self.getHelper().call("isFile", path=path)
+
         extra = {'_path': path}
         self.logger.debug('Is file', extra=extra)
         sftp = self.client.open_sftp()
         try:
             statInfo = sftp.stat(path)
         except:
+            if not self.isConnected():
+                raise
             return False
         finally:
             sftp.close()
         return statInfo.st_mode & 0170000 == stat.S_IFREG
 
+    @resumable
     def mkdir(self, path):
         """
         Create directory specified by the path
@@ -258,6 +735,10 @@ class AdvancedSSHClient(ParamikoSSHClient):
         :param path: directory path
         :type path: str
         """
+        if self.useHelper:
+            self.getHelper().call("mkdir", path=path)
+            return
+
         extra = {'_path': path}
         self.logger.debug('Creating directory', extra=extra)
         sftp = self.client.open_sftp()
@@ -278,6 +759,29 @@ class AdvancedSSHClient(ParamikoSSHClient):
                 sftp.chdir(part)
         sftp.close()
 
+    @flushing
+    @reconnecting
+    def put(self, path, contents=None, chmod=None, mode='w'):
+        """
+        Create file with the specified contents
+
+        :param path: file path
+        :type path: str
+        :param contents: contents
+        :type contents: str
+        :param chmod: permissions
+        :type chmod: int
+        :param mode: file mode, e.g., ``a`` to append
+        :type mode: str
+        :returns: file path
+        :rtype: str
+        """
+        if self.useHelper:
+            return self.getHelper().call("put", path=path, content=base64.b64encode(contents or ""), mode=mode, chmod=chmod)
+        return super(AdvancedSSHClient, self).put(path, contents=contents, chmod=chmod, mode=mode)
+
+    @flushing
+    @resumable
     def read(self, path):
         """
         Read contents of the file specified by the path
@@ -286,6 +790,14 @@ class AdvancedSSHClient(ParamikoSSHClient):
         :type path: str
         :returns: str
         """
+        if self.useHelper:
+            try:
+                return base64.b64decode(self.getHelper().call("read", path=path))
+            except RuntimeError as e:
+                log.error("Could not read '%s' on '%s'", path, self.hostname)
+                log.error(e)
+                return ""
+
         extra = {'_path': path}
         self.logger.debug('Downloading file', extra=extra)
         sftp = self.client.open_sftp()
@@ -296,12 +808,28 @@ class AdvancedSSHClient(ParamikoSSHClient):
             with sftp.file(tail, mode="r") as f:
                 content = f.read()
         except Exception as e:
+            if not self.isConnected():
+                raise
             log.error("Could not read '%s' on '%s'", path, self.hostname)
             log.error(e)
         finally:
             sftp.close()
         return content
 
+    def reconnect(self):
+        """
+        Reconnect using the original connection parameters, e.g., after the node was rebooted
+
+        :returns: connection successful
+        :rtype: bool
+        """
+        self.close()
+        self.client = paramiko.SSHClient()
+        self.client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        return self.connect()
+
+    @flushing
+    @reconnecting
     def run(self, cmd, timeout=None, pseudoTTY=False):
         """
         Run the specified command
@@ -317,6 +845,10 @@ class AdvancedSSHClient(ParamikoSSHClient):
         :param pseudoTTY: allocate a pseudo tty
         :type pseudoTTY: bool
         """
+        if self.useHelper and timeout is None and not pseudoTTY:
+            result = self.getHelper().call("run", command=cmd)
+            return base64.b64decode(result["stdout"]), base64.b64decode(result["stderr"]), result["status"]
+
         extra = {'_cmd': cmd}
         self.logger.debug('Executing command', extra=extra)
 
@@ -404,6 +936,114 @@ class AdvancedSSHClient(ParamikoSSHClient):
 
         return [stdout, stderr, status]
 
+    @flushing
+    @reconnecting
+    def runMany(self, commands, maxConcurrent=5, timeout=None):
+        """
+        Run the specified commands concurrently using separate session channels
+        on the same transport
+
+        Note that SSH servers limit the number of sessions per connection, e.g.,
+        ``MaxSessions`` of OpenSSH defaults to 10.
+
+        :param commands: commands
+        :type commands: [str]
+        :param maxConcurrent: maximum number of commands that run at the same time
+        :type maxConcurrent: int
+        :param timeout: How long to wait (in seconds) for all commands to
+                        finish (optional).
+        :type timeout: float
+        :returns: stdout, stderr and status for each command in the order of the commands
+        :rtype: [(str, str, int)]
+        """
+        transport = self.client.get_transport()
+        pending = list(enumerate(commands))
+        running = {}
+        outputs = {}
+        results = [None] * len(commands)
+
+        start_time = time.time()
+        try:
+            while pending or running:
+
+                while pending and len(running) < maxConcurrent:
+                    index, command = pending.pop(0)
+                    chan = transport.open_session()
+                    chan.exec_command(command)
+                    # prevent interactive commands from hanging
+                    chan.shutdown_write()
+                    running[chan] = index
+                    outputs[index] = (StringIO.StringIO(), StringIO.StringIO())
+
+                if timeout and time.time() - start_time > timeout:
+                    raise SSHCommandTimeoutError(cmd=commands[running.values()[0]], timeout=timeout)
+
+                # wait until any of the channels has new data or finished
+                select.select(running.keys(), [], [], 1)
+
+                for chan, index in running.items():
+                    stdout, stderr = outputs[index]
+                    while chan.recv_ready():
+                        stdout.write(chan.recv(self.CHUNK_SIZE))
+                    while chan.recv_stderr_ready():
+                        stderr.write(chan.recv_stderr(self.CHUNK_SIZE))
+                    if chan.exit_status_ready() and not chan.recv_ready() and not chan.recv_stderr_ready():
+                        status = chan.recv_exit_status()
+                        chan.close()
+                        del running[chan]
+                        results[index] = (stdout.getvalue(), stderr.getvalue(), status)
+                        if status != 0:
+                            self.log.debug("%s: '%s' status: %s", self.hostname, commands[index], status)
+        finally:
+            for chan in running:
+                chan.close()
+
+        return results
+
+    def setKeyValue(self, path, key, value, separator=" = "):
+        """
+        Make sure that the key is set to the value in a configuration file, see :meth:`~ensureLine`
+
+        .. code-block:: python
+
+            client.setKeyValue("/etc/sysctl.conf", "vm.swappiness", 10)
+
+        :param path: file path
+        :type path: str
+        :param key: key
+        :type key: str
+        :param value: value
+        :type value: str
+        :param separator: separator between key and value
+        :type separator: str
+        :returns: whether the file was modified
+        :rtype: bool
+        """
+        return self.ensureLine(path, "{0}{1}{2}".format(key, separator, value), key=key, separator=separator)
+
+    @flushing
+    def startJob(self, command):
+        """
+        Start the specified command detached from the connection. Its output and exit
+        status are written to files in a remote job directory such that the command
+        survives lost connections and does not keep a channel open while it is running.
+
+        .. code-block:: python
+
+            job = client.startJob("make all")
+            stdout, stderr, status = job.wait()
+
+        :param command: command
+        :type command: str
+        :returns: remote job
+        :rtype: :class:`~RemoteJob`
+        """
+        job = RemoteJob(self, command)
+        job.start()
+        return job
+
+    @flushing
+    @resumable
     def touch(self, path):
         """
         Touch file specified by path
@@ -411,6 +1051,14 @@ class AdvancedSSHClient(ParamikoSSHClient):
         :param path: file path
         :type path: str
         """
+        if self.useHelper:
+            try:
+                self.getHelper().call("touch", path=path)
+            except RuntimeError as e:
+                log.error("Could not touch '%s' on '%s'", path, self.hostname)
+                log.error(e)
+            return
+
         extra = {'_path': path}
         self.logger.debug('touch file', extra=extra)
         sftp = self.client.open_sftp()
@@ -427,7 +1075,9 @@ class AdvancedSSHClient(ParamikoSSHClient):
         finally:
             sftp.close()
 
-    def upload(self, filenames, remotefileOrDirname):
+    @flushing
+    @reconnecting
+    def upload(self, filenames, remotefileOrDirname, delta=False, compress=False, maxConcurrent=4, statistics=None):
         """
         Upload local file specified by the path
 
@@ -435,73 +1085,624 @@ class AdvancedSSHClient(ParamikoSSHClient):
         :type filename: str or list
         :param remotefileOrDirname: file path or dir name if multiple files are to be uploaded
         :type remotefileOrDirname: str
+        :param delta: only send the data that differs from existing remote files, see :func:`~storm.thunder.transfer.uploadDelta`
+        :type delta: bool
+        :param compress: compress files whose samples compress well during the transfer,
+            see :func:`~storm.thunder.transfer.uploadCompressed`
+        :type compress: bool
+        :param maxConcurrent: maximum number of SFTP sessions that upload multiple files concurrently
+        :type maxConcurrent: int
+        :param statistics: optional dictionary that receives the number of bytes transferred
+            for each file path that has been successfully uploaded
+        :type statistics: dict
         :returns: [ file path(s) that have been successfully uploaded ]
         """
         def putWithConfirmation(sftp, filename, remotefilename):
+            """
+            Upload the file and return the number of bytes transferred or ``None`` if it failed
+            """
+            if delta:
+                try:
+                    literalSize = transfer.uploadDelta(self.getHelper(), filename, remotefilename)
+                    if literalSize is not None:
+                        return literalSize
+                except Exception as e:
+                    log.warning("Delta upload of '%s' to '%s' failed, uploading the whole file: %s", filename, self.hostname, e)
+            if compress and transfer.isCompressible(filename):
+                try:
+                    return transfer.uploadCompressed(self, filename, remotefilename)
+                except Exception as e:
+                    log.warning("Compressed upload of '%s' to '%s' failed, uploading the uncompressed file: %s", filename, self.hostname, e)
             try:
-                sftp.put(filename, remotefilename, confirm=True)
-                return True
+                # large files are transferred in bulk in order to keep the link busy
+                if os.path.isfile(filename) and os.path.getsize(filename) >= transfer.BULK_TRANSFER_SIZE:
+                    return transfer.uploadBulk(self, filename, remotefilename)
+                return sftp.put(filename, remotefilename, confirm=True).st_size
             except IOError, e:
                 log.error("Couldn't upload {0} : {1}".format(filename, traceback.format_exception_only(IOError, e)))
-                return False
+                return None
 
         extra = {'_path': filenames}
         self.logger.debug('Uploading file(s)', extra=extra)
         uploaded = []
-        with self.client.open_sftp() as sftp:
-            if type(filenames) == types.ListType:
-                for filename in filenames:
-                    remotefilename = os.path.join(remotefileOrDirname, os.path.basename(filename))
-                    if putWithConfirmation(sftp, filename, remotefilename):
-                        uploaded.append(filename)
+        if type(filenames) == types.ListType:
+            if delta:
+                # start the helper before the sessions share it
+                self.getHelper()
+            pending = collections.deque(filenames)
+            results = {}
+
+            def uploadPending(session):
+                """
+                Upload pending files over a separate SFTP session until none are left
+                """
+                try:
+                    sftp = self.client.open_sftp()
+                except Exception as e:
+                    # leave the pending files to the other sessions
+                    log.error("%s: could not open SFTP session %d: %s", self.hostname, session, e)
+                    return
+                with sftp:
+                    while True:
+                        try:
+                            filename = pending.popleft()
+                        except IndexError:
+                            return
+                        remotefilename = os.path.join(remotefileOrDirname, os.path.basename(filename))
+                        try:
+                            results[filename] = putWithConfirmation(sftp, filename, remotefilename)
+                        except Exception as e:
+                            log.error("Couldn't upload %s: %s", filename, e)
+                            results[filename] = None
+                        log.debug("%s: %s '%s' (%d of %d files done, session %d)",
+                                  self.hostname, "uploaded" if results[filename] is not None else "failed to upload",
+                                  filename, len(results), len(filenames), session)
+
+            numberOfSessions = max(1, min(maxConcurrent, len(filenames)))
+            if numberOfSessions == 1:
+                uploadPending(1)
             else:
-                # filenames is not a list, its a single file to be uploaded
-                if putWithConfirmation(sftp, filenames, remotefileOrDirname):
-                    uploaded.append(filenames)
-
+                pool = ThreadPool(processes=numberOfSessions)
+                pool.map(uploadPending, range(1, numberOfSessions + 1))
+                pool.close()
+                pool.join()
+            # files left over when no session could be opened
+            for filename in pending:
+                log.error("Couldn't upload %s: no SFTP session to '%s'", filename, self.hostname)
+                results[filename] = None
+            uploaded = [filename for filename in filenames if results.get(filename) is not None]
+        else:
+            # filenames is not a list, its a single file to be uploaded
+            with self.client.open_sftp() as sftp:
+                results = {filenames: putWithConfirmation(sftp, filenames, remotefileOrDirname)}
+            if results[filenames] is not None:
+                uploaded.append(filenames)
+
+        if statistics is not None:
+            statistics.update((filename, results[filename]) for filename in uploaded)
         return uploaded
 
     def waitForReady(self, initialWait=None, pollfrequency=5, timeout=600):
         """
-        Wait until the node is ready, that is its network interface is up
+        Wait until the node is ready, that is its SSH server accepts connections and sends its banner
+
+        Use :class:`~storm.thunder.connection.ReadinessProber` directly to wait for many nodes at once.
+
         :param initialWait: initial wait time before polling can start
         :type initialWait: int
-        :param pollfrequency: polling frequency
+        :param pollfrequency: maximum time between polls, polls back off exponentially up to it
         :type pollfrequency: int
         :param timeout: timeout
         :type timeout: int
         :returns True if waiting for a ready state does not time out, else False
         :rtype boolean
         """
+        if self.proxy:
+            # nodes behind a jump host cannot be probed directly so attempt to reconnect instead
+            if initialWait:
+                time.sleep(initialWait)
+            end = time.time() + timeout
+            delay = 1
+            while time.time() < end:
+                try:
+                    self.reconnect()
+                    return True
+                except Exception as exception:
+                    self.log.debug("%s: not ready yet: %s", self.hostname, exception)
+                time.sleep(min(delay, max(end - time.time(), 0)))
+                delay = min(delay * 2, max(pollfrequency, 1))
+            self.log.error("Waiting for '{0}' timed out after '{1}' seconds".format(self.hostname, timeout))
+            return False
 
-        # sleep time should always be a minimum 2 seconds between each poll
-        if pollfrequency < 2:
-            pollfrequency = 2
+        prober = ReadinessProber(maximumDelay=max(pollfrequency, 1))
+        prober.add(self.hostname, self.hostname, port=self.port, delay=initialWait or 0)
+        ready, _ = prober.wait(timeout=timeout)
+        if not ready:
+            self.log.error("Waiting for '{0}' timed out after '{1}' seconds".format(self.hostname, timeout))
+            return False
 
-        if initialWait:
-            time.sleep(initialWait)
+        return True
 
-        pollfrequency -= 1
-        sshSocket = socket.socket()
-        sshSocket.settimeout(1)
-        start = time.time()
-        end = start + timeout
-        while time.time() < end:
+class FileTransaction(object):
+    """
+    Remote file transaction that reads each file once, applies edits locally and
+    writes each modified file once using a temporary file and a rename, see
+    :meth:`~AdvancedSSHClient.beginFileTransaction`
 
+    :param client: connected ssh client
+    :type client: :class:`~AdvancedSSHClient`
+    """
+    def __init__(self, client):
+        self.client = client
+        self.busy = False
+        self.files = collections.OrderedDict()
+        self.modified = set()
+
+    def ensureBlock(self, path, block, marker="storm-thunder"):
+        """
+        Make sure that the file contains the block, see :meth:`~AdvancedSSHClient.ensureBlock`
+
+        :returns: whether the file was modified
+        :rtype: bool
+        """
+        if agent.ensureBlockInLines(self.getLines(path), block, marker=marker):
+            self.modified.add(path)
+            return True
+        return False
+
+    def ensureHostsEntry(self, path, ip, hostnames):
+        """
+        Make sure that the hosts file maps the hostnames to the ip address, see :meth:`~AdvancedSSHClient.ensureHostsEntry`
+
+        :returns: whether the file was modified
+        :rtype: bool
+        """
+        if agent.ensureHostsEntryInLines(self.getLines(path), ip, hostnames):
+            self.modified.add(path)
+            return True
+        return False
+
+    def ensureLine(self, path, line, key=None, separator="="):
+        """
+        Make sure that the file contains the line, see :meth:`~AdvancedSSHClient.ensureLine`
+
+        :returns: whether the file was modified
+        :rtype: bool
+        """
+        if agent.ensureLineInLines(self.getLines(path), line, key=key, separator=separator):
+            self.modified.add(path)
+            return True
+        return False
+
+    def flush(self):
+        """
+        Write the modified files and forget the read files such that subsequent
+        edits see changes that were made by other operations
+        """
+        files = self.files
+        modified = [path for path in files if path in self.modified]
+        self.files = collections.OrderedDict()
+        self.modified = set()
+        if not modified:
+            return
+
+        self.busy = True
+        try:
+            commands = []
+            for path in modified:
+                # paths are relative to the home directory for both SFTP and the helper
+                temporaryPath = "{0}.storm-thunder-{1}".format(path[2:] if path.startswith("~/") else path, uuid.uuid4().hex[:8])
+                self.client.put(temporaryPath, contents="".join(line + "\n" for line in files[path]))
+                commands.append(
+                    "{{ chown --reference={path} {temporaryPath} 2>/dev/null; "
+                    "chmod --reference={path} {temporaryPath} 2>/dev/null; "
+                    "mv -f {temporaryPath} {path}; }}".format(path=quotePath(path), temporaryPath=pipes.quote(temporaryPath)))
+            stdout, stderr, status = self.client.run(" && ".join(commands))
+            if status != 0:
+                raise RuntimeError("Could not write '{0}'".format("', '".join(modified)), status, stdout, stderr)
+        finally:
+            self.busy = False
+        log.debug("%s: wrote '%s'", self.client.hostname, "', '".join(modified))
+
+    def getLines(self, path):
+        """
+        Get the lines of the file, reading it if necessary
+
+        :param path: file path
+        :type path: str
+        :returns: lines
+        :rtype: [str]
+        """
+        if path not in self.files:
+            self.busy = True
             try:
-                sshSocket.connect((self.hostname, self.port))
-                sshSocket.recv(256)
-                break
-            except:
-                time.sleep(pollfrequency)
+                stdout, stderr, status = self.client.run("if [ -e {0} ]; then cat {0}; fi".format(quotePath(path)))
+            finally:
+                self.busy = False
+            if status != 0:
+                raise RuntimeError("Could not read '{0}'".format(path), status, stdout, stderr)
+            self.files[path] = stdout.splitlines()
+        return self.files[path]
+
+class JobPoller(object):
+    """
+    Poller that periodically checks the status of the detached jobs of all nodes
+    using a single batched command per node
+
+    :param interval: poll interval in seconds
+    :type interval: float
+    :param numberOfParallelPolls: number of nodes to poll in parallel
+    :type numberOfParallelPolls: int
+    :param maximumPollFailures: number of consecutive failed polls of a node after which its jobs are considered lost
+    :type maximumPollFailures: int
+    """
+    def __init__(self, interval=10, numberOfParallelPolls=20, maximumPollFailures=6):
+        self.interval = interval
+        self.maximumPollFailures = maximumPollFailures
+        self.numberOfParallelPolls = numberOfParallelPolls
+        self.jobs = []
+        self.lock = threading.Lock()
+        # client to number of consecutive failed polls mapping
+        self.pollFailures = {}
+        self.thread = None
+
+    def add(self, job):
+        """
+        Add job to be polled until it is done, starting the poller thread if necessary
 
-        sshSocket.close()
-        if time.time() > end:
-            self.log.error("Waiting for '{0}' timed out after '{1}' seconds".format(self.hostname, timeout))
-            return False
+        :param job: remote job
+        :type job: :class:`~RemoteJob`
+        """
+        with self.lock:
+            self.jobs.append(job)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name="JobPoller")
+                self.thread.daemon = True
+                self.thread.start()
+
+    def poll(self):
+        """
+        Check the status of all jobs once and mark the ones that are done
+        """
+        with self.lock:
+            jobsByClient = collections.OrderedDict()
+            for job in self.jobs:
+                jobsByClient.setdefault(job.client, []).append(job)
 
-        return True
+        def pollClient(clientJobs):
+            """
+            Check the status of the jobs of a single node
+            """
+            client, jobs = clientJobs
+            # a job without status file whose process is gone ended without reporting its status
+            checks = [
+                "if [ -f {directory}/status ]; then echo {directory} $(cat {directory}/status); "
+                "elif ! kill -0 {pid} 2>/dev/null && [ ! -f {directory}/status ]; then echo {directory} lost; fi".format(
+                    directory=job.directory,
+                    pid=job.pid)
+                for job in jobs
+            ]
+            try:
+                stdout, stderr, status = client.run("; ".join(checks))
+                error = stderr if status != 0 else None
+            except Exception as exception:
+                error = exception
+            if error:
+                self.pollFailures[client] = self.pollFailures.get(client, 0) + 1
+                log.warn("%s: could not poll jobs (%d/%d): %s",
+                         client.hostname, self.pollFailures[client], self.maximumPollFailures, error)
+                # the node is gone or unreachable so the jobs cannot be finished normally
+                if self.pollFailures[client] >= self.maximumPollFailures:
+                    for job in jobs:
+                        job.lose("Could not poll job {0} times: {1}".format(self.pollFailures[client], error))
+                return
+            self.pollFailures.pop(client, None)
+            statuses = dict(line.split(" ", 1) for line in stdout.splitlines() if " " in line)
+            for job in jobs:
+                if job.directory in statuses:
+                    jobStatus = statuses[job.directory].strip()
+                    job.finish(int(jobStatus) if jobStatus.lstrip("-").isdigit() else None)
+
+        if jobsByClient:
+            pool = ThreadPool(processes=min(self.numberOfParallelPolls, len(jobsByClient)))
+            pool.map(pollClient, jobsByClient.items())
+            pool.close()
+            pool.join()
+
+        with self.lock:
+            self.jobs = [job for job in self.jobs if not job.isDone()]
+            clients = set(job.client for job in self.jobs)
+            for client in self.pollFailures.keys():
+                if client not in clients:
+                    del self.pollFailures[client]
+
+    def _run(self):
+        """
+        Poll jobs until there are no more jobs left
+        """
+        while True:
+            time.sleep(self.interval)
+            self.poll()
+            with self.lock:
+                if not self.jobs:
+                    self.thread = None
+                    return
+
+class JumpHost(object):
+    """
+    Shared connection to a jump host, also known as bastion, that opens a ``direct-tcpip``
+    channel for each node connection. This way connecting to many nodes behind the
+    jump host only requires a single handshake with the jump host.
 
+    .. code-block:: python
+
+        jumpHost = JumpHost("bastion.example.com")
+        client = AdvancedSSHClient("10.0.0.1", proxy=jumpHost)
+        client.connect()
+
+    :param hostname: host name or ip address of the jump host
+    :type hostname: str
+    :param port: port
+    :type port: int
+    :param username: user name
+    :type username: str
+    :param password: SSH password
+    :type password: str
+    :param timeout: connection and channel open timeout in seconds
+    :type timeout: float
+    :param maximumPendingChannels: maximum number of channels that are being opened at the same time
+    :type maximumPendingChannels: int
+    """
+    def __init__(self, hostname, port=22, username="root", password=None, timeout=None, maximumPendingChannels=10):
+        self.hostname = hostname
+        self.port = port
+        self.timeout = timeout
+        self.client = AdvancedSSHClient(hostname, port=port, username=username, password=password, timeout=timeout)
+        self.lock = threading.Lock()
+        self.pendingChannels = threading.BoundedSemaphore(maximumPendingChannels)
+        # number of users of the shared jump host, see getJumpHost and releaseJumpHost
+        self.references = 0
+
+    def close(self):
+        """
+        Close the connection to the jump host and therefore all channels
+        """
+        with self.lock:
+            self.client.close()
+
+    def openChannel(self, hostname, port=22):
+        """
+        Open a channel to the specified host and port through the jump host
+
+        :param hostname: host name or ip address as seen from the jump host
+        :type hostname: str
+        :param port: port
+        :type port: int
+        :returns: channel that can be used as socket
+        :rtype: :class:`paramiko.Channel`
+        """
+        with self.lock:
+            if not self.client.isConnected():
+                self.client.reconnect()
+            transport = self.client.client.get_transport()
+        with self.pendingChannels:
+            return transport.open_channel("direct-tcpip", (hostname, port), ("127.0.0.1", 0), timeout=self.timeout)
+
+class RemoteHelper(object):
+    """
+    Client side of the :mod:`~storm.thunder.agent` that performs file and command operations
+    on a node through a single exec channel. Requests can be pipelined using :meth:`batch`
+    such that many small operations only cost a single round trip.
+
+    .. code-block:: python
+
+        helper = RemoteHelper(client)
+        helper.start()
+        exists, isFile = helper.batch([("exists", {"path": "/tmp"}), ("isFile", {"path": "/etc/hosts"})])
+
+    :param client: connected ssh client
+    :type client: :class:`~AdvancedSSHClient`
+    """
+    def __init__(self, client):
+        self.client = client
+        self.channel = None
+        self.inputStream = None
+        self.lock = threading.Lock()
+        self.nextId = 1
+
+    def batch(self, requests):
+        """
+        Send all requests before reading their responses
+
+        :param requests: list of operation and arguments tuples
+        :type requests: [(str, dict)]
+        :returns: results in the order of the requests
+        :rtype: list
+        :raises RuntimeError: if any of the operations failed
+        """
+        with self.lock:
+            ids = []
+            for operation, arguments in requests:
+                ids.append(self.nextId)
+                self._writeFrame({"id": self.nextId, "operation": operation, "arguments": arguments})
+                self.nextId += 1
+
+            # always read all responses in order to keep the stream in sync
+            responses = [self._readFrame() for _ in ids]
+
+        results = []
+        for requestId, response in zip(ids, responses):
+            if response.get("id") != requestId:
+                raise RuntimeError("Unexpected response '{0}' for request {1} from helper on '{2}'".format(response, requestId, self.client.hostname))
+            if "error" in response:
+                raise RuntimeError("Helper on '{0}' could not run '{1}': {2}".format(
+                    self.client.hostname, requests[ids.index(requestId)][0], response["error"]))
+            results.append(response.get("result"))
+        return results
+
+    def call(self, operation, **arguments):
+        """
+        Perform a single operation
+
+        :param operation: operation, e.g., ``isFile``
+        :type operation: str
+        :returns: result
+        :raises RuntimeError: if the operation failed
+        """
+        return self.batch([(operation, arguments)])[0]
+
+    def close(self):
+        """
+        Stop the helper by closing its channel
+        """
+        if self.channel:
+            self.channel.close()
+            self.channel = None
+
+    def isActive(self):
+        """
+        Check if the helper channel is still usable
+
+        :returns: bool
+        """
+        return self.channel is not None and not self.channel.closed and not self.channel.exit_status_ready()
+
+    def start(self):
+        """
+        Start the helper on the node using the first Python interpreter found. The agent
+        is passed along with the command such that it does not require a separate upload.
+        """
+        source = base64.b64encode(zlib.compress(inspect.getsource(agent)))
+        command = ("exec $(command -v python3 || command -v python || command -v python2) -c "
+                   "'import base64,zlib;exec(zlib.decompress(base64.b64decode(\"{0}\")))'").format(source)
+        self.channel = self.client.client.get_transport().open_session()
+        self.channel.exec_command(command)
+        self.inputStream = self.channel.makefile("rb")
+
+    def _readFrame(self):
+        """
+        Read a single response frame
+
+        :returns: response
+        :rtype: dict
+        """
+        header = self.inputStream.read(4)
+        if len(header) < 4:
+            error = self.channel.makefile_stderr("rb").read().strip()
+            self.close()
+            raise RuntimeError("Helper on '{0}' stopped unexpectedly: {1}".format(self.client.hostname, error))
+        length = struct.unpack(">I", header)[0]
+        return json.loads(self.inputStream.read(length))
+
+    def _writeFrame(self, document):
+        """
+        Write a single request frame
+
+        :param document: request
+        :type document: dict
+        """
+        data = json.dumps(document)
+        self.channel.sendall(struct.pack(">I", len(data)) + data)
+
+class RemoteJob(object):
+    """
+    Command that runs detached on a node, see :meth:`~AdvancedSSHClient.startJob`
+
+    :param client: connected ssh client
+    :type client: :class:`~AdvancedSSHClient`
+    :param command: command
+    :type command: str
+    """
+    def __init__(self, client, command):
+        self.client = client
+        self.command = command
+        self.directory = None
+        self.pid = None
+        self.status = None
+        self.done = threading.Event()
+        self.lostReason = None
+
+    def finish(self, status):
+        """
+        Mark job as done
+
+        :param status: exit status or ``None`` if the job ended without reporting one
+        :type status: int
+        """
+        self.status = status
+        self.done.set()
+
+    def getResult(self):
+        """
+        Get the result of the finished job and remove its job directory
+
+        :returns: stdout, stderr, status
+        :rtype: (str, str, int)
+        """
+        if self.lostReason:
+            # the node cannot be reached so do not try to read the output
+            return "", "Job was lost: {0}".format(self.lostReason), -1
+        stdout = self.client.read("{0}/stdout".format(self.directory))
+        stderr = self.client.read("{0}/stderr".format(self.directory))
+        status = self.status
+        if status is None:
+            stderr += "\nJob ended without reporting an exit status"
+            status = -1
+        self.client.run("/bin/rm -rf {0}".format(self.directory))
+        return stdout, stderr, status
+
+    def isDone(self):
+        """
+        Check if the job is done
+
+        :returns: bool
+        """
+        return self.done.is_set()
+
+    def lose(self, reason):
+        """
+        Mark job as done without a result because its node could not be reached
+
+        :param reason: reason
+        :type reason: str
+        """
+        self.lostReason = reason
+        self.finish(None)
+
+    def start(self):
+        """
+        Start the job in a new session that is not affected by the connection going away
+        """
+        script = '( {command} ) > "$1/stdout" 2> "$1/stderr" < /dev/null; echo $? > "$1/status.tmp" && mv "$1/status.tmp" "$1/status"'.format(
+            command=self.command)
+        stdout, stderr, status = self.client.run(
+            "directory=$(/bin/mktemp --directory -t storm-thunder-job-XXXXXXXX) || exit 1; "
+            "nohup setsid /bin/bash -c {script} storm-thunder-job \"$directory\" > /dev/null 2>&1 < /dev/null & "
+            "echo \"$directory\" $!".format(script=pipes.quote(script)))
+        if status != 0:
+            raise RuntimeError("Could not start job", status, stdout, stderr)
+        self.directory, self.pid = stdout.split()
+        log.debug("%s: started job '%s' in '%s'", self.client.hostname, self.command, self.directory)
+
+    def wait(self, timeout=DEFAULT_JOB_TIMEOUT):
+        """
+        Wait for the job to finish, the status is checked by the shared :class:`~JobPoller`
+
+        Jobs whose node cannot be polled anymore finish with status ``-1``.
+
+        :param timeout: How long to wait (in seconds) for the job to
+                        finish, ``None`` to wait without limit.
+        :type timeout: float
+        :returns: stdout, stderr, status
+        :rtype: (str, str, int)
+        """
+        getJobPoller().add(self)
+        end = time.time() + timeout if timeout is not None else None
+        # wait in short intervals such that the wait can be interrupted
+        while not self.done.wait(1 if end is None else max(0, min(1, end - time.time()))):
+            if end is not None and time.time() >= end:
+                raise SSHCommandTimeoutError(cmd=self.command, timeout=timeout)
+        return self.getResult()
 
 class RemoteTemporaryDirectory(object):
     """
@@ -541,3 +1742,168 @@ class RemoteTemporaryDirectory(object):
         if exception:
             return False
         return True
+
+def getEnsureBlockCommand(path, block, marker="storm-thunder", builder=None):
+    """
+    Get shell command that makes sure that the file contains the block, see :meth:`~AdvancedSSHClient.ensureBlock`
+
+    The command prints ``changed`` or ``unchanged``, a leading ``~/`` in the path refers to the home directory.
+
+    :param path: file path
+    :type path: str
+    :param block: block of lines
+    :type block: str
+    :param marker: marker that identifies the block
+    :type marker: str
+    :param builder: optional script builder that defines the awk program once in its script header
+        instead of repeating it in each command
+    :type builder: :class:`~storm.thunder.script.ScriptBuilder`
+    :returns: command
+    :rtype: str
+    """
+    if builder:
+        program = builder.addDefinition("STORM_ENSURE_BLOCK_AWK_PROGRAM", ENSURE_BLOCK_AWK_PROGRAM)
+    else:
+        program = pipes.quote(ENSURE_BLOCK_AWK_PROGRAM)
+    return EDIT_COMMAND.format(
+        path=quotePath(path),
+        environment="STORM_BLOCK={0} STORM_MARKER={1}".format(pipes.quote(block.rstrip("\n")), pipes.quote(marker)),
+        program=program)
+
+def getEnsureHostsEntryCommand(path, ip, hostnames, builder=None):
+    """
+    Get shell command that makes sure that the hosts file maps the hostnames to the ip address,
+    see :meth:`~AdvancedSSHClient.ensureHostsEntry`
+
+    The command prints ``changed`` or ``unchanged``, a leading ``~/`` in the path refers to the home directory.
+
+    :param path: hosts file path
+    :type path: str
+    :param ip: ip address
+    :type ip: str
+    :param hostnames: hostnames
+    :type hostnames: [str]
+    :param builder: optional script builder that defines the awk program once in its script header
+        instead of repeating it in each command
+    :type builder: :class:`~storm.thunder.script.ScriptBuilder`
+    :returns: command
+    :rtype: str
+    """
+    if builder:
+        program = builder.addDefinition("STORM_ENSURE_HOSTS_ENTRY_AWK_PROGRAM", ENSURE_HOSTS_ENTRY_AWK_PROGRAM)
+    else:
+        program = pipes.quote(ENSURE_HOSTS_ENTRY_AWK_PROGRAM)
+    return EDIT_COMMAND.format(
+        path=quotePath(path),
+        environment="STORM_IP={0} STORM_HOSTNAMES={1}".format(pipes.quote(ip), pipes.quote(" ".join(hostnames))),
+        program=program)
+
+def getEnsureLineCommand(path, line, key=None, separator="=", builder=None):
+    """
+    Get shell command that makes sure that the file contains the line, see :meth:`~AdvancedSSHClient.ensureLine`
+
+    The command prints ``changed`` or ``unchanged``, a leading ``~/`` in the path refers to the home directory.
+
+    :param path: file path
+    :type path: str
+    :param line: line
+    :type line: str
+    :param key: optional key of the line
+    :type key: str
+    :param separator: separator between key and value
+    :type separator: str
+    :param builder: optional script builder that defines the awk program once in its script header
+        instead of repeating it in each command
+    :type builder: :class:`~storm.thunder.script.ScriptBuilder`
+    :returns: command
+    :rtype: str
+    """
+    if builder:
+        program = builder.addDefinition("STORM_ENSURE_LINE_AWK_PROGRAM", ENSURE_LINE_AWK_PROGRAM)
+    else:
+        program = pipes.quote(ENSURE_LINE_AWK_PROGRAM)
+    return EDIT_COMMAND.format(
+        path=quotePath(path),
+        environment="STORM_LINE={0} STORM_KEY={1} STORM_SEPARATOR={2}".format(
+            pipes.quote(line), pipes.quote(key or ""), pipes.quote(separator.strip())),
+        program=program)
+
+def getJobPoller():
+    """
+    Get the shared job poller
+
+    :returns: job poller
+    :rtype: :class:`~JobPoller`
+    """
+    global jobPoller
+    with jobPollerLock:
+        if jobPoller is None:
+            jobPoller = JobPoller()
+        return jobPoller
+
+def getJumpHost(specification, timeout=None):
+    """
+    Get the shared jump host for the specification, connections to nodes behind the same
+    jump host use the same jump host connection. Each call needs to be matched by a call
+    to :func:`~releaseJumpHost` once the connections through the jump host are closed.
+
+    The specification is either a string of the form ``[username@]hostname[:port]`` or a
+    dictionary with ``hostname`` and optional ``port``, ``username`` and ``password`` keys.
+
+    :param specification: jump host specification
+    :type specification: str or dict
+    :param timeout: connection and channel open timeout in seconds
+    :type timeout: float
+    :returns: jump host
+    :rtype: :class:`~JumpHost`
+    """
+    if isinstance(specification, dict):
+        parameters = dict(specification)
+    else:
+        parameters = {}
+        hostname = specification
+        if "@" in hostname:
+            parameters["username"], hostname = hostname.split("@", 1)
+        if ":" in hostname:
+            hostname, port = hostname.rsplit(":", 1)
+            parameters["port"] = int(port)
+        parameters["hostname"] = hostname
+    parameters.setdefault("port", 22)
+    parameters.setdefault("username", "root")
+
+    key = (parameters["username"], parameters["hostname"], parameters["port"])
+    with jumpHostsLock:
+        if key not in jumpHosts:
+            jumpHosts[key] = JumpHost(timeout=timeout, **parameters)
+        jumpHosts[key].references += 1
+        return jumpHosts[key]
+
+def quotePath(path):
+    """
+    Quote the path for the shell while keeping a leading ``~/`` expandable
+
+    :param path: path
+    :type path: str
+    :returns: quoted path
+    :rtype: str
+    """
+    if path.startswith("~/"):
+        return "\"$HOME\"/{0}".format(pipes.quote(path[2:]))
+    return pipes.quote(path)
+
+def releaseJumpHost(jumpHost):
+    """
+    Release the shared jump host, the connection to the jump host is closed once it is
+    not used anymore
+
+    :param jumpHost: jump host from :func:`~getJumpHost`
+    :type jumpHost: :class:`~JumpHost`
+    """
+    with jumpHostsLock:
+        jumpHost.references -= 1
+        if jumpHost.references > 0:
+            return
+        for key, sharedJumpHost in jumpHosts.items():
+            if sharedJumpHost is jumpHost:
+                del jumpHosts[key]
+    jumpHost.close()
@@ -0,0 +1,625 @@
+"""
+Copyright (c) IBM 2015-2017. All Rights Reserved.
+Project name: storm-thunder
+This project is licensed under the MIT License, see LICENSE
+
+Functionality to establish and monitor connections to remote nodes
+"""
+import collections
+import errno
+import logging
+from multiprocessing.dummy import Pool as ThreadPool
+import random
+import select
+import socket
+import threading
+import time
+
+
+ADDRESS_SELECTION_TTL = 300
+
+log = logging.getLogger(__name__)
+
+ReadinessEvent = collections.namedtuple("ReadinessEvent", ["key", "hostname", "port", "banner", "attempts", "elapsed", "latency"])
+
+# key to (expiration time, readiness event) mapping of previously selected addresses
+addressSelections = {}
+addressSelectionsLock = threading.Lock()
+
+class AdmissionController(object):
+    """
+    Limit the number of concurrent operations such as SSH handshakes and adjust the
+    limit using additive increase and multiplicative decrease (AIMD).
+
+    Every successful operation increases the limit by ``increase`` while a failed or
+    congested operation, i.e., one that took considerably longer than the fastest one
+    observed so far, decreases it by ``decreaseFactor``. Like TCP congestion control
+    the limit is only decreased once for all operations that were started before the
+    last decrease.
+
+    .. code-block:: python
+
+        controller = AdmissionController(initialLimit=10)
+        controller.call(client.connect)
+
+    :param initialLimit: initial number of concurrent operations
+    :type initialLimit: int
+    :param minimumLimit: minimum number of concurrent operations
+    :type minimumLimit: int
+    :param maximumLimit: maximum number of concurrent operations
+    :type maximumLimit: int
+    :param increase: increase of the limit after each successful operation
+    :type increase: float
+    :param decreaseFactor: factor by which the limit is multiplied after a failed or congested operation
+    :type decreaseFactor: float
+    :param latencyFactor: operations that take longer than this factor times the minimum latency are congested
+    :type latencyFactor: float
+    :param minimumCongestedLatency: operations that take less than this many seconds are never congested
+    :type minimumCongestedLatency: float
+    """
+    def __init__(self, initialLimit=10, minimumLimit=1, maximumLimit=100, increase=1, decreaseFactor=0.5,
+                 latencyFactor=4, minimumCongestedLatency=1):
+        self.limit = float(max(minimumLimit, min(initialLimit, maximumLimit)))
+        self.minimumLimit = minimumLimit
+        self.maximumLimit = maximumLimit
+        self.increase = increase
+        self.decreaseFactor = decreaseFactor
+        self.latencyFactor = latencyFactor
+        self.minimumCongestedLatency = minimumCongestedLatency
+        self.active = 0
+        self.condition = threading.Condition()
+        self.lastDecrease = 0
+        self.minimumLatency = None
+
+    def acquire(self):
+        """
+        Wait until another operation is admitted
+
+        :returns: start time of the operation that needs to be passed to :meth:`release`
+        :rtype: float
+        """
+        with self.condition:
+            while self.active >= int(self.limit):
+                self.condition.wait()
+            self.active += 1
+            return time.time()
+
+    def call(self, function, attempts=3, delay=1, jitter=0.5):
+        """
+        Call function once it is admitted and retry failed calls with jitter
+
+        :param function: function
+        :type function: func
+        :param attempts: number of attempts
+        :type attempts: int
+        :param delay: delay in seconds before the first retry, doubled for each subsequent retry
+        :type delay: float
+        :param jitter: fraction of the delay that is randomized to spread out retries
+        :type jitter: float
+        :returns: result of the function
+        """
+        for attempt in range(1, attempts + 1):
+            start = self.acquire()
+            try:
+                result = function()
+            except Exception as exception:
+                self.release(start, success=False)
+                if attempt == attempts:
+                    raise
+                retryDelay = delay * 2 ** (attempt - 1) * (1 - jitter * random.random())
+                log.debug("Attempt %d of %d failed, retrying in %.1f seconds: %s", attempt, attempts, retryDelay, exception)
+                time.sleep(retryDelay)
+            else:
+                self.release(start)
+                return result
+
+    def release(self, start, success=True):
+        """
+        Release an admitted operation and adjust the limit based on its outcome
+
+        :param start: start time of the operation as returned by :meth:`acquire`
+        :type start: float
+        :param success: operation was successful
+        :type success: bool
+        """
+        with self.condition:
+            self.active -= 1
+            latency = time.time() - start
+            congested = False
+            if success:
+                if self.minimumLatency is None or latency < self.minimumLatency:
+                    self.minimumLatency = latency
+                congested = latency > max(self.minimumLatency * self.latencyFactor, self.minimumCongestedLatency)
+
+            if success and not congested:
+                self.limit = min(self.limit + self.increase, self.maximumLimit)
+            elif start >= self.lastDecrease:
+                self.limit = max(self.limit * self.decreaseFactor, self.minimumLimit)
+                self.lastDecrease = time.time()
+                log.debug("Decreased limit to %d after %s operation", self.limit, "congested" if success else "failed")
+            self.condition.notify_all()
+
+class ProbeTarget(object):
+    """
+    Host and port pair that is being probed for readiness
+
+    :param key: key identifying the target, e.g., the node name
+    :type key: str
+    :param hostname: host name or ip address
+    :type hostname: str
+    :param port: port
+    :type port: int
+    :param delay: initial delay in seconds before the first attempt
+    :type delay: float
+    """
+    def __init__(self, key, hostname, port=22, delay=0):
+        self.key = key
+        self.hostname = hostname
+        self.port = port
+        self.added = time.time()
+        self.attempts = 0
+        self.nextAttempt = self.added + delay
+        self.socket = None
+        self.start = None
+        self.connected = False
+        self.latency = None
+        self.received = ""
+
+    def close(self):
+        """
+        Close the socket of the current attempt
+        """
+        if self.socket:
+            try:
+                self.socket.close()
+            except socket.error:
+                pass
+            self.socket = None
+            self.start = None
+            self.connected = False
+            self.received = ""
+
+    def getBanner(self):
+        """
+        Get the SSH protocol banner from the data received so far
+
+        :returns: banner or ``None`` if not received yet
+        :rtype: str
+        """
+        # servers may send other lines before the actual version line
+        lines = self.received.split("\n")
+        for line in lines[:-1]:
+            if line.startswith("SSH-"):
+                return line.strip()
+        return None
+
+class ReadinessProber(object):
+    """
+    Probe many host and port pairs for readiness from a single thread using
+    non-blocking connects.
+
+    Every attempt uses a fresh socket and failed attempts are retried with exponential
+    backoff and jitter. By default a target is only considered ready once it sent an
+    SSH protocol banner.
+
+    .. code-block:: python
+
+        prober = ReadinessProber()
+        prober.add("node1", "1.2.3.4")
+        for event in prober.events(timeout=600):
+            ...
+
+    :param connectTimeout: timeout in seconds for a single connect attempt including the banner check
+    :type connectTimeout: float
+    :param initialDelay: delay in seconds before retrying after the first failed attempt
+    :type initialDelay: float
+    :param maximumDelay: maximum delay in seconds between attempts
+    :type maximumDelay: float
+    :param backoffFactor: factor by which the delay increases after each failed attempt
+    :type backoffFactor: float
+    :param jitter: fraction of the delay that is randomized to spread out attempts
+    :type jitter: float
+    :param checkBanner: wait for the SSH protocol banner instead of only a successful connect
+    :type checkBanner: bool
+    """
+    def __init__(self, connectTimeout=5, initialDelay=1, maximumDelay=30, backoffFactor=2, jitter=0.5, checkBanner=True):
+        self.connectTimeout = connectTimeout
+        self.initialDelay = initialDelay
+        self.maximumDelay = maximumDelay
+        self.backoffFactor = backoffFactor
+        self.jitter = jitter
+        self.checkBanner = checkBanner
+        self.targets = {}
+        self.sockets = {}
+
+    def __len__(self):
+        return len(self.targets)
+
+    def __contains__(self, key):
+        return key in self.targets
+
+    def add(self, key, hostname, port=22, delay=0):
+        """
+        Add target to be probed
+
+        :param key: key identifying the target, e.g., the node name
+        :type key: str
+        :param hostname: host name or ip address
+        :type hostname: str
+        :param port: port
+        :type port: int
+        :param delay: initial delay in seconds before the first attempt
+        :type delay: float
+        """
+        if key in self.targets:
+            self.remove(key)
+        self.targets[key] = ProbeTarget(key, hostname, port=port, delay=delay)
+
+    def events(self, timeout=600):
+        """
+        Probe until all targets are ready or the timeout is reached while
+        yielding readiness events as they happen
+
+        :param timeout: timeout in seconds
+        :type timeout: float
+        :returns: generator of readiness events
+        :rtype: :class:`~ReadinessEvent`
+        """
+        end = time.time() + timeout
+        while self.targets and time.time() < end:
+            for event in self.probe(timeout=min(1, max(end - time.time(), 0))):
+                yield event
+
+    def getDelay(self, attempts):
+        """
+        Get the delay before the next attempt
+
+        :param attempts: number of failed attempts so far
+        :type attempts: int
+        :returns: delay in seconds
+        :rtype: float
+        """
+        delay = min(self.maximumDelay, self.initialDelay * self.backoffFactor ** max(attempts - 1, 0))
+        return delay * (1 - self.jitter * random.random())
+
+    def probe(self, timeout=1):
+        """
+        Perform a single round of probing by starting due connection attempts and
+        waiting up to the timeout for attempts to make progress
+
+        :param timeout: maximum time in seconds to wait
+        :type timeout: float
+        :returns: events for the targets that became ready, these are no longer probed
+        :rtype: [:class:`~ReadinessEvent`]
+        """
+        now = time.time()
+
+        # start due attempts
+        for target in self.targets.values():
+            if target.socket is None and target.nextAttempt <= now:
+                self._startAttempt(target, now)
+
+        # determine how long we can wait until the next attempt is due or times out
+        deadlines = [now + timeout]
+        for target in self.targets.values():
+            if target.socket is None:
+                deadlines.append(target.nextAttempt)
+            else:
+                deadlines.append(target.start + self.connectTimeout)
+        waitTime = max(min(deadlines) - now, 0)
+
+        events = []
+        for fileDescriptor in self._wait(waitTime):
+            target = self.sockets.get(fileDescriptor)
+            if target is None:
+                continue
+
+            if not target.connected:
+                error = target.socket.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                if error != 0:
+                    log.debug("Could not connect to '%s:%s': %s", target.hostname, target.port, errno.errorcode.get(error, error))
+                    self._failAttempt(target)
+                    continue
+                # the time it took to establish the connection approximates the round trip time
+                target.latency = time.time() - target.start
+                if self.checkBanner:
+                    target.connected = True
+                    continue
+                banner = None
+
+            else:
+                try:
+                    data = target.socket.recv(256)
+                except socket.error as exception:
+                    if exception.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                        continue
+                    log.debug("Could not read banner from '%s:%s': %s", target.hostname, target.port, exception)
+                    self._failAttempt(target)
+                    continue
+                if not data:
+                    log.debug("'%s:%s' closed the connection before sending a banner", target.hostname, target.port)
+                    self._failAttempt(target)
+                    continue
+                target.received += data
+                banner = target.getBanner()
+                if banner is None:
+                    if len(target.received) > 4096:
+                        log.debug("'%s:%s' did not send a valid banner", target.hostname, target.port)
+                        self._failAttempt(target)
+                    continue
+
+            events.append(ReadinessEvent(target.key, target.hostname, target.port, banner, target.attempts, time.time() - target.added, target.latency))
+            self.remove(target.key)
+
+        # time out attempts that take too long
+        now = time.time()
+        for target in self.targets.values():
+            if target.socket is not None and now - target.start > self.connectTimeout:
+                log.debug("Probing '%s:%s' timed out", target.hostname, target.port)
+                self._failAttempt(target)
+
+        return events
+
+    def remove(self, key):
+        """
+        Stop probing the specified target
+
+        :param key: key identifying the target
+        :type key: str
+        """
+        target = self.targets.pop(key, None)
+        if target and target.socket:
+            self.sockets.pop(target.socket.fileno(), None)
+            target.close()
+
+    def wait(self, timeout=600):
+        """
+        Probe until all targets are ready or the timeout is reached
+
+        :param timeout: timeout in seconds
+        :type timeout: float
+        :returns: keys of the targets that became ready, keys of the targets that did not
+        :rtype: ([str], [str])
+        """
+        ready = [event.key for event in self.events(timeout=timeout)]
+        notReady = sorted(self.targets.keys())
+        for key in notReady:
+            self.remove(key)
+        return ready, notReady
+
+    def _failAttempt(self, target):
+        """
+        Close the current attempt of the target and schedule the next one
+
+        :param target: target
+        :type target: :class:`~ProbeTarget`
+        """
+        self.sockets.pop(target.socket.fileno(), None)
+        target.close()
+        target.nextAttempt = time.time() + self.getDelay(target.attempts)
+
+    def _startAttempt(self, target, now):
+        """
+        Start a non-blocking connection attempt using a fresh socket
+
+        :param target: target
+        :type target: :class:`~ProbeTarget`
+        :param now: current time
+        :type now: float
+        """
+        target.attempts += 1
+        try:
+            address = socket.getaddrinfo(target.hostname, target.port, 0, socket.SOCK_STREAM)[0]
+            target.socket = socket.socket(address[0], address[1], address[2])
+            target.socket.setblocking(0)
+            target.start = now
+            error = target.socket.connect_ex(address[4])
+        except socket.error as exception:
+            log.debug("Could not connect to '%s:%s': %s", target.hostname, target.port, exception)
+            target.close()
+            target.nextAttempt = now + self.getDelay(target.attempts)
+            return
+        if error not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EALREADY):
+            log.debug("Could not connect to '%s:%s': %s", target.hostname, target.port, errno.errorcode.get(error, error))
+            target.close()
+            target.nextAttempt = now + self.getDelay(target.attempts)
+            return
+        self.sockets[target.socket.fileno()] = target
+
+    def _wait(self, timeout):
+        """
+        Wait for pending connection attempts to finish or for banner data to arrive
+
+        :param timeout: timeout in seconds
+        :type timeout: float
+        :returns: file descriptors of attempts that made progress
+        :rtype: [int]
+        """
+        if not self.sockets:
+            time.sleep(timeout)
+            return []
+        if hasattr(select, "poll"):
+            poller = select.poll()
+            for fileDescriptor, target in self.sockets.items():
+                if target.connected:
+                    poller.register(fileDescriptor, select.POLLIN | select.POLLERR | select.POLLHUP)
+                else:
+                    poller.register(fileDescriptor, select.POLLOUT | select.POLLERR | select.POLLHUP)
+            return [fileDescriptor for fileDescriptor, _ in poller.poll(timeout * 1000)]
+        readable, writable, _ = select.select(
+            [fileDescriptor for fileDescriptor, target in self.sockets.items() if target.connected],
+            [fileDescriptor for fileDescriptor, target in self.sockets.items() if not target.connected],
+            [], timeout)
+        return readable + writable
+
+def checkReachability(targets, timeout=10):
+    """
+    Check whether many host and port pairs are reachable at once using non-blocking
+    connects and SSH banner checks. Unreachable targets are retried until the timeout.
+
+    :param targets: key to (hostname, port) mapping
+    :type targets: dict
+    :param timeout: timeout in seconds
+    :type timeout: float
+    :returns: key to readiness event mapping for reachable targets, keys of unreachable targets
+    :rtype: (dict, [str])
+    """
+    prober = ReadinessProber(connectTimeout=min(timeout, 5), initialDelay=0.5, maximumDelay=2)
+    for key, (hostname, port) in targets.items():
+        prober.add(key, hostname, port=port)
+    reachable = {
+        event.key: event
+        for event in prober.events(timeout=timeout)
+    }
+    unreachable = sorted(prober.targets.keys())
+    for key in unreachable:
+        prober.remove(key)
+    return reachable, unreachable
+
+def getProbeAddress(client):
+    """
+    Get the address to probe in order to determine whether the node of the client
+    is ready. Nodes behind a jump host cannot be probed directly so for those the
+    jump host is probed and the subsequent reconnect determines actual readiness.
+
+    :param client: SSH client
+    :type client: :class:`~storm.thunder.client.AdvancedSSHClient`
+    :returns: hostname, port
+    :rtype: (str, int)
+    """
+    proxy = getattr(client, "proxy", None)
+    if proxy:
+        return proxy.hostname, proxy.port
+    return client.hostname, client.port
+
+def selectAddresses(candidates, port=22, timeout=10, ttl=ADDRESS_SELECTION_TTL):
+    """
+    Select the fastest responsive address for each key by racing connects to all
+    of its candidate addresses. The first address that sends an SSH protocol banner
+    wins and the selection is cached for the specified time.
+
+    :param candidates: key to list of candidate addresses mapping
+    :type candidates: dict
+    :param port: port
+    :type port: int
+    :param timeout: timeout in seconds
+    :type timeout: float
+    :param ttl: time in seconds for which a selection is reused
+    :type ttl: float
+    :returns: key to readiness event of the selected address mapping, keys without a reachable address
+    :rtype: (dict, [str])
+    """
+    now = time.time()
+    selected = {}
+    prober = ReadinessProber(connectTimeout=min(timeout, 5), initialDelay=0.5, maximumDelay=2)
+    with addressSelectionsLock:
+        for key, addresses in candidates.items():
+            expiration, event = addressSelections.get(key, (0, None))
+            if expiration > now and event.hostname in addresses and event.port == port:
+                selected[key] = event
+                continue
+            for address in set(addresses):
+                prober.add((key, address), address, port=port)
+
+    for event in prober.events(timeout=timeout):
+        key = event.key[0]
+        if key in selected:
+            continue
+        selected[key] = event._replace(key=key)
+        log.debug("Selected '%s' for '%s' with a latency of %.3f seconds", event.hostname, key, event.latency or 0)
+        with addressSelectionsLock:
+            addressSelections[key] = (time.time() + ttl, selected[key])
+        # stop racing the other addresses
+        for probeKey in [probeKey for probeKey in prober.targets if probeKey[0] == key]:
+            prober.remove(probeKey)
+
+    for probeKey in list(prober.targets):
+        prober.remove(probeKey)
+    unreachable = sorted(set(candidates) - set(selected))
+    return selected, unreachable
+
+def waitForReconnect(clients, timeout=600, verify=None, numberOfParallelReconnects=20, delay=0):
+    """
+    Wait for the nodes of the specified clients to become ready again and reconnect
+    each client as soon as its node accepts connections.
+
+    All nodes are watched by a single :class:`~ReadinessProber` while the actual
+    reconnects happen in parallel.
+
+    :param clients: node name to SSH client mapping
+    :type clients: dict
+    :param timeout: timeout in seconds
+    :type timeout: float
+    :param verify: optional function that receives the node name and the reconnected client and
+        returns ``False`` if the node is not in the expected state yet, e.g., has not rebooted yet
+    :type verify: func(str, :class:`~storm.thunder.client.AdvancedSSHClient`)
+    :param numberOfParallelReconnects: number of reconnects to perform in parallel
+    :type numberOfParallelReconnects: int
+    :param delay: initial delay in seconds before probing starts
+    :type delay: float
+    :returns: names of the nodes that could not be reconnected
+    :rtype: [str]
+    """
+    if not clients:
+        return []
+
+    prober = ReadinessProber()
+    for name, client in clients.items():
+        prober.add(name, *getProbeAddress(client), delay=delay)
+
+    def reconnect(name):
+        """
+        Reconnect client and verify its state
+
+        :param name: node name
+        :type name: str
+        :returns: node name, reconnected
+        :rtype: (str, bool)
+        """
+        client = clients[name]
+        try:
+            client.reconnect()
+            if verify and not verify(name, client):
+                log.debug("'%s' is not ready yet", name)
+                client.close()
+                return name, False
+        except Exception as exception:
+            log.debug("Could not reconnect to '%s': %s", name, exception)
+            return name, False
+        log.info("Reconnected to '%s'", name)
+        return name, True
+
+    pool = ThreadPool(processes=min(numberOfParallelReconnects, len(clients)))
+    attempts = {}
+    pending = []
+    reconnected = set()
+    end = time.time() + timeout
+    try:
+        while (prober or pending) and time.time() < end:
+            for event in prober.probe(timeout=min(1, max(end - time.time(), 0))):
+                pending.append(pool.apply_async(reconnect, (event.key,)))
+
+            for result in [result for result in pending if result.ready()]:
+                pending.remove(result)
+                name, success = result.get()
+                if success:
+                    reconnected.add(name)
+                else:
+                    # back off and wait for the node to become ready again
+                    attempts[name] = attempts.get(name, 0) + 1
+                    client = clients[name]
+                    prober.add(name, *getProbeAddress(client), delay=prober.getDelay(attempts[name]))
+    finally:
+        pool.close()
+        pool.join()
+
+    # collect reconnects that finished after the timeout
+    for result in pending:
+        name, success = result.get()
+        if success:
+            reconnected.add(name)
+
+    failed = sorted(set(clients.keys()) - reconnected)
+    for name in failed:
+        log.error("Could not reconnect to '%s' within %s seconds", name, timeout)
+    return failed
@@ -16,11 +16,13 @@ import sys
 from c4.utils.util import (getVariableArguments,
                            initWithVariableArguments, naturalSortKey)
 
-from storm.thunder.base import (DEFAULT_NUMBER_OF_PARALLEL_DEPLOYMENTS,
+from storm.thunder.base import (DEFAULT_NUMBER_OF_PARALLEL_CONNECTS,
+                                DEFAULT_NUMBER_OF_PARALLEL_DEPLOYMENTS,
                                 NodesInfoMap,
                                 deploy,
                                 getDeployments, getDocumentation)
 from storm.thunder.configuration import DeploymentInfos
+from storm.thunder.relay import deployThroughRelays
 
 
 log = logging.getLogger(__name__)
@@ -43,6 +45,9 @@ def getArgumentParser():
                               metavar="nodes.json",
                               type=argparse.FileType("r"),
                               help="nodes information")
+    driverParser.add_argument("--relays",
+                              type=lambda value: value.split(","),
+                              help="comma separated names of relay nodes that run the deployments for their share of the nodes")
     driverParser.add_argument("--usePrivateIps",
                               action="store_true",
                               default=False,
@@ -127,10 +132,36 @@ def getConfigArgumentParser():
                         metavar="nodes.json",
                         type=argparse.FileType("r"),
                         help="nodes information")
+    parser.add_argument("--fileTransactions",
+                        action="store_true",
+                        default=False,
+                        help="collect file edits of consecutive deployments and write each file once per node (default value 'False')")
     parser.add_argument("--parallel",
                         default=DEFAULT_NUMBER_OF_PARALLEL_DEPLOYMENTS,
                         type=int,
                         help="number of deployments to run in parallel (default: {})".format(DEFAULT_NUMBER_OF_PARALLEL_DEPLOYMENTS))
+    parser.add_argument("--parallelConnects",
+                        default=DEFAULT_NUMBER_OF_PARALLEL_CONNECTS,
+                        type=int,
+                        help="initial number of SSH handshakes to perform in parallel, adjusted based on latency and failures (default: {})".format(DEFAULT_NUMBER_OF_PARALLEL_CONNECTS))
+    parser.add_argument("--preflightTimeout",
+                        type=int,
+                        help="timeout in seconds for checking that all nodes are reachable, 0 disables the check (default: the connection timeout)")
+    parser.add_argument("--relays",
+                        type=lambda value: value.split(","),
+                        help="comma separated names of relay nodes that run the deployments for their share of the nodes")
+    parser.add_argument("--scriptMode",
+                        action="store_true",
+                        default=False,
+                        help="combine consecutive command-driven deployments into a single remote script per node (default value 'False')")
+    parser.add_argument("--selectAddress",
+                        action="store_true",
+                        default=False,
+                        help="connect to whichever public or private ip of a node responds fastest (default value 'False')")
+    parser.add_argument("--useHelper",
+                        action="store_true",
+                        default=False,
+                        help="perform file and command operations through a remote helper agent on each node (default value 'False')")
     parser.add_argument("--usePrivateIps",
                         action="store_true",
                         default=False,
@@ -259,6 +290,8 @@ def main():
                 raise ValueError("Node {}{} does not have private IP".format(node.name,
                                                                              '(id={})'.format(node.id) if hasattr(node, 'id') else ''))
 
+    relays = nodesInformation.getNodesByNames(args.relays) if args.relays else []
+
     if usingConfigFile:
         config = args.config.read()
         args.config.close()
@@ -272,7 +305,20 @@ def main():
 
         for deploymentSection in getDeploymentSections(deploymentInfos, nodesInformation):
             deployments, nodes = deploymentSection
-            results = deploy(deployments, nodes, usePrivateIps=args.usePrivateIps, numberOfParallelDeployments=args.parallel)
+            options = {
+                "fileTransactions": args.fileTransactions,
+                "numberOfParallelConnects": args.parallelConnects,
+                "numberOfParallelDeployments": args.parallel,
+                "preflightTimeout": args.preflightTimeout,
+                "scriptMode": args.scriptMode,
+                "selectAddress": args.selectAddress,
+                "useHelper": args.useHelper,
+                "usePrivateIps": args.usePrivateIps
+            }
+            if relays:
+                results = deployThroughRelays(deployments, nodes, relays, **options)
+            else:
+                results = deploy(deployments, nodes, **options)
             if results.numberOfErrors:
                 return results.numberOfErrors
 
@@ -292,6 +338,7 @@ def main():
         fullDeploymentClassName = "storm.deployments.{0}".format(parameters.pop("deployment"))
         parameters.pop("nodes", None)
         parameters.pop("nodes_json", None)
+        parameters.pop("relays", None)
         parameters.pop("verbose", None)
 
         # get class info
@@ -306,7 +353,10 @@ def main():
 
         # TODO: add argument parser option for results file
         # TODO: add argument parser option for timeout
-        results = deploy(deployment, nodes, usePrivateIps=usePrivateIps)
+        if relays:
+            results = deployThroughRelays(deployment, nodes, relays, usePrivateIps=usePrivateIps)
+        else:
+            results = deploy(deployment, nodes, usePrivateIps=usePrivateIps)
 
         # TODO: display detailled information on success and errors
         return results.numberOfErrors
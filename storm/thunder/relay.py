@@ -0,0 +1,299 @@
+"""
+Copyright (c) IBM 2015-2017. All Rights Reserved.
+Project name: storm-thunder
+This project is licensed under the MIT License, see LICENSE
+
+Hierarchical execution of deployments through relay nodes
+
+Instead of connecting to every node the control host only connects to a set of relay
+nodes. The storm package is pushed to each relay which then runs the deployments for
+its subtree of nodes and streams the results back.
+
+Relay nodes need a Python interpreter with the storm-thunder dependencies installed.
+"""
+import datetime
+import json
+import logging
+from multiprocessing.dummy import Pool as ThreadPool
+import os
+import StringIO
+import sys
+import threading
+import zipfile
+
+from c4.utils.jsonutil import JSONSerializable
+
+import storm
+
+from .base import (Datetime, DeploymentErrorResult, DeploymentResults, DeploymentRunError,
+                   NodeDeploymentException, NodesInfoMap,
+                   deploy,
+                   getNodeAddress)
+from .client import (AdvancedSSHClient, RemoteTemporaryDirectory,
+                     getJumpHost,
+                     releaseJumpHost)
+
+
+PREFLIGHT_MARKER = "STORM-THUNDER-PREFLIGHT"
+RESULT_MARKER = "STORM-THUNDER-RESULT"
+STEP_MARKER = "STORM-THUNDER-STEP"
+
+log = logging.getLogger(__name__)
+
+# storm package archive that is pushed to the relays
+packageArchive = None
+
+class RelayRequest(JSONSerializable):
+    """
+    Request for a relay to run deployments on its subtree of nodes
+
+    :param deployments: deployments
+    :type deployments: [:class:`~storm.thunder.base.BaseDeployment`]
+    :param nodes: the nodes
+    :type nodes: [:class:`~storm.thunder.base.BaseNodeInfo`]
+    :param options: additional :func:`~storm.thunder.base.deploy` options
+    :type options: dict
+    """
+    def __init__(self, deployments, nodes, options=None):
+        self.deployments = deployments
+        self.nodes = nodes
+        self.options = options or {}
+
+def createPackageArchive():
+    """
+    Create a zip archive of the storm package that can be put on the Python path of a relay
+
+    :returns: zip archive
+    :rtype: str
+    """
+    global packageArchive
+    if packageArchive is None:
+        packageDirectory = os.path.dirname(os.path.abspath(storm.__file__))
+        baseDirectory = os.path.dirname(packageDirectory)
+        archive = StringIO.StringIO()
+        with zipfile.ZipFile(archive, "w", zipfile.ZIP_DEFLATED) as zipArchive:
+            for directory, _, fileNames in os.walk(packageDirectory):
+                for fileName in sorted(fileNames):
+                    if fileName.endswith(".py"):
+                        path = os.path.join(directory, fileName)
+                        zipArchive.write(path, os.path.relpath(path, baseDirectory))
+        packageArchive = archive.getvalue()
+    return packageArchive
+
+def deployThroughRelays(deploymentOrDeploymentList, nodeOrNodes, relays, timeout=60, relaysUsePrivateIps=False,
+                        python="python", callback=None, **options):
+    """
+    Run specified deployment on the nodes through relay nodes. Each relay runs the deployments
+    for its subtree of the nodes, cluster deployments therefore run once per subtree.
+
+    :param deploymentOrDeploymentList: single deployment or deployment list
+    :type deploymentOrDeploymentList: :class:`~storm.thunder.base.BaseDeployment` or [:class:`~storm.thunder.base.BaseDeployment`]
+    :param nodeOrNodes: node or list of nodes
+    :type nodeOrNodes: :class:`~libcloud.compute.base.Node` or :class:`~storm.thunder.base.BaseNodeInfo` or [:class:`~libcloud.compute.base.Node` or :class:`~storm.thunder.base.BaseNodeInfo`]
+    :param relays: relay nodes
+    :type relays: [:class:`~libcloud.compute.base.Node` or :class:`~storm.thunder.base.BaseNodeInfo`]
+    :param timeout: connection timeout in seconds
+    :type timeout: int
+    :param relaysUsePrivateIps: use private ip to connect to relays instead of the public one
+    :type relaysUsePrivateIps: bool
+    :param python: Python interpreter on the relays
+    :type python: str
+    :param callback: optional function that is called with the node name to result mapping of each step
+        as soon as it is available, a step is reported separately for the subtree of each relay
+    :type callback: func(dict)
+    :param options: additional :func:`~storm.thunder.base.deploy` options for the relays, e.g., ``usePrivateIps``
+    :type options: dict
+    :returns: deployment results
+    :rtype: :class:`~storm.thunder.base.DeploymentResults`
+    """
+    totalStart = datetime.datetime.utcnow()
+    deployments = deploymentOrDeploymentList if isinstance(deploymentOrDeploymentList, list) else [deploymentOrDeploymentList]
+    nodes = nodeOrNodes if isinstance(nodeOrNodes, list) else [nodeOrNodes]
+    if not relays:
+        raise ValueError("At least one relay is required")
+
+    # convert nodes to serializable node information
+    nodesInformation = NodesInfoMap()
+    nodesInformation.addNodes(nodes)
+    subtrees = partitionNodes([nodesInformation[node.name] for node in nodes], relays)
+
+    archive = createPackageArchive()
+    deploymentResults = DeploymentResults(totalStart)
+    steps = {}
+    relayLock = threading.Lock()
+
+    def relayDeploy(relay):
+        """
+        Run deployments for the subtree of the relay
+
+        :param relay: relay node
+        :type relay: :class:`~libcloud.compute.base.Node` or :class:`~storm.thunder.base.BaseNodeInfo`
+        :returns: relay, error
+        :rtype: (:class:`~libcloud.compute.base.Node` or :class:`~storm.thunder.base.BaseNodeInfo`, :class:`Exception`)
+        """
+        subtree = subtrees[relay.name]
+        request = RelayRequest(deployments, subtree, options=dict(options, timeout=timeout))
+        stepResults = {}
+
+        def handleLine(line):
+            """
+            Handle output line from the relay
+            """
+            if line.startswith(RESULT_MARKER):
+                _, stepIndex, resultString = line.split(" ", 2)
+                result = JSONSerializable.fromJSON(resultString)
+                with relayLock:
+                    steps.setdefault(int(stepIndex), {})[result.node.name] = result
+                stepResults[result.node.name] = result
+            elif line.startswith(STEP_MARKER):
+                if callback and stepResults:
+                    callback(dict(stepResults))
+                stepResults.clear()
+            elif line.startswith(PREFLIGHT_MARKER):
+                preflight = json.loads(line.split(" ", 1)[1])
+                with relayLock:
+                    deploymentResults.preflight.update(preflight)
+            elif line:
+                log.debug("%s: %s", relay.name, line)
+
+        def handleErrorLine(line):
+            """
+            Handle log line from the relay
+            """
+            if line:
+                log.info("%s: %s", relay.name, line)
+
+        jumpHost = getJumpHost(relay.extra["jumpHost"], timeout=timeout) if relay.extra.get("jumpHost") else None
+        client = AdvancedSSHClient(getNodeAddress(relay, relaysUsePrivateIps),
+                                   password=relay.extra.get("password"),
+                                   timeout=timeout,
+                                   proxy=jumpHost)
+        try:
+            client.connect()
+            with RemoteTemporaryDirectory(client, prefix="storm-thunder-relay") as relayDirectory:
+                client.put("{0}/storm.zip".format(relayDirectory), contents=archive, mode="wb")
+                client.put("{0}/request.json".format(relayDirectory), contents=request.toJSON(includeClassInfo=True))
+                command = "PYTHONPATH={0}/storm.zip {1} -m storm.thunder.relay {0}/request.json".format(relayDirectory, python)
+                log.info("Running deployments on %d nodes through '%s'", len(subtree), relay.name)
+                status = streamCommand(client, command, handleLine, handleErrorLine)
+                if status != 0:
+                    raise DeploymentRunError(relay, "Relay exited with status {0}".format(status), status)
+        except Exception as exception:
+            log.error("Could not run deployments through '%s': %s", relay.name, exception)
+            return relay, exception
+        finally:
+            client.close()
+            if jumpHost:
+                releaseJumpHost(jumpHost)
+            # results of a step the relay could not finish
+            if callback and stepResults:
+                callback(dict(stepResults))
+        return relay, None
+
+    pool = ThreadPool(processes=len(relays))
+    relayErrors = pool.map(relayDeploy, relays)
+    pool.close()
+    pool.join()
+
+    deploymentResults.steps = [steps[stepIndex] for stepIndex in sorted(steps)]
+
+    # nodes of failed relays without results are marked as failed
+    totalEnd = datetime.datetime.utcnow()
+    errorResults = [
+        DeploymentErrorResult(NodeDeploymentException(), node, totalStart, totalEnd, error)
+        for relay, error in relayErrors
+        if error
+        for node in subtrees[relay.name]
+        if not any(node.name in step for step in deploymentResults.steps)
+    ]
+    if errorResults:
+        deploymentResults.addResults(errorResults)
+        if callback:
+            callback(deploymentResults.steps[-1])
+
+    deploymentResults.end = Datetime(totalEnd)
+    log.info("Running deployments on %d nodes through %d relays took %s", len(nodes), len(relays), totalEnd-totalStart)
+    return deploymentResults
+
+def main():
+    """
+    Run the deployments of a relay request and stream the results to standard output
+    """
+    logging.basicConfig(format='%(asctime)s [%(levelname)s] [%(name)s(%(filename)s:%(lineno)d)] - %(message)s', level=logging.INFO, stream=sys.stderr)
+
+    request = RelayRequest.fromJSONFile(sys.argv[1])
+
+    stepIndex = [0]
+    def streamStep(step):
+        """
+        Write the results of a step to standard output
+        """
+        for result in step.values():
+            sys.stdout.write("{0} {1} {2}\n".format(RESULT_MARKER, stepIndex[0], result.toJSON(includeClassInfo=True)))
+        sys.stdout.write("{0} {1}\n".format(STEP_MARKER, stepIndex[0]))
+        sys.stdout.flush()
+        stepIndex[0] += 1
+
+    results = deploy(request.deployments, request.nodes, callback=streamStep, **request.options)
+    sys.stdout.write("{0} {1}\n".format(PREFLIGHT_MARKER, json.dumps(results.preflight)))
+    sys.stdout.flush()
+    return 0
+
+def partitionNodes(nodes, relays):
+    """
+    Partition the nodes into contiguous subtrees of similar size, one for each relay
+
+    :param nodes: the nodes
+    :type nodes: [:class:`~libcloud.compute.base.Node` or :class:`~storm.thunder.base.BaseNodeInfo`]
+    :param relays: relay nodes
+    :type relays: [:class:`~libcloud.compute.base.Node` or :class:`~storm.thunder.base.BaseNodeInfo`]
+    :returns: relay name to nodes mapping
+    :rtype: dict
+    """
+    subtrees = {}
+    start = 0
+    for index, relay in enumerate(relays):
+        end = start + (len(nodes) - start) // (len(relays) - index)
+        subtrees[relay.name] = nodes[start:end]
+        start = end
+    return subtrees
+
+def streamCommand(client, command, lineCallback, errorLineCallback=None):
+    """
+    Run the command and pass each line of its output to the callback as soon as it is available
+
+    :param client: connected SSH client
+    :type client: :class:`~storm.thunder.client.AdvancedSSHClient`
+    :param command: command
+    :type command: str
+    :param lineCallback: function that is called with each standard output line
+    :type lineCallback: func(str)
+    :param errorLineCallback: function that is called with each standard error line
+    :type errorLineCallback: func(str)
+    :returns: exit status
+    :rtype: int
+    """
+    channel = client.client.get_transport().open_session()
+
+    def drainStandardError():
+        """
+        Read standard error separately so that a full buffer cannot block the command
+        """
+        for line in channel.makefile_stderr("r"):
+            if errorLineCallback:
+                errorLineCallback(line.rstrip("\r\n"))
+
+    try:
+        channel.exec_command(command)
+        errorThread = threading.Thread(target=drainStandardError, name="relay-stderr")
+        errorThread.daemon = True
+        errorThread.start()
+        for line in channel.makefile("r"):
+            lineCallback(line.rstrip("\r\n"))
+        errorThread.join()
+        return channel.recv_exit_status()
+    finally:
+        channel.close()
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,172 @@
+"""
+Copyright (c) IBM 2015-2017. All Rights Reserved.
+Project name: storm-thunder
+This project is licensed under the MIT License, see LICENSE
+
+Functionality to combine the commands of several deployments into a single remote script
+"""
+import collections
+import logging
+import pipes
+import re
+import uuid
+
+
+log = logging.getLogger(__name__)
+
+CommandResult = collections.namedtuple("CommandResult", ["command", "errorMessage", "stdout", "stderr", "status", "failed"])
+
+SCRIPT_HEADER = """\
+__stormDirectory=$(mktemp -d -t storm-thunder-script-XXXXXXXX) || exit 1
+trap 'rm -rf "$__stormDirectory"' EXIT
+__stormRun() {{
+    # run each command in its own subshell like separate remote commands would
+    ( eval "$3" ) > "$__stormDirectory/stdout" 2> "$__stormDirectory/stderr" < /dev/null
+    __stormStatus=$?
+    echo "{marker} STDOUT $1 $2"
+    cat "$__stormDirectory/stdout"; echo
+    echo "{marker} STDERR $1 $2"
+    cat "$__stormDirectory/stderr"; echo
+    echo "{marker} STATUS $1 $2 $__stormStatus"
+    if [ $__stormStatus -ne 0 ]; then
+        if [ -n "$4" ] && grep -qF -- "$4" "$__stormDirectory/stderr"; then
+            return 0
+        fi
+        exit $__stormStatus
+    fi
+}}
+"""
+
+class ScriptBuilder(object):
+    """
+    Builder that combines shell commands of several steps into a single script. The
+    script stops at the first failing command and its output contains status markers
+    such that it can be split back into the results of the individual commands.
+
+    The script is passed to the command as its standard input, such that its size is not
+    limited by the maximum length of a command line argument.
+
+    .. code-block:: python
+
+        builder = ScriptBuilder()
+        builder.addStep("install")
+        builder.addCommand("yum install --assumeyes git", "Could not install git")
+        stdout, stderr, status = runWithInput(client, builder.getCommand(), builder.build())
+        results = builder.parseOutput(stdout)
+    """
+    def __init__(self):
+        self.definitions = collections.OrderedDict()
+        self.marker = "STORM-THUNDER-{0}".format(uuid.uuid4().hex)
+        self.steps = []
+        self.stepNames = []
+
+    def addCommand(self, command, errorMessage, ignoreStderrContaining=None):
+        """
+        Add command to the current step
+
+        :param command: shell command
+        :type command: str
+        :param errorMessage: error message in case the command fails
+        :type errorMessage: str
+        :param ignoreStderrContaining: do not treat the command as failed if its standard error contains this
+        :type ignoreStderrContaining: str
+        """
+        if not self.steps:
+            raise ValueError("A step needs to be added before adding commands")
+        self.steps[-1].append((command, errorMessage, ignoreStderrContaining))
+
+    def addDefinition(self, name, value):
+        """
+        Define a shell variable once in the script header such that large values
+        like programs do not have to be repeated in each command that uses them
+
+        :param name: variable name
+        :type name: str
+        :param value: value
+        :type value: str
+        :returns: quoted reference to the variable for use in commands
+        :rtype: str
+        """
+        if self.definitions.setdefault(name, value) != value:
+            raise ValueError("Variable '{0}' is already defined with a different value".format(name))
+        return '"${0}"'.format(name)
+
+    def addStep(self, name):
+        """
+        Start a new step, subsequent commands are added to it
+
+        :param name: step name
+        :type name: str
+        """
+        self.steps.append([])
+        self.stepNames.append(name)
+
+    def build(self):
+        """
+        Build the script
+
+        :returns: script
+        :rtype: str
+        """
+        lines = [SCRIPT_HEADER.format(marker=self.marker)]
+        for name, value in self.definitions.items():
+            lines.append("{0}={1}".format(name, pipes.quote(value)))
+        for stepIndex, commands in enumerate(self.steps):
+            lines.append("# {0}".format(self.stepNames[stepIndex]))
+            for commandIndex, (command, _, ignoreStderrContaining) in enumerate(commands):
+                lines.append("__stormRun {0} {1} {2} {3}".format(
+                    stepIndex, commandIndex, pipes.quote(command), pipes.quote(ignoreStderrContaining or "")))
+        return "\n".join(lines) + "\n"
+
+    def getCommand(self):
+        """
+        Get command that runs the script passed as its standard input, see :meth:`~build`
+
+        :returns: command
+        :rtype: str
+        """
+        return "/bin/bash -s"
+
+    def getStateFileName(self, name):
+        """
+        Get a file in the temporary directory of the script that commands of the current
+        step can use in order to keep state across commands, e.g., whether a file changed
+
+        :param name: name
+        :type name: str
+        :returns: quoted file name for use in commands
+        :rtype: str
+        """
+        if not self.steps:
+            raise ValueError("A step needs to be added before using state files")
+        return '"$__stormDirectory/{0}-{1}"'.format(len(self.steps) - 1, name)
+
+    def parseOutput(self, output):
+        """
+        Split the script output into the results of the commands that ran
+
+        :param output: standard output of the script
+        :type output: str
+        :returns: command results for each step, steps that did not run have no results
+        :rtype: [[:class:`~CommandResult`]]
+        """
+        markerRegex = re.compile(r"^{0} (?P<kind>STDOUT|STDERR|STATUS) (?P<step>\d+) (?P<command>\d+)(?: (?P<status>\d+))?$".format(self.marker), re.MULTILINE)
+        matches = list(markerRegex.finditer(output))
+
+        results = [[] for _ in self.steps]
+        outputs = {}
+        for index, match in enumerate(matches):
+            stepIndex = int(match.group("step"))
+            commandIndex = int(match.group("command"))
+            if match.group("kind") == "STATUS":
+                command, errorMessage, ignoreStderrContaining = self.steps[stepIndex][commandIndex]
+                stdout = outputs.get((stepIndex, commandIndex, "STDOUT"), "")
+                stderr = outputs.get((stepIndex, commandIndex, "STDERR"), "")
+                status = int(match.group("status"))
+                failed = status != 0 and not (ignoreStderrContaining and ignoreStderrContaining in stderr)
+                results[stepIndex].append(CommandResult(command, errorMessage, stdout, stderr, status, failed))
+            else:
+                # the script adds a new line after each output
+                end = matches[index + 1].start() if index + 1 < len(matches) else len(output)
+                outputs[(stepIndex, commandIndex, match.group("kind"))] = output[match.end() + 1:end][:-1]
+        return results
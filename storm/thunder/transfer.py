@@ -0,0 +1,866 @@
+"""
+Copyright (c) IBM 2015-2017. All Rights Reserved.
+Project name: storm-thunder
+This project is licensed under the MIT License, see LICENSE
+
+Efficient file transfer to nodes
+
+Bulk transfers use SFTP sessions with large windows and keep many write or read
+requests in flight instead of waiting for each response, such that large files are
+not limited by the round trip time.
+
+Compressed transfers stream the file contents through gzip on both ends, which
+pays off for text-heavy artifacts on bandwidth-bound links. Files are only compressed
+if their extension does not indicate compressed contents and, for uploads, a sample
+of the file compresses well.
+
+Directory synchronization compares a manifest of the local tree with one of the remote
+tree that is fetched in a single call, and only sends the added or changed entries as a
+single compressed tar stream.
+
+File collection streams the files matching glob patterns on each node as a compressed tar
+stream into a shared local archive. Files are spooled to disk beyond a threshold, such
+that memory stays bounded, and content that was already collected from another node is
+stored as a hard link to the first copy.
+
+Delta transfers follow the rsync algorithm. The remote helper computes weak and strong
+checksums of the blocks of the existing remote file. Locally a rolling checksum is moved
+over the new file in order to find those blocks, such that only the data in between has
+to be sent. The remote helper then reconstructs the file from the blocks of the existing
+file and the literal data, and verifies it before replacing the existing file.
+"""
+import base64
+import collections
+import copy
+import hashlib
+import logging
+import math
+import mmap
+from multiprocessing.dummy import Pool as ThreadPool
+import os
+import pipes
+import posixpath
+import re
+import stat
+import tarfile
+import tempfile
+import threading
+import uuid
+import zlib
+
+import paramiko
+
+from .cache import getFileHash
+
+
+ADLER_MODULUS = 65521
+BULK_CHUNK_SIZE = 1024 * 1024
+BULK_MAXIMUM_PACKET_SIZE = 256 * 1024
+# read requests larger than 64 KiB are shortened by older OpenSSH servers, writes are limited by their 256 KiB messages
+BULK_READ_REQUEST_SIZE = 64 * 1024
+BULK_TRANSFER_SIZE = 8 * 1024 * 1024
+BULK_WINDOW_SIZE = 64 * 1024 * 1024
+BULK_WRITE_REQUEST_SIZE = 128 * 1024
+CHUNK_SIZE = 256 * 1024
+COLLECTION_SPOOL_SIZE = 8 * 1024 * 1024
+COMPRESSED_EXTENSIONS = (".7z", ".bz2", ".deb", ".egg", ".gif", ".gz", ".jar", ".jpeg", ".jpg", ".lz4", ".png",
+                         ".rpm", ".tbz2", ".tgz", ".txz", ".war", ".whl", ".xz", ".zip", ".zst")
+COMPRESSION_LEVEL = 6
+COMPRESSION_SAMPLE_SIZE = 64 * 1024
+MAXIMUM_BLOCK_SIZE = 1024 * 1024
+MAXIMUM_COMPRESSION_RATIO = 0.8
+# the delta is computed byte by byte in Python at a few MB/s and for each node, so anything
+# but small files is sent whole, as are mostly changed files
+MAXIMUM_DELTA_FILE_SIZE = 4 * 1024 * 1024
+MAXIMUM_DELTA_LITERAL_RATIO = 0.5
+MAXIMUM_INSTRUCTIONS = 10000
+MAXIMUM_LITERAL_SIZE = 1024 * 1024
+MINIMUM_BLOCK_SIZE = 4096
+MINIMUM_COMPRESSION_SIZE = 16 * 1024
+NUMBER_OF_PARALLEL_STATS = 16
+PATHS_PER_HASH_COMMAND = 500
+REQUESTS_PER_BATCH = 8
+
+log = logging.getLogger(__name__)
+
+ManifestEntry = collections.namedtuple("ManifestEntry", ["type", "size", "mtime", "mode", "target"])
+
+class ChannelReader(object):
+    """
+    File-like object that reads the standard output of the channel and counts the bytes read
+
+    :param channel: channel of a running command
+    :type channel: :class:`~paramiko.Channel`
+    """
+    def __init__(self, channel):
+        self.channel = channel
+        self.transferredSize = 0
+
+    def read(self, size):
+        """
+        Read up to size bytes, less only at the end of the output
+
+        :param size: number of bytes
+        :type size: int
+        :returns: data
+        :rtype: str
+        """
+        chunks = []
+        remaining = size
+        while remaining > 0:
+            chunk = self.channel.recv(min(remaining, CHUNK_SIZE))
+            if not chunk:
+                break
+            chunks.append(chunk)
+            remaining -= len(chunk)
+        self.transferredSize += size - remaining
+        return b"".join(chunks)
+
+class CollectionArchive(object):
+    """
+    Local tar archive that is shared by the collections from multiple nodes and stores
+    files whose content was already added as hard links to the first copy
+
+    .. code-block:: python
+
+        with CollectionArchive("logs.tar.gz") as archive:
+            collectFiles(client, ["/var/log/messages*"], archive, "node1")
+
+    :param fileName: archive file name, compressed if it ends with ``.gz`` or ``.tgz``
+    :type fileName: str
+    """
+    def __init__(self, fileName):
+        mode = "w:gz" if fileName.endswith((".gz", ".tgz")) else "w"
+        self.archive = tarfile.open(fileName, mode, **({"compresslevel": COMPRESSION_LEVEL} if mode == "w:gz" else {}))
+        self.duplicateSize = 0
+        self.hashes = {}
+        self.lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
+
+    def add(self, member, fileobj=None, sha256=None):
+        """
+        Add the member to the archive
+
+        :param member: member with its name in the archive
+        :type member: :class:`~tarfile.TarInfo`
+        :param fileobj: contents of regular files
+        :type fileobj: file
+        :param sha256: SHA-256 hex digest of the contents of regular files
+        :type sha256: str
+        :returns: whether the contents were added, as opposed to a hard link to identical contents
+        :rtype: bool
+        """
+        with self.lock:
+            if member.isreg() and sha256 in self.hashes:
+                link = copy.copy(member)
+                link.type = tarfile.LNKTYPE
+                link.linkname = self.hashes[sha256]
+                link.size = 0
+                self.archive.addfile(link)
+                self.duplicateSize += member.size
+                return False
+            self.archive.addfile(member, fileobj)
+            if member.isreg():
+                self.hashes[sha256] = member.name
+            return True
+
+    def close(self):
+        """
+        Write the end of the archive
+        """
+        self.archive.close()
+
+class CompressingChannelWriter(object):
+    """
+    File-like object that sends the data written to it through the channel as a gzip stream
+
+    :param channel: channel of a running command that reads the stream from its standard input
+    :type channel: :class:`~paramiko.Channel`
+    """
+    def __init__(self, channel):
+        self.channel = channel
+        self.compressor = zlib.compressobj(COMPRESSION_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        self.transferredSize = 0
+
+    def close(self):
+        """
+        Send the remaining compressed data and close the standard input of the command
+        """
+        data = self.compressor.flush()
+        self.transferredSize += len(data)
+        self.channel.sendall(data)
+        self.channel.shutdown_write()
+
+    def write(self, data):
+        """
+        Compress and send data
+
+        :param data: data
+        :type data: str
+        """
+        data = self.compressor.compress(data)
+        if data:
+            self.transferredSize += len(data)
+            self.channel.sendall(data)
+
+def collectFiles(client, patterns, archive, directory):
+    """
+    Collect the files matching the glob patterns from the node into the archive directory
+
+    Note that directories matching the patterns are collected recursively and that
+    patterns are expanded by the remote shell, relative patterns are therefore relative
+    to the home directory.
+
+    :param client: connected ssh client
+    :type client: :class:`~storm.thunder.client.AdvancedSSHClient`
+    :param patterns: remote glob patterns
+    :type patterns: [str]
+    :param archive: archive
+    :type archive: :class:`~CollectionArchive`
+    :param directory: directory in the archive, usually the node name
+    :type directory: str
+    :returns: statistics with the number of ``files`` and ``duplicates``, the ``transferredSize``
+        and the ``errors`` such as patterns without matches and unreadable files
+    :rtype: dict
+    """
+    lines = ["shopt -s nullglob", "files=()"]
+    for pattern in patterns:
+        lines.append("matches=({0}); [ ${{#matches[@]}} -gt 0 ] || echo {1} >&2; files+=(\"${{matches[@]}}\")".format(
+            quoteGlob(pattern), pipes.quote("No files match '{0}'".format(pattern))))
+    lines.append("tar -czf - --ignore-failed-read --warning=no-file-changed -T /dev/null -- \"${files[@]}\"")
+
+    statistics = {"duplicates": 0, "errors": [], "files": 0, "transferredSize": 0}
+    channel = client.client.get_transport().open_session()
+    try:
+        channel.exec_command("/bin/bash -c {0}".format(pipes.quote("; ".join(lines))))
+        reader = ChannelReader(channel)
+        try:
+            stream = tarfile.open(fileobj=reader, mode="r|gz")
+            for member in iter(stream.next, None):
+                # do not keep all members of the stream in memory
+                stream.members = []
+                member.name = posixpath.join(directory, posixpath.normpath("/" + member.name).lstrip("/"))
+                if member.islnk():
+                    member.linkname = posixpath.join(directory, posixpath.normpath("/" + member.linkname).lstrip("/"))
+                if not member.isreg():
+                    archive.add(member)
+                    continue
+
+                sha256 = hashlib.sha256()
+                with tempfile.SpooledTemporaryFile(max_size=COLLECTION_SPOOL_SIZE) as spool:
+                    contents = stream.extractfile(member)
+                    for chunk in iter(lambda: contents.read(CHUNK_SIZE), b""):
+                        sha256.update(chunk)
+                        spool.write(chunk)
+                    spool.seek(0)
+                    if archive.add(member, spool, sha256.hexdigest()):
+                        statistics["files"] += 1
+                    else:
+                        statistics["duplicates"] += 1
+            stream.close()
+        except (tarfile.TarError, IOError) as error:
+            statistics["errors"].append("Could not read archive: {0}".format(error))
+        # the end of the compressed stream is not needed by the archive
+        for _ in iter(lambda: reader.read(CHUNK_SIZE), b""):
+            pass
+        statistics["transferredSize"] = reader.transferredSize
+        stderr = channel.makefile_stderr("rb").read()
+        status = channel.recv_exit_status()
+    finally:
+        channel.close()
+
+    statistics["errors"].extend(line for line in stderr.splitlines() if line and "Removing leading" not in line)
+    if status != 0 and not statistics["errors"]:
+        statistics["errors"].append("Could not create archive, exit status {0}".format(status))
+    log.info("Collected %d files and %d duplicates from '%s'", statistics["files"], statistics["duplicates"], client.hostname)
+    return statistics
+
+def downloadBulk(client, remoteFileName, localFileName, callback=None):
+    """
+    Download the remote file with all read requests in flight at once
+
+    :param client: connected ssh client
+    :type client: :class:`~storm.thunder.client.AdvancedSSHClient`
+    :param remoteFileName: remote file name
+    :type remoteFileName: str
+    :param localFileName: local file name
+    :type localFileName: str
+    :param callback: optional function that accepts the bytes transferred so far and the total bytes to be transferred
+    :type callback: func(int, int)
+    :returns: number of bytes transferred
+    :rtype: int
+    :raises IOError: if the file could not be downloaded completely
+    """
+    sftp = openBulkSFTP(client)
+    try:
+        with sftp.open(remoteFileName, "rb") as remoteFile:
+            remoteFile.MAX_REQUEST_SIZE = BULK_READ_REQUEST_SIZE
+            size = remoteFile.stat().st_size
+            remoteFile.prefetch(size)
+            transferredSize = 0
+            with open(localFileName, "wb") as f:
+                while transferredSize < size:
+                    data = remoteFile.read(min(BULK_CHUNK_SIZE, size - transferredSize))
+                    if not data:
+                        break
+                    f.write(data)
+                    transferredSize += len(data)
+                    if callback:
+                        callback(transferredSize, size)
+    finally:
+        sftp.close()
+    if transferredSize != size:
+        raise IOError("Downloaded {0} of {1} bytes of '{2}'".format(transferredSize, size, remoteFileName))
+    return transferredSize
+
+def downloadCompressed(client, remoteFileName, localFileName):
+    """
+    Download the remote file by compressing it on the node and decompressing it locally
+
+    :param client: connected ssh client
+    :type client: :class:`~storm.thunder.client.AdvancedSSHClient`
+    :param remoteFileName: remote file name
+    :type remoteFileName: str
+    :param localFileName: local file name
+    :type localFileName: str
+    :returns: number of bytes transferred
+    :rtype: int
+    :raises RuntimeError: if the remote file could not be compressed
+    """
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    transferredSize = 0
+    size = 0
+    channel = client.client.get_transport().open_session()
+    try:
+        channel.exec_command("gzip -{0} -c {1}".format(COMPRESSION_LEVEL, quoteRelativePath(remoteFileName)))
+        with open(localFileName, "wb") as f:
+            for chunk in iter(lambda: channel.recv(CHUNK_SIZE), b""):
+                transferredSize += len(chunk)
+                data = decompressor.decompress(chunk)
+                size += len(data)
+                f.write(data)
+            data = decompressor.flush()
+            size += len(data)
+            f.write(data)
+        stderr = channel.makefile_stderr("rb").read()
+        status = channel.recv_exit_status()
+    finally:
+        channel.close()
+    if status != 0:
+        raise RuntimeError("Could not compress '{0}' on '{1}'".format(remoteFileName, client.hostname), status, stderr)
+
+    log.info("Downloaded '%s' from '%s' as %d instead of %d bytes", remoteFileName, client.hostname, transferredSize, size)
+    return transferredSize
+
+def getBlockSize(fileSize):
+    """
+    Get the delta transfer block size for a file, the square root of the size
+    rounded to kilobytes balances the size of the signatures and the literal data
+
+    :param fileSize: file size in bytes
+    :type fileSize: int
+    :returns: block size in bytes
+    :rtype: int
+    """
+    blockSize = int(math.sqrt(fileSize)) // 1024 * 1024
+    return max(MINIMUM_BLOCK_SIZE, min(MAXIMUM_BLOCK_SIZE, blockSize))
+
+def getDelta(fileName, signatures, blockSize):
+    """
+    Get the instructions to reconstruct the local file from the blocks of the remote file
+
+    :param fileName: local file name
+    :type fileName: str
+    :param signatures: weak and strong checksums of the remote blocks
+    :type signatures: [(int, str)]
+    :param blockSize: block size in bytes
+    :type blockSize: int
+    :returns: block ranges ``[index, count]`` and literal data
+    :rtype: generator
+    """
+    blocks = {}
+    for index, (weakChecksum, strongChecksum) in enumerate(signatures):
+        blocks.setdefault(weakChecksum, {}).setdefault(strongChecksum, index)
+
+    size = os.path.getsize(fileName)
+    if size == 0:
+        return
+
+    with open(fileName, "rb") as f:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            blockRange = None
+            literalStart = position = 0
+            a = b = None
+            while position + blockSize <= size:
+                if a is None:
+                    checksum = zlib.adler32(data[position:position + blockSize]) & 0xffffffff
+                    a, b = checksum & 0xffff, checksum >> 16
+
+                candidates = blocks.get((b << 16) | a)
+                if candidates:
+                    index = candidates.get(hashlib.md5(data[position:position + blockSize]).hexdigest())
+                    if index is not None:
+                        if literalStart < position:
+                            if blockRange:
+                                yield blockRange
+                                blockRange = None
+                            yield data[literalStart:position]
+                        # extend consecutive blocks into a single range
+                        if blockRange and blockRange[0] + blockRange[1] == index:
+                            blockRange[1] += 1
+                        else:
+                            if blockRange:
+                                yield blockRange
+                            blockRange = [index, 1]
+                        position += blockSize
+                        literalStart = position
+                        a = b = None
+                        continue
+
+                if position + blockSize >= size:
+                    break
+                # roll the checksum one byte forward
+                removed = ord(data[position])
+                a = (a - removed + ord(data[position + blockSize])) % ADLER_MODULUS
+                b = (b - blockSize * removed - 1 + a) % ADLER_MODULUS
+                position += 1
+
+                if position - literalStart >= MAXIMUM_LITERAL_SIZE:
+                    if blockRange:
+                        yield blockRange
+                        blockRange = None
+                    yield data[literalStart:position]
+                    literalStart = position
+
+            if blockRange:
+                yield blockRange
+            if literalStart < size:
+                yield data[literalStart:size]
+        finally:
+            data.close()
+
+def getLocalManifest(directory, numberOfParallelStats=NUMBER_OF_PARALLEL_STATS):
+    """
+    Get the manifest of the local directory tree, the entries are stat'ed in parallel
+
+    :param directory: local directory
+    :type directory: str
+    :param numberOfParallelStats: number of parallel stat calls
+    :type numberOfParallelStats: int
+    :returns: relative path to manifest entry mapping
+    :rtype: dict
+    """
+    paths = []
+    for root, directoryNames, fileNames in os.walk(directory):
+        for name in directoryNames + fileNames:
+            paths.append(os.path.relpath(os.path.join(root, name), directory))
+
+    pool = ThreadPool(processes=numberOfParallelStats)
+    fileInfos = pool.map(os.lstat, [os.path.join(directory, path) for path in paths], chunksize=256)
+    pool.close()
+    pool.join()
+
+    manifest = {}
+    for path, fileInfo in zip(paths, fileInfos):
+        if stat.S_ISLNK(fileInfo.st_mode):
+            manifest[path] = ManifestEntry("l", 0, 0, 0, os.readlink(os.path.join(directory, path)))
+        elif stat.S_ISDIR(fileInfo.st_mode):
+            manifest[path] = ManifestEntry("d", 0, 0, stat.S_IMODE(fileInfo.st_mode), "")
+        elif stat.S_ISREG(fileInfo.st_mode):
+            manifest[path] = ManifestEntry("f", fileInfo.st_size, int(fileInfo.st_mtime), stat.S_IMODE(fileInfo.st_mode), "")
+    return manifest
+
+def getRemoteManifest(client, directory):
+    """
+    Get the manifest of the remote directory tree in a single call
+
+    :param client: connected ssh client
+    :type client: :class:`~storm.thunder.client.AdvancedSSHClient`
+    :param directory: remote directory
+    :type directory: str
+    :returns: relative path to manifest entry mapping
+    :rtype: dict
+    :raises RuntimeError: if the remote directory tree could not be listed
+    """
+    stdout, stderr, status = client.run(
+        "if [ -d {0} ]; then cd {0} && find . -mindepth 1 -printf '%y\\t%s\\t%T@\\t%m\\t%l\\t%P\\0'; fi".format(
+            quoteRelativePath(directory)))
+    if status != 0:
+        raise RuntimeError("Could not list '{0}' on '{1}'".format(directory, client.hostname), status, stdout, stderr)
+
+    manifest = {}
+    for line in stdout.split("\0"):
+        if not line:
+            continue
+        entryType, size, mtime, mode, target, path = line.split("\t", 5)
+        if entryType == "l":
+            manifest[path] = ManifestEntry("l", 0, 0, 0, target)
+        elif entryType == "d":
+            manifest[path] = ManifestEntry("d", 0, 0, int(mode, 8), "")
+        else:
+            manifest[path] = ManifestEntry(entryType, int(size), int(float(mtime)), int(mode, 8), "")
+    return manifest
+
+def hasCompressedExtension(fileName):
+    """
+    Check if the extension of the file indicates that its contents are already compressed
+
+    :param fileName: file name
+    :type fileName: str
+    :returns: bool
+    """
+    return fileName.lower().endswith(COMPRESSED_EXTENSIONS)
+
+def isCompressible(fileName):
+    """
+    Check if compressing the local file pays off based on its extension and
+    the compression ratio of samples from its beginning, middle and end
+
+    :param fileName: local file name
+    :type fileName: str
+    :returns: bool
+    """
+    if hasCompressedExtension(fileName):
+        return False
+    size = os.path.getsize(fileName)
+    if size < MINIMUM_COMPRESSION_SIZE:
+        return False
+    sample = b""
+    with open(fileName, "rb") as f:
+        for offset in sorted(set([0, max(0, size // 2 - COMPRESSION_SAMPLE_SIZE // 2), max(0, size - COMPRESSION_SAMPLE_SIZE)])):
+            f.seek(offset)
+            sample += f.read(COMPRESSION_SAMPLE_SIZE)
+    return len(zlib.compress(sample, 1)) <= MAXIMUM_COMPRESSION_RATIO * len(sample)
+
+def openBulkSFTP(client):
+    """
+    Open an SFTP session with large window and packet sizes
+
+    :param client: connected ssh client
+    :type client: :class:`~storm.thunder.client.AdvancedSSHClient`
+    :returns: SFTP client
+    :rtype: :class:`~paramiko.SFTPClient`
+    """
+    return paramiko.SFTPClient.from_transport(
+        client.client.get_transport(),
+        window_size=BULK_WINDOW_SIZE,
+        max_packet_size=BULK_MAXIMUM_PACKET_SIZE)
+
+def quoteGlob(pattern):
+    """
+    Quote the glob pattern for the shell such that only its wildcards are expanded
+
+    :param pattern: glob pattern
+    :type pattern: str
+    :returns: quoted pattern
+    :rtype: str
+    """
+    pattern = pattern[2:] if pattern.startswith("~/") else pattern
+    parts = []
+    for wildcards, literal in re.findall(r"([*?]*)([^*?]*)", pattern):
+        parts.append(wildcards)
+        if literal:
+            parts.append(pipes.quote(literal))
+    return "".join(parts)
+
+def quoteRelativePath(path):
+    """
+    Quote the path for the shell, paths starting with ``~/`` are relative to the home
+    directory which is the working directory of commands, the same as for SFTP
+
+    :param path: path
+    :type path: str
+    :returns: quoted path
+    :rtype: str
+    """
+    return pipes.quote(path[2:] if path.startswith("~/") else path)
+
+def runWithInput(client, command, data):
+    """
+    Run the command with the data as its standard input
+
+    :param client: connected ssh client
+    :type client: :class:`~storm.thunder.client.AdvancedSSHClient`
+    :param command: command
+    :type command: str
+    :param data: standard input
+    :type data: str
+    :returns: stdout, stderr, status
+    :rtype: tuple
+    """
+    channel = client.client.get_transport().open_session()
+    try:
+        channel.exec_command(command)
+        channel.sendall(data)
+        channel.shutdown_write()
+        stdout = channel.makefile("rb").read()
+        stderr = channel.makefile_stderr("rb").read()
+        status = channel.recv_exit_status()
+    finally:
+        channel.close()
+    return stdout, stderr, status
+
+def syncDirectory(client, localDirectory, remoteDirectory, delete=False):
+    """
+    Synchronize the local directory tree to the remote directory, only sending added
+    or changed entries. Files are considered unchanged if their size and modification
+    time match, files that only differ in modification time are compared by hash.
+    Modes and modification times are preserved while files are owned by the remote user.
+
+    :param client: connected ssh client
+    :type client: :class:`~storm.thunder.client.AdvancedSSHClient`
+    :param localDirectory: local directory
+    :type localDirectory: str
+    :param remoteDirectory: remote directory
+    :type remoteDirectory: str
+    :param delete: delete remote entries that do not exist locally
+    :type delete: bool
+    :returns: numbers of ``sent``, ``updated`` and ``deleted`` entries and the ``transferredSize``
+    :rtype: dict
+    :raises RuntimeError: if the remote directory could not be updated
+    """
+    localManifest = getLocalManifest(localDirectory)
+    remoteManifest = getRemoteManifest(client, remoteDirectory)
+
+    sent = []
+    removed = []
+    modeChanges = {}
+    timeChanges = {}
+    candidates = []
+    for path, entry in sorted(localManifest.items()):
+        remoteEntry = remoteManifest.get(path)
+        if remoteEntry is None:
+            sent.append(path)
+        elif remoteEntry.type != entry.type or remoteEntry.target != entry.target:
+            removed.append(path)
+            sent.append(path)
+        elif entry.type != "l":
+            if entry.type == "f" and remoteEntry.size != entry.size:
+                sent.append(path)
+                continue
+            if entry.type == "f" and remoteEntry.mtime != entry.mtime:
+                candidates.append(path)
+            if remoteEntry.mode != entry.mode:
+                modeChanges[path] = entry.mode
+
+    # files that only differ in modification time are compared by content
+    if candidates:
+        remoteHashes = {}
+        for index in range(0, len(candidates), PATHS_PER_HASH_COMMAND):
+            stdout, _, _ = client.run("cd {0} && sha256sum -- {1}".format(
+                quoteRelativePath(remoteDirectory),
+                " ".join(pipes.quote(path) for path in candidates[index:index + PATHS_PER_HASH_COMMAND])))
+            for line in stdout.splitlines():
+                remoteHash, _, path = line.partition("  ")
+                remoteHashes[path] = remoteHash
+        pool = ThreadPool(processes=NUMBER_OF_PARALLEL_STATS)
+        localHashes = pool.map(getFileHash, [os.path.join(localDirectory, path) for path in candidates])
+        pool.close()
+        pool.join()
+        for path, localHash in zip(candidates, localHashes):
+            if remoteHashes.get(path) == localHash:
+                timeChanges[path] = localManifest[path].mtime
+            else:
+                modeChanges.pop(path, None)
+                sent.append(path)
+
+    if delete:
+        for path in sorted(remoteManifest):
+            # entries in removed directories are removed along with them
+            if path not in localManifest and not (removed and path.startswith(removed[-1] + "/")):
+                removed.append(path)
+
+    commands = []
+    if removed:
+        commands.append("rm -rf -- {0}".format(" ".join(pipes.quote(path) for path in removed)))
+    for path, mode in sorted(modeChanges.items()):
+        commands.append("chmod {0:o} -- {1}".format(mode, pipes.quote(path)))
+    for path, mtime in sorted(timeChanges.items()):
+        commands.append("touch -c -m -d @{0} -- {1}".format(mtime, pipes.quote(path)))
+    if commands:
+        stdout, stderr, status = runWithInput(
+            client,
+            "cd {0} && /bin/bash -e -s".format(quoteRelativePath(remoteDirectory)),
+            "\n".join(commands) + "\n")
+        if status != 0:
+            raise RuntimeError("Could not update '{0}' on '{1}'".format(remoteDirectory, client.hostname), status, stdout, stderr)
+
+    transferredSize = 0
+    if sent or not remoteManifest:
+        channel = client.client.get_transport().open_session()
+        try:
+            channel.exec_command("mkdir -p {0} && tar -xzpf - --no-same-owner -C {0}".format(quoteRelativePath(remoteDirectory)))
+            writer = CompressingChannelWriter(channel)
+            archive = tarfile.open(fileobj=writer, mode="w|")
+            for path in sorted(sent):
+                archive.add(os.path.join(localDirectory, path), arcname=path, recursive=False)
+            archive.close()
+            writer.close()
+            stderr = channel.makefile_stderr("rb").read()
+            status = channel.recv_exit_status()
+        finally:
+            channel.close()
+        if status != 0:
+            raise RuntimeError("Could not extract files into '{0}' on '{1}'".format(remoteDirectory, client.hostname), status, stderr)
+        transferredSize = writer.transferredSize
+
+    statistics = {
+        "deleted": len(set(removed).difference(sent)),
+        "sent": len(sent),
+        "transferredSize": transferredSize,
+        "updated": len(modeChanges) + len(timeChanges)
+    }
+    log.info("Synchronized '%s' to '%s' on '%s': %d sent, %d updated, %d deleted, %d bytes transferred",
+             localDirectory, remoteDirectory, client.hostname,
+             statistics["sent"], statistics["updated"], statistics["deleted"], statistics["transferredSize"])
+    return statistics
+
+def uploadBulk(client, fileName, remoteFileName, callback=None):
+    """
+    Upload the local file with write requests in flight instead of waiting for each of them
+
+    :param client: connected ssh client
+    :type client: :class:`~storm.thunder.client.AdvancedSSHClient`
+    :param fileName: local file name
+    :type fileName: str
+    :param remoteFileName: remote file name
+    :type remoteFileName: str
+    :param callback: optional function that accepts the bytes transferred so far and the total bytes to be transferred
+    :type callback: func(int, int)
+    :returns: number of bytes transferred
+    :rtype: int
+    :raises IOError: if the file could not be uploaded completely
+    """
+    size = os.path.getsize(fileName)
+    sftp = openBulkSFTP(client)
+    try:
+        transferredSize = 0
+        with sftp.open(remoteFileName, "wb") as remoteFile:
+            remoteFile.MAX_REQUEST_SIZE = BULK_WRITE_REQUEST_SIZE
+            remoteFile.set_pipelined(True)
+            with open(fileName, "rb") as f:
+                for chunk in iter(lambda: f.read(BULK_CHUNK_SIZE), b""):
+                    remoteFile.write(chunk)
+                    transferredSize += len(chunk)
+                    if callback:
+                        callback(transferredSize, size)
+        # closing the file waits for the outstanding write requests
+        remoteSize = sftp.stat(remoteFileName).st_size
+    finally:
+        sftp.close()
+    if remoteSize != size:
+        raise IOError("Uploaded {0} of {1} bytes of '{2}'".format(remoteSize, size, fileName))
+    return transferredSize
+
+def uploadCompressed(client, fileName, remoteFileName):
+    """
+    Upload the local file by compressing it locally and decompressing it on the node.
+    Existing remote files are replaced only after the upload completed and keep their
+    owner and mode.
+
+    :param client: connected ssh client
+    :type client: :class:`~storm.thunder.client.AdvancedSSHClient`
+    :param fileName: local file name
+    :type fileName: str
+    :param remoteFileName: remote file name
+    :type remoteFileName: str
+    :returns: number of bytes transferred
+    :rtype: int
+    :raises RuntimeError: if the file could not be decompressed on the node
+    """
+    path = quoteRelativePath(remoteFileName)
+    temporaryPath = quoteRelativePath("{0}.storm-thunder-{1}".format(remoteFileName, uuid.uuid4().hex[:8]))
+    command = (
+        "gzip -dc > {temporaryPath} && "
+        "{{ chown --reference={path} {temporaryPath} 2>/dev/null; "
+        "chmod --reference={path} {temporaryPath} 2>/dev/null; "
+        "mv -f {temporaryPath} {path}; }} || "
+        "{{ rm -f {temporaryPath}; false; }}").format(path=path, temporaryPath=temporaryPath)
+
+    channel = client.client.get_transport().open_session()
+    try:
+        channel.exec_command(command)
+        writer = CompressingChannelWriter(channel)
+        with open(fileName, "rb") as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+                writer.write(chunk)
+        writer.close()
+        stderr = channel.makefile_stderr("rb").read()
+        status = channel.recv_exit_status()
+    finally:
+        channel.close()
+    if status != 0:
+        raise RuntimeError("Could not decompress '{0}' on '{1}'".format(remoteFileName, client.hostname), status, stderr)
+
+    log.info("Uploaded '%s' to '%s' as %d instead of %d bytes", fileName, client.hostname, writer.transferredSize, os.path.getsize(fileName))
+    return writer.transferredSize
+
+def uploadDelta(helper, fileName, remoteFileName):
+    """
+    Upload the local file by only sending the data that differs from the existing remote file
+
+    :param helper: remote helper
+    :type helper: :class:`~storm.thunder.client.RemoteHelper`
+    :param fileName: local file name
+    :type fileName: str
+    :param remoteFileName: remote file name
+    :type remoteFileName: str
+    :returns: number of bytes of literal data sent or ``None`` if there is no remote file to start from
+        or the delta does not pay off, i.e. the file is larger than :data:`MAXIMUM_DELTA_FILE_SIZE` or
+        more than :data:`MAXIMUM_DELTA_LITERAL_RATIO` of it differs
+    :rtype: int
+    :raises RuntimeError: if the remote file could not be reconstructed
+    """
+    fileSize = os.path.getsize(fileName)
+    if fileSize > MAXIMUM_DELTA_FILE_SIZE:
+        log.debug("Not computing the delta of '%s' with %d bytes", fileName, fileSize)
+        return None
+
+    blockSize = getBlockSize(fileSize)
+    signatures = helper.call("getBlockSignatures", path=remoteFileName, blockSize=blockSize)
+    if signatures is None:
+        return None
+
+    # concurrent uploads to the same file must not share their temporary file
+    temporaryFileName = "{0}.storm-thunder-{1}".format(remoteFileName, uuid.uuid4().hex[:8])
+    literalSize = 0
+    numberOfPatches = 0
+    requests = []
+    instructions = []
+    instructionsSize = 0
+    for instruction in getDelta(fileName, signatures, blockSize):
+        if isinstance(instruction, list):
+            instructions.append(instruction)
+        else:
+            instructions.append(base64.b64encode(instruction))
+            instructionsSize += len(instruction)
+            literalSize += len(instruction)
+            if literalSize > fileSize * MAXIMUM_DELTA_LITERAL_RATIO:
+                log.debug("Delta of '%s' exceeds %d%% of its size", fileName, MAXIMUM_DELTA_LITERAL_RATIO * 100)
+                if numberOfPatches > 0:
+                    helper.call("remove", path=temporaryFileName)
+                return None
+        if instructionsSize >= MAXIMUM_LITERAL_SIZE or len(instructions) >= MAXIMUM_INSTRUCTIONS:
+            requests.append(("patch", {"path": temporaryFileName, "basePath": remoteFileName, "blockSize": blockSize,
+                                       "delta": instructions, "append": numberOfPatches > 0}))
+            numberOfPatches += 1
+            instructions = []
+            instructionsSize = 0
+        # pipeline the patches while bounding the amount of data held in memory
+        if len(requests) >= REQUESTS_PER_BATCH:
+            helper.batch(requests)
+            requests = []
+
+    requests.append(("patch", {"path": temporaryFileName, "basePath": remoteFileName, "blockSize": blockSize,
+                               "delta": instructions, "append": numberOfPatches > 0}))
+    requests.append(("replace", {"path": remoteFileName, "temporaryPath": temporaryFileName, "sha256": getFileHash(fileName)}))
+    helper.batch(requests)
+
+    log.debug("Sent %d of %d bytes of '%s' to '%s'", literalSize, fileSize, fileName, helper.client.hostname)
+    return literalSize
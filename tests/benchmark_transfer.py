@@ -0,0 +1,102 @@
+"""
+Copyright (c) IBM 2015-2017. All Rights Reserved.
+Project name: storm-thunder
+This project is licensed under the MIT License, see LICENSE
+
+Throughput benchmark of the file transfers against a local SFTP server
+
+.. code-block:: bash
+
+    python tests/benchmark_transfer.py --sizes 1 16 128 --latency 0.01
+"""
+import argparse
+import logging
+import os
+import shutil
+import tempfile
+import time
+
+from conftest import connectToLocalServer
+from storm.thunder.transfer import (downloadBulk,
+                                    uploadBulk)
+
+
+log = logging.getLogger(__name__)
+
+def benchmark(client, directory, size, numberOfRuns):
+    """
+    Measure the throughput of uploading and downloading a file of the size with the
+    default SFTP transfers and the bulk transfers
+
+    :param client: connected ssh client
+    :type client: :class:`~storm.thunder.client.AdvancedSSHClient`
+    :param directory: working directory
+    :type directory: str
+    :param size: file size in bytes
+    :type size: int
+    :param numberOfRuns: number of runs
+    :type numberOfRuns: int
+    :returns: transfer method to throughput in MB/s mapping
+    :rtype: dict
+    """
+    fileName = os.path.join(directory, "local")
+    remoteFileName = os.path.join(directory, "remote")
+    downloadedFileName = os.path.join(directory, "downloaded")
+    with open(fileName, "wb") as f:
+        f.write(os.urandom(size))
+
+    def sftpGet():
+        sftp = client.client.open_sftp()
+        try:
+            sftp.get(remoteFileName, downloadedFileName)
+        finally:
+            sftp.close()
+
+    def sftpPut():
+        sftp = client.client.open_sftp()
+        try:
+            sftp.put(fileName, remoteFileName, confirm=True)
+        finally:
+            sftp.close()
+
+    methods = [
+        ("sftp put", sftpPut),
+        ("bulk upload", lambda: uploadBulk(client, fileName, remoteFileName)),
+        ("sftp get", sftpGet),
+        ("bulk download", lambda: downloadBulk(client, remoteFileName, downloadedFileName))
+    ]
+    throughputs = {}
+    for name, method in methods:
+        start = time.time()
+        for _ in range(numberOfRuns):
+            method()
+        throughputs[name] = size * numberOfRuns / (time.time() - start) / 1024 / 1024
+    return throughputs
+
+def main():
+    """
+    Run the benchmark
+    """
+    parser = argparse.ArgumentParser(description="Throughput benchmark of the file transfers against a local SFTP server")
+    parser.add_argument("--latency", default=0, type=float, help="One-way latency of the server in seconds")
+    parser.add_argument("--runs", default=3, type=int, help="Number of runs per transfer")
+    parser.add_argument("--sizes", default=[1, 16, 64], nargs="+", type=int, help="File sizes in MB")
+    args = parser.parse_args()
+    # conftest already configured the logging handler
+    logging.getLogger().setLevel(logging.WARNING)
+
+    client = connectToLocalServer(latency=args.latency)
+
+    directory = tempfile.mkdtemp(prefix="storm-thunder-benchmark-")
+    try:
+        print("{0:>10} {1:>14} {2:>14} {3:>14} {4:>14}".format("size (MB)", "sftp put", "bulk upload", "sftp get", "bulk download"))
+        for size in args.sizes:
+            throughputs = benchmark(client, directory, size * 1024 * 1024, args.runs)
+            print("{0:>10} {1:>9.1f} MB/s {2:>9.1f} MB/s {3:>9.1f} MB/s {4:>9.1f} MB/s".format(
+                size, throughputs["sftp put"], throughputs["bulk upload"], throughputs["sftp get"], throughputs["bulk download"]))
+    finally:
+        client.close()
+        shutil.rmtree(directory)
+
+if __name__ == "__main__":
+    main()
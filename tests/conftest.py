@@ -7,11 +7,247 @@ import inspect
 import logging
 import os
 import pytest
+import Queue
+import shutil
+import socket
+import subprocess
 import tempfile
+import threading
+import time
+
+import paramiko
+
+from storm.thunder import AdvancedSSHClient, agent, getEnsureLineCommand
 
 log = logging.getLogger(__name__)
 logging.basicConfig(format='%(asctime)s [%(levelname)s] [%(name)s(%(filename)s:%(lineno)d)] - %(message)s', level=logging.INFO)
 
+class LocalChannel(object):
+    """
+    Channel that runs its command on the local machine
+    """
+    def __init__(self, transport):
+        self.transport = transport
+        self.process = None
+
+    def close(self):
+        pass
+
+    def exec_command(self, command):
+        self.transport.commands.append(command)
+        self.process = subprocess.Popen(["/bin/bash", "-c", command], cwd=self.transport.directory,
+                                        stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+    def makefile(self, mode):
+        return self.process.stdout
+
+    def makefile_stderr(self, mode):
+        return self.process.stderr
+
+    def recv(self, size):
+        return os.read(self.process.stdout.fileno(), size)
+
+    def recv_exit_status(self):
+        return self.process.wait()
+
+    def sendall(self, data):
+        self.transport.sent += len(data)
+        self.process.stdin.write(data)
+
+    def shutdown_write(self):
+        self.process.stdin.close()
+
+class LocalClient(object):
+    """
+    Client whose commands, channels and file operations run in a local directory
+    """
+    hostname = "localhost"
+
+    def __init__(self, directory):
+        self.client = self
+        self.commands = []
+        self.directory = directory
+        self.sent = 0
+        self.uploads = []
+
+    def ensureLine(self, path, line, key=None, separator="="):
+        stdout, _, _ = self.run(getEnsureLineCommand(path, line, key=key, separator=separator))
+        return stdout.strip() == "changed"
+
+    def get_transport(self):
+        return self
+
+    def open_session(self):
+        return LocalChannel(self)
+
+    def put(self, path, contents=None):
+        with open(os.path.join(self.directory, path), "w") as f:
+            f.write(contents)
+
+    def read(self, path):
+        with open(os.path.join(self.directory, path)) as f:
+            return f.read()
+
+    def run(self, cmd):
+        self.commands.append(cmd)
+        process = subprocess.Popen(["/bin/bash", "-c", cmd], cwd=self.directory, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        stdout, stderr = process.communicate()
+        return stdout, stderr, process.returncode
+
+    def upload(self, localPath, remotePath):
+        self.uploads.append(localPath)
+        shutil.copyfile(localPath, os.path.join(self.directory, remotePath))
+        return True
+
+class LocalHelper(object):
+    """
+    Helper that performs the agent operations on the local machine
+    """
+    def __init__(self):
+        self.client = self
+        self.hostname = "localhost"
+        self.requests = []
+
+    def batch(self, requests):
+        self.requests.extend(requests)
+        return [agent.OPERATIONS[operation](**arguments) for operation, arguments in requests]
+
+    def call(self, operation, **arguments):
+        return self.batch([(operation, arguments)])[0]
+
+class LocalServer(paramiko.ServerInterface):
+    """
+    SSH server that accepts any password and sessions
+    """
+    def check_auth_password(self, username, password):
+        return paramiko.AUTH_SUCCESSFUL
+
+    def check_channel_request(self, kind, chanid):
+        return paramiko.OPEN_SUCCEEDED
+
+    def get_allowed_auths(self, username):
+        return "password"
+
+class LocalSFTPHandle(paramiko.SFTPHandle):
+    """
+    SFTP handle of a local file
+    """
+    def stat(self):
+        return paramiko.SFTPAttributes.from_stat(os.fstat(self.readfile.fileno()))
+
+class LocalSFTPServer(paramiko.SFTPServerInterface):
+    """
+    SFTP server that serves the local file system
+    """
+    def open(self, path, flags, attr):
+        mode = "r+b" if flags & os.O_RDWR else "wb" if flags & os.O_WRONLY else "rb"
+        if flags & os.O_CREAT and not os.path.exists(path):
+            open(path, "wb").close()
+        f = open(path, mode)
+        if flags & os.O_TRUNC:
+            f.truncate()
+        handle = LocalSFTPHandle(flags)
+        handle.readfile = f
+        handle.writefile = f
+        return handle
+
+    def stat(self, path):
+        return paramiko.SFTPAttributes.from_stat(os.stat(path))
+
+    lstat = stat
+
+def addLatency(sock, latency):
+    """
+    Forward the data of the socket in both directions after a delay in order to
+    simulate the latency of a remote link without limiting its bandwidth
+
+    :param sock: socket
+    :type sock: :class:`~socket.socket`
+    :param latency: one-way latency in seconds
+    :type latency: float
+    :returns: socket with latency
+    :rtype: :class:`~socket.socket`
+    """
+    delayedSocket, proxySocket = socket.socketpair()
+
+    def receive(source, queue):
+        try:
+            for data in iter(lambda: source.recv(65536), b""):
+                queue.put((time.time() + latency, data))
+        except socket.error:
+            pass
+        queue.put((0, None))
+
+    def send(destination, queue):
+        try:
+            for due, data in iter(queue.get, (0, None)):
+                time.sleep(max(0, due - time.time()))
+                destination.sendall(data)
+            destination.shutdown(socket.SHUT_WR)
+        except socket.error:
+            pass
+
+    for source, destination in [(sock, proxySocket), (proxySocket, sock)]:
+        queue = Queue.Queue()
+        for target, argument in [(receive, source), (send, destination)]:
+            thread = threading.Thread(target=target, args=(argument, queue))
+            thread.daemon = True
+            thread.start()
+    return delayedSocket
+
+def connectToLocalServer(latency=0):
+    """
+    Start an SSH server with SFTP support on the local host and connect to it
+
+    :param latency: one-way latency of the server in seconds
+    :type latency: float
+    :returns: connected ssh client
+    :rtype: :class:`~storm.thunder.client.AdvancedSSHClient`
+    """
+    hostKey = paramiko.RSAKey.generate(2048)
+    serverSocket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    serverSocket.bind(("127.0.0.1", 0))
+    serverSocket.listen(1)
+
+    def serve():
+        connection, _ = serverSocket.accept()
+        serverSocket.close()
+        transport = paramiko.Transport(addLatency(connection, latency) if latency else connection)
+        transport.add_server_key(hostKey)
+        transport.set_subsystem_handler("sftp", paramiko.SFTPServer, LocalSFTPServer)
+        transport.start_server(server=LocalServer())
+    serverThread = threading.Thread(target=serve)
+    serverThread.daemon = True
+    serverThread.start()
+
+    client = AdvancedSSHClient("127.0.0.1", port=serverSocket.getsockname()[1], username="benchmark", password="benchmark")
+    client.client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+    client.connect()
+    return client
+
+@pytest.fixture
+def localClient(tmpdir):
+    """
+    Client whose commands run in the temporary directory of the test
+    """
+    return LocalClient(str(tmpdir))
+
+@pytest.fixture
+def localHelper():
+    """
+    Helper whose agent operations run on the local machine
+    """
+    return LocalHelper()
+
+@pytest.fixture
+def localServerClient(request):
+    """
+    Client connected to an SSH server with SFTP support on the local host
+    """
+    client = connectToLocalServer()
+    request.addfinalizer(client.close)
+    return client
+
 @pytest.fixture(scope="function")
 def mockAdvancedSSHClient(monkeypatch):
 
@@ -0,0 +1,96 @@
+"""
+Copyright (c) IBM 2015-2017. All Rights Reserved.
+Project name: storm-thunder
+This project is licensed under the MIT License, see LICENSE
+"""
+import base64
+import json
+import logging
+import os
+import struct
+import subprocess
+import sys
+
+from storm.thunder import agent
+
+
+log = logging.getLogger(__name__)
+
+def test_agent(tmpdir):
+
+    process = subprocess.Popen([sys.executable, os.path.abspath(agent.__file__.replace(".pyc", ".py"))],
+                               stdin=subprocess.PIPE, stdout=subprocess.PIPE, cwd=str(tmpdir))
+
+    requests = [
+        ("mkdir", {"path": "test/directory"}),
+        ("put", {"path": "test/directory/file", "content": base64.b64encode("test"), "chmod": 0600}),
+        ("isFile", {"path": "test/directory/file"}),
+        ("exists", {"path": "test/missing"}),
+        ("read", {"path": "test/directory/file"}),
+        ("run", {"command": "echo test; exit 3"}),
+        # commands cannot read the requests that follow
+        ("run", {"command": "cat"}),
+        ("read", {"path": "test/missing"})
+    ]
+    # pipeline all requests before reading the responses
+    for requestId, (operation, arguments) in enumerate(requests):
+        data = json.dumps({"id": requestId, "operation": operation, "arguments": arguments})
+        process.stdin.write(struct.pack(">I", len(data)) + data)
+    process.stdin.close()
+
+    responses = []
+    for _ in requests:
+        length = struct.unpack(">I", process.stdout.read(4))[0]
+        responses.append(json.loads(process.stdout.read(length)))
+    assert process.wait() == 0
+
+    assert [response["id"] for response in responses] == range(len(requests))
+    assert os.stat(str(tmpdir.join("test", "directory", "file"))).st_mode & 0777 == 0600
+    assert responses[2]["result"] is True
+    assert responses[3]["result"] is False
+    assert base64.b64decode(responses[4]["result"]) == "test"
+    assert base64.b64decode(responses[5]["result"]["stdout"]) == "test\n"
+    assert responses[5]["result"]["status"] == 3
+    assert base64.b64decode(responses[6]["result"]["stdout"]) == ""
+    assert "error" in responses[7]
+
+def test_ensureBlock(tmpdir):
+
+    path = str(tmpdir.join("profile"))
+    assert agent.ensureBlock(path, "PATH=$PATH:/opt/test\nexport PATH", marker="test")
+    assert tmpdir.join("profile").read() == "# BEGIN test\nPATH=$PATH:/opt/test\nexport PATH\n# END test\n"
+    assert not agent.ensureBlock(path, "PATH=$PATH:/opt/test\nexport PATH", marker="test")
+
+    tmpdir.join("profile").write("alias ll='ls -l'\n" + tmpdir.join("profile").read() + "umask 022\n")
+    assert agent.ensureBlock(path, "PATH=$PATH:/opt/other", marker="test")
+    assert tmpdir.join("profile").read() == "alias ll='ls -l'\n# BEGIN test\nPATH=$PATH:/opt/other\n# END test\numask 022\n"
+
+def test_ensureHostsEntry(tmpdir):
+
+    path = str(tmpdir.join("hosts"))
+    tmpdir.join("hosts").write("127.0.0.1 localhost\n# cluster\n10.0.0.9 node1.domain node1 # moved\n10.0.0.2 node2\n")
+
+    # hostnames move from other ip addresses and entries without hostnames left are removed
+    assert agent.ensureHostsEntry(path, "10.0.0.1", ["node1.domain", "node1"])
+    assert tmpdir.join("hosts").read() == "127.0.0.1 localhost\n# cluster\n10.0.0.2 node2\n10.0.0.1 node1.domain node1\n"
+    assert not agent.ensureHostsEntry(path, "10.0.0.1", ["node1"])
+
+    # hostnames of the same ip address are merged
+    assert agent.ensureHostsEntry(path, "10.0.0.2", ["node2.domain", "node2"])
+    assert agent.ensureHostsEntry(path, "10.0.0.1", ["alias1"])
+    assert tmpdir.join("hosts").read() == "127.0.0.1 localhost\n# cluster\n10.0.0.2 node2 node2.domain\n10.0.0.1 node1.domain node1 alias1\n"
+
+def test_ensureLine(tmpdir):
+
+    path = str(tmpdir.join("sysctl.conf"))
+    tmpdir.join("sysctl.conf").write("# kernel.shmmax = 1\n  kernel.shmmax=5\nvm.swappinessX = 1\n")
+
+    assert agent.ensureLine(path, "kernel.shmmax = 7", key="kernel.shmmax")
+    assert not agent.ensureLine(path, "kernel.shmmax = 7", key="kernel.shmmax")
+    assert agent.ensureLine(path, "vm.swappiness = 10", key="vm.swappiness")
+    assert tmpdir.join("sysctl.conf").read() == "# kernel.shmmax = 1\nkernel.shmmax = 7\nvm.swappinessX = 1\nvm.swappiness = 10\n"
+
+    path = str(tmpdir.join("hosts"))
+    tmpdir.join("hosts").write("10.0.0.10 other\n10.0.0.1 old\n")
+    assert agent.ensureLine(path, "10.0.0.1 node1", key="10.0.0.1", separator=" ")
+    assert tmpdir.join("hosts").read() == "10.0.0.10 other\n10.0.0.1 node1\n"
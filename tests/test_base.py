@@ -5,11 +5,62 @@ This project is licensed under the MIT License, see LICENSE
 """
 import logging
 
-from storm.thunder import BaseNodeInfo, NodesInfoMap
+import pytest
+
+from storm.deployments.node import (AddPathsToBashProfile,
+                                    Reboot,
+                                    SetKernelParameters)
+from storm.thunder import (BaseNodeInfo,
+                           Deployment,
+                           NodesInfoMap,
+                           ScriptDeployment,
+                           deploy)
+from storm.thunder.base import combineScriptDeployments
 
 
 log = logging.getLogger(__name__)
 
+def test_combineScriptDeployments():
+
+    addPaths = AddPathsToBashProfile(["/opt/test"])
+    reboot = Reboot()
+    setKernelParameters = SetKernelParameters(swappiness=10)
+
+    # deploy accepts any sequence of deployments
+    combined = combineScriptDeployments((addPaths, setKernelParameters, reboot, setKernelParameters))
+    assert len(combined) == 3
+    assert isinstance(combined[0], ScriptDeployment)
+    assert combined[0].deployments == [addPaths, setKernelParameters]
+    assert combined[1:] == [reboot, setKernelParameters]
+
+def test_deployReleasesJumpHosts(monkeypatch):
+
+    class Noop(Deployment):
+        def run(self, node, client, usePrivateIps):
+            return node
+
+    monkeypatch.setattr("storm.thunder.client.jumpHosts", {})
+    closed = []
+    monkeypatch.setattr("storm.thunder.client.JumpHost.close", lambda self: closed.append(self))
+    monkeypatch.setattr("storm.thunder.client.AdvancedSSHClient.close", lambda self: None)
+    node = BaseNodeInfo("node1", "10.0.0.1")
+    node.extra["jumpHost"] = "bastion.example.com"
+
+    # nodes that cannot be connected to
+    def connect(self):
+        raise IOError("connection refused")
+    monkeypatch.setattr("storm.thunder.client.AdvancedSSHClient.connect", connect)
+    assert deploy(Noop(), node, preflightTimeout=0).numberOfErrors == 1
+    assert len(closed) == 1
+
+    # errors while running the deployments
+    monkeypatch.setattr("storm.thunder.client.AdvancedSSHClient.connect", lambda self: True)
+    def callback(step):
+        raise RuntimeError("callback failed")
+    with pytest.raises(RuntimeError):
+        deploy(Noop(), node, preflightTimeout=0, callback=callback)
+    assert len(closed) == 2
+
 class TestBaseNodeInfo(object):
 
     def test_getNodesByName(self):
@@ -67,3 +118,9 @@ class TestBaseNodeInfo(object):
         assert nodes[0].name == testNode.name
         assert nodes[0].public_ips == testNode.public_ips
         assert nodes[0].extra == testNode.extra
+
+        # jump host information is preserved
+        testJumpHost = BaseNodeInfo("testJumpHost", "10.0.0.1", jumpHost="admin@bastion.example.com")
+        nodesInformation.add(testJumpHost)
+        nodes = nodesInformation.getNodesByNames(["testJumpHost"])
+        assert nodes[0].extra["jumpHost"] == "admin@bastion.example.com"
@@ -0,0 +1,68 @@
+"""
+Copyright (c) IBM 2015-2017. All Rights Reserved.
+Project name: storm-thunder
+This project is licensed under the MIT License, see LICENSE
+"""
+import logging
+import os
+
+from storm.thunder import RemoteArtifactCache, getFileHash
+
+
+log = logging.getLogger(__name__)
+
+def test_materialize(localClient, tmpdir):
+
+    tmpdir.join("first.rpm").write("first")
+    tmpdir.join("second.rpm").write("second")
+    tmpdir.join("copy.rpm").write("first")
+    fileNames = [str(tmpdir.join(fileName)) for fileName in ["first.rpm", "second.rpm", "copy.rpm"]]
+    cacheDirectory = tmpdir.join("cache")
+
+    client = localClient
+    cache = RemoteArtifactCache(client, directory=str(cacheDirectory))
+    remoteFileNames = cache.materialize(fileNames, str(tmpdir.join("run1")))
+    assert remoteFileNames == [str(tmpdir.join("run1", fileName)) for fileName in ["first.rpm", "second.rpm", "copy.rpm"]]
+    assert tmpdir.join("run1", "copy.rpm").read() == "first"
+
+    # identical contents are only uploaded once
+    assert client.uploads == fileNames[:2]
+    assert sorted(os.listdir(str(cacheDirectory))) == sorted(getFileHash(fileName) for fileName in fileNames[:2])
+
+    # cached files are not uploaded again
+    client.uploads = []
+    cache.materialize(fileNames, str(tmpdir.join("run2")))
+    assert client.uploads == []
+    assert tmpdir.join("run2", "second.rpm").read() == "second"
+
+    # editing materialized files does not affect the cache
+    tmpdir.join("run2", "second.rpm").write("edited", mode="a")
+    cache.materialize(fileNames, str(tmpdir.join("run3")))
+    assert tmpdir.join("run3", "second.rpm").read() == "second"
+
+def test_materializeFallback(localClient, tmpdir):
+
+    # users that cannot write to the cache directory use the fallback directory
+    tmpdir.join("file.rpm").write("file")
+    tmpdir.join("readonly").write("not a directory")
+    cache = RemoteArtifactCache(localClient, directory=str(tmpdir.join("readonly", "cache")), fallbackDirectory=str(tmpdir.join("fallback")))
+    cache.materialize([str(tmpdir.join("file.rpm"))], str(tmpdir.join("target")))
+    assert cache.directory == str(tmpdir.join("fallback"))
+    assert os.listdir(str(tmpdir.join("fallback"))) == [getFileHash(str(tmpdir.join("file.rpm")))]
+    assert tmpdir.join("target", "file.rpm").read() == "file"
+
+def test_materializeEviction(localClient, tmpdir):
+
+    tmpdir.join("old.rpm").write("o" * 100)
+    tmpdir.join("new.rpm").write("n" * 100)
+    cacheDirectory = tmpdir.join("cache")
+
+    client = localClient
+    cache = RemoteArtifactCache(client, directory=str(cacheDirectory), maximumSize=150)
+    cache.materialize([str(tmpdir.join("old.rpm"))], str(tmpdir.join("target")))
+    os.utime(str(cacheDirectory.join(getFileHash(str(tmpdir.join("old.rpm"))))), (0, 0))
+    cache.materialize([str(tmpdir.join("new.rpm"))], str(tmpdir.join("target")))
+
+    # least recently used entries are evicted while materialized files remain
+    assert os.listdir(str(cacheDirectory)) == [getFileHash(str(tmpdir.join("new.rpm")))]
+    assert tmpdir.join("target", "old.rpm").read() == "o" * 100
@@ -0,0 +1,347 @@
+"""
+Copyright (c) IBM 2015-2017. All Rights Reserved.
+Project name: storm-thunder
+This project is licensed under the MIT License, see LICENSE
+"""
+import logging
+import os
+import socket
+
+from storm.thunder import (AdvancedSSHClient,
+                           FileTransaction,
+                           JobPoller,
+                           RemoteJob,
+                           getJumpHost,
+                           releaseJumpHost)
+from storm.thunder import agent
+from storm.thunder.client import (getEnsureBlockCommand,
+                                  getEnsureHostsEntryCommand,
+                                  getEnsureLineCommand)
+
+
+log = logging.getLogger(__name__)
+
+class FakeChannel(object):
+    """
+    Channel that finishes its command after a number of polls
+    """
+    def __init__(self, transport):
+        self.transport = transport
+        self.command = None
+        self.polls = 0
+        self.stdout = ""
+        self.stderr = ""
+
+    def close(self):
+        self.transport.running.discard(self)
+
+    def exec_command(self, command):
+        self.command = command
+        self.stdout = command
+        self.stderr = "error" if command == "fail" else ""
+        self.transport.running.add(self)
+        self.transport.maximumRunning = max(self.transport.maximumRunning, len(self.transport.running))
+
+    def exit_status_ready(self):
+        self.polls += 1
+        return self.polls > len(self.command)
+
+    def recv(self, size):
+        data, self.stdout = self.stdout[:size], self.stdout[size:]
+        return data
+
+    def recv_exit_status(self):
+        return 1 if self.command == "fail" else 0
+
+    def recv_ready(self):
+        return self.polls > 1 and bool(self.stdout)
+
+    def recv_stderr(self, size):
+        data, self.stderr = self.stderr[:size], self.stderr[size:]
+        return data
+
+    def recv_stderr_ready(self):
+        return self.polls > 1 and bool(self.stderr)
+
+    def shutdown_write(self):
+        pass
+
+class FakeTransport(object):
+    """
+    Transport that keeps track of the number of concurrently running channels
+    """
+    def __init__(self):
+        self.maximumRunning = 0
+        self.running = set()
+
+    def is_active(self):
+        return True
+
+    def open_session(self):
+        return FakeChannel(self)
+
+def test_chmod(monkeypatch):
+
+    class FakeSFTP(object):
+
+        def __init__(self, error):
+            self.error = error
+
+        def chmod(self, path, mode):
+            if self.error:
+                raise self.error
+
+        def close(self):
+            pass
+
+    client = AdvancedSSHClient("node")
+    connected = [True]
+    errors = [socket.error("connection lost"), None]
+    reconnects = []
+    monkeypatch.setattr(client, "ensureConnected", lambda: reconnects.append(True) or connected.__setitem__(0, True))
+    monkeypatch.setattr(client, "isConnected", lambda: connected[0])
+    def open_sftp():
+        error = errors.pop(0)
+        if isinstance(error, socket.error):
+            connected[0] = False
+        return FakeSFTP(error)
+    monkeypatch.setattr(client.client, "open_sftp", open_sftp)
+
+    # transport errors are replayed after reconnecting
+    client.chmod("/tmp/file", 0644)
+    assert not errors
+    assert len(reconnects) == 2
+
+    # other errors are only logged
+    errors.append(IOError("permission denied"))
+    client.chmod("/tmp/file", 0644)
+
+def test_fileTransaction(localClient, tmpdir):
+
+    client = localClient
+    hostsPath = str(tmpdir.join("hosts"))
+    tmpdir.join("hosts").write("127.0.0.1 localhost\n10.0.0.1 old\n")
+    os.chmod(hostsPath, 0640)
+    profilePath = str(tmpdir.join("profile"))
+
+    transaction = FileTransaction(client)
+    assert transaction.ensureLine(hostsPath, "10.0.0.1 node1", key="10.0.0.1", separator=" ")
+    assert transaction.ensureLine(hostsPath, "10.0.0.2 node2", key="10.0.0.2", separator=" ")
+    assert not transaction.ensureLine(hostsPath, "10.0.0.2 node2", key="10.0.0.2", separator=" ")
+    assert transaction.ensureBlock(profilePath, "export PATH=$PATH:/opt/test", marker="test")
+
+    # files are only read once and not written until the transaction is flushed
+    assert len(client.commands) == 2
+    assert tmpdir.join("hosts").read() == "127.0.0.1 localhost\n10.0.0.1 old\n"
+    assert not tmpdir.join("profile").check()
+
+    transaction.flush()
+    assert len(client.commands) == 3
+    assert tmpdir.join("hosts").read() == "127.0.0.1 localhost\n10.0.0.1 node1\n10.0.0.2 node2\n"
+    assert os.stat(hostsPath).st_mode & 0777 == 0640
+    assert tmpdir.join("profile").read() == "# BEGIN test\nexport PATH=$PATH:/opt/test\n# END test\n"
+    assert sorted(os.listdir(str(tmpdir))) == ["hosts", "profile"]
+
+    # nothing to write
+    transaction.flush()
+    assert len(client.commands) == 3
+
+def test_getEnsureBlockCommand(localClient, tmpdir):
+
+    client = localClient
+    path = str(tmpdir.join("profile"))
+
+    assert client.run(getEnsureBlockCommand(path, "PATH=$PATH:/opt/test\nexport PATH\n", marker="test"))[0] == "changed\n"
+    assert tmpdir.join("profile").read() == "# BEGIN test\nPATH=$PATH:/opt/test\nexport PATH\n# END test\n"
+    assert client.run(getEnsureBlockCommand(path, "PATH=$PATH:/opt/test\nexport PATH", marker="test"))[0] == "unchanged\n"
+
+    tmpdir.join("profile").write("alias ll='ls -l'\n" + tmpdir.join("profile").read() + "umask 022\n")
+    assert client.run(getEnsureBlockCommand(path, "PATH=$PATH:/opt/other", marker="test"))[0] == "changed\n"
+    assert tmpdir.join("profile").read() == "alias ll='ls -l'\n# BEGIN test\nPATH=$PATH:/opt/other\n# END test\numask 022\n"
+
+def test_getEnsureHostsEntryCommand(localClient, tmpdir):
+
+    client = localClient
+    path = str(tmpdir.join("hosts"))
+    contents = "127.0.0.1 localhost\n\n# cluster\n10.0.0.9\tnode1.domain node1 other # moved\n10.0.0.2 node2\n10.0.0.2 node2 node2.domain\n"
+    edits = [
+        ("10.0.0.1", ["node1.domain", "node1"]),
+        ("10.0.0.1", ["node1"]),
+        ("10.0.0.2", ["node2.domain", "node2", "alias2"]),
+        ("10.0.0.9", ["node9"]),
+        ("10.0.0.3", ["other", "node1"])
+    ]
+
+    # the command edits the file the same way as the agent
+    tmpdir.join("hosts").write(contents)
+    lines = contents.splitlines()
+    for ip, hostnames in edits:
+        changed = agent.ensureHostsEntryInLines(lines, ip, hostnames)
+        assert client.run(getEnsureHostsEntryCommand(path, ip, hostnames))[0] == ("changed\n" if changed else "unchanged\n")
+        assert tmpdir.join("hosts").read() == "".join(line + "\n" for line in lines)
+    assert tmpdir.join("hosts").read() == (
+        "127.0.0.1 localhost\n\n# cluster\n10.0.0.9 node9 # moved\n10.0.0.2 node2 node2.domain alias2\n10.0.0.1 node1.domain\n10.0.0.3 other node1\n")
+
+def test_getEnsureLineCommand(localClient, tmpdir):
+
+    client = localClient
+    path = str(tmpdir.join("sysctl.conf"))
+    tmpdir.join("sysctl.conf").write("# kernel.shmmax = 1\n  kernel.shmmax=5\nvm.swappinessX = 1\n")
+
+    assert client.run(getEnsureLineCommand(path, "kernel.shmmax = 7", key="kernel.shmmax"))[0] == "changed\n"
+    assert client.run(getEnsureLineCommand(path, "kernel.shmmax = 7", key="kernel.shmmax"))[0] == "unchanged\n"
+    assert client.run(getEnsureLineCommand(path, "vm.swappiness = 10", key="vm.swappiness"))[0] == "changed\n"
+    assert tmpdir.join("sysctl.conf").read() == "# kernel.shmmax = 1\nkernel.shmmax = 7\nvm.swappinessX = 1\nvm.swappiness = 10\n"
+
+    # whitespace separators and special characters
+    path = str(tmpdir.join("hosts"))
+    tmpdir.join("hosts").write("10.0.0.10 other\n10.0.0.1 old\n")
+    assert client.run(getEnsureLineCommand(path, "10.0.0.1 node1 'node\\1'", key="10.0.0.1", separator=" "))[0] == "changed\n"
+    assert tmpdir.join("hosts").read() == "10.0.0.10 other\n10.0.0.1 node1 'node\\1'\n"
+
+def test_getJumpHost(monkeypatch):
+
+    monkeypatch.setattr("storm.thunder.client.jumpHosts", {})
+
+    jumpHost = getJumpHost("admin@bastion.example.com:2222")
+    assert jumpHost.hostname == "bastion.example.com"
+    assert jumpHost.port == 2222
+    assert jumpHost.client.username == "admin"
+
+    # nodes behind the same jump host share it
+    assert getJumpHost({"hostname": "bastion.example.com", "port": 2222, "username": "admin"}) is jumpHost
+
+    otherJumpHost = getJumpHost("bastion.example.com")
+    assert otherJumpHost is not jumpHost
+    assert otherJumpHost.port == 22
+    assert otherJumpHost.client.username == "root"
+
+    # jump hosts are closed once all users released them
+    closed = []
+    monkeypatch.setattr(jumpHost, "close", lambda: closed.append(jumpHost))
+    releaseJumpHost(jumpHost)
+    assert not closed
+    releaseJumpHost(jumpHost)
+    assert closed == [jumpHost]
+    assert getJumpHost("admin@bastion.example.com:2222") is not jumpHost
+
+def test_remoteJob(localClient, monkeypatch):
+
+    monkeypatch.setattr("storm.thunder.client.jobPoller", JobPoller(interval=0.1))
+
+    client = localClient
+    job = RemoteJob(client, "sleep 0.5; echo output; echo error >&2; exit 3")
+    job.start()
+    assert not job.isDone()
+    assert job.wait(timeout=10) == ("output\n", "error\n", 3)
+    assert job.isDone()
+
+    # jobs whose process ended without an exit status are reported as failed
+    lostJob = RemoteJob(client, "kill -9 $$")
+    lostJob.start()
+    stdout, stderr, status = lostJob.wait(timeout=10)
+    assert status == -1
+    assert "Job ended without reporting an exit status" in stderr
+
+def test_remoteJobLost(localClient, monkeypatch):
+
+    monkeypatch.setattr("storm.thunder.client.jobPoller", JobPoller(interval=0.1, maximumPollFailures=3))
+
+    client = localClient
+    job = RemoteJob(client, "sleep 5")
+    job.start()
+
+    # the node goes away while the job is running
+    def run(cmd):
+        client.commands.append(cmd)
+        raise socket.error("connection lost")
+    client.run = run
+    stdout, stderr, status = job.wait(timeout=10)
+    assert status == -1
+    assert "Could not poll job 3 times" in stderr
+    assert len(client.commands) == 4
+
+def test_runMany(monkeypatch):
+
+    monkeypatch.setattr("storm.thunder.client.select.select", lambda readable, writable, exceptional, timeout: (readable, [], []))
+
+    transport = FakeTransport()
+    client = AdvancedSSHClient("node")
+    monkeypatch.setattr(client.client, "get_transport", lambda: transport)
+
+    commands = ["first command", "fail", "second", "third command with a longer runtime", "fourth"]
+    results = client.runMany(commands, maxConcurrent=2)
+
+    assert results == [
+        ("first command", "", 0),
+        ("fail", "error", 1),
+        ("second", "", 0),
+        ("third command with a longer runtime", "", 0),
+        ("fourth", "", 0)
+    ]
+    assert transport.maximumRunning == 2
+    assert not transport.running
+
+def test_upload(localServerClient, tmpdir):
+
+    fileNames = []
+    for number in range(10):
+        tmpdir.join("file{0}".format(number)).write("contents {0}".format(number))
+        fileNames.append(str(tmpdir.join("file{0}".format(number))))
+    # directories cannot be uploaded
+    fileNames.insert(5, str(tmpdir.mkdir("directory")))
+    remoteDirectory = tmpdir.mkdir("remote")
+
+    client = localServerClient
+    sessions = []
+    openSFTP = client.client.open_sftp
+    def open_sftp():
+        sessions.append(openSFTP())
+        return sessions[-1]
+    client.client.open_sftp = open_sftp
+
+    statistics = {}
+    uploaded = client.upload(fileNames, str(remoteDirectory), maxConcurrent=3, statistics=statistics)
+    numberOfSessions = len(sessions)
+
+    downloadedSize = client.download(str(remoteDirectory.join("file0")), str(tmpdir.join("downloaded")))
+    assert client.download(str(remoteDirectory.join("missing")), str(tmpdir.join("missing"))) is None
+
+    assert uploaded == fileNames[:5] + fileNames[6:]
+    assert numberOfSessions == 3
+    assert statistics == dict((fileName, len(open(fileName).read())) for fileName in uploaded)
+    assert downloadedSize == len("contents 0")
+    assert tmpdir.join("downloaded").read() == "contents 0"
+    for number in range(10):
+        assert remoteDirectory.join("file{0}".format(number)).read() == "contents {0}".format(number)
+
+def test_uploadSessionFailure(localServerClient, tmpdir):
+
+    fileNames = []
+    for number in range(6):
+        tmpdir.join("file{0}".format(number)).write("contents {0}".format(number))
+        fileNames.append(str(tmpdir.join("file{0}".format(number))))
+    remoteDirectory = tmpdir.mkdir("remote")
+
+    client = localServerClient
+    openSFTP = client.client.open_sftp
+    attempts = []
+    def open_sftp():
+        attempts.append(True)
+        if len(attempts) == 1:
+            raise EOFError("session refused")
+        return openSFTP()
+    client.client.open_sftp = open_sftp
+
+    # the other sessions upload the files of the session that could not be opened
+    assert client.upload(fileNames, str(remoteDirectory), maxConcurrent=3) == fileNames
+    for number in range(6):
+        assert remoteDirectory.join("file{0}".format(number)).read() == "contents {0}".format(number)
+
+    # no session at all fails every file instead of the whole batch
+    def failingOpenSFTP():
+        raise EOFError("session refused")
+    client.client.open_sftp = failingOpenSFTP
+    statistics = {}
+    assert client.upload(fileNames, str(remoteDirectory), maxConcurrent=3, statistics=statistics) == []
+    assert statistics == {}
@@ -0,0 +1,148 @@
+"""
+Copyright (c) IBM 2015-2017. All Rights Reserved.
+Project name: storm-thunder
+This project is licensed under the MIT License, see LICENSE
+"""
+import logging
+import socket
+import threading
+
+import pytest
+
+from storm.thunder import (AdmissionController,
+                           ReadinessProber,
+                           checkReachability, selectAddresses)
+
+
+log = logging.getLogger(__name__)
+
+@pytest.fixture
+def sshServerStandIn(request):
+    """
+    Local server that sends an SSH protocol banner to every connection
+    """
+    serverSocket = socket.socket()
+    serverSocket.bind(("127.0.0.1", 0))
+    serverSocket.listen(5)
+
+    def serve():
+        while True:
+            try:
+                connection, _ = serverSocket.accept()
+            except socket.error:
+                break
+            connection.sendall("Welcome\r\nSSH-2.0-OpenSSH_7.4\r\n")
+            connection.close()
+
+    thread = threading.Thread(target=serve)
+    thread.daemon = True
+    thread.start()
+    request.addfinalizer(serverSocket.close)
+    return serverSocket.getsockname()
+
+@pytest.fixture
+def unusedPort():
+    unusedSocket = socket.socket()
+    unusedSocket.bind(("127.0.0.1", 0))
+    port = unusedSocket.getsockname()[1]
+    unusedSocket.close()
+    return port
+
+def test_checkReachability(sshServerStandIn, unusedPort):
+
+    reachable, unreachable = checkReachability(
+        {
+            "node1": sshServerStandIn,
+            "node2": ("127.0.0.1", unusedPort)
+        },
+        timeout=1)
+    assert reachable.keys() == ["node1"]
+    assert reachable["node1"].banner == "SSH-2.0-OpenSSH_7.4"
+    assert unreachable == ["node2"]
+
+def test_selectAddresses(sshServerStandIn):
+
+    candidates = {
+        "node1": ["127.0.0.2", sshServerStandIn[0]],
+        "node2": ["127.0.0.2"]
+    }
+    selected, unreachable = selectAddresses(candidates, port=sshServerStandIn[1], timeout=1)
+    assert selected.keys() == ["node1"]
+    assert selected["node1"].key == "node1"
+    assert selected["node1"].hostname == sshServerStandIn[0]
+    assert selected["node1"].latency >= 0
+    assert unreachable == ["node2"]
+
+    # selections are cached
+    cachedSelected, _ = selectAddresses({"node1": candidates["node1"]}, port=sshServerStandIn[1], timeout=1)
+    assert cachedSelected["node1"] is selected["node1"]
+
+class TestAdmissionController(object):
+
+    def test_call(self):
+
+        controller = AdmissionController(initialLimit=4, maximumLimit=5)
+        calls = []
+
+        def flaky():
+            calls.append(controller.active)
+            if len(calls) < 3:
+                raise socket.error("Error reading SSH protocol banner")
+            return "connected"
+
+        assert controller.call(flaky, attempts=3, delay=0) == "connected"
+        assert calls == [1, 1, 1]
+        assert controller.active == 0
+
+        def failing():
+            raise socket.error("Connection refused")
+
+        with pytest.raises(socket.error):
+            controller.call(failing, attempts=2, delay=0)
+        assert controller.active == 0
+
+    def test_release(self):
+
+        controller = AdmissionController(initialLimit=4, minimumLimit=1, maximumLimit=5)
+        controller.release(controller.acquire())
+        assert controller.limit == 5
+        controller.release(controller.acquire())
+        assert controller.limit == 5
+
+        # failures of operations started before the last decrease only count once
+        first = controller.acquire()
+        second = controller.acquire()
+        controller.release(first, success=False)
+        assert controller.limit == 2.5
+        controller.release(second, success=False)
+        assert controller.limit == 2.5
+
+        controller.release(controller.acquire(), success=False)
+        controller.release(controller.acquire(), success=False)
+        assert controller.limit == 1
+
+class TestReadinessProber(object):
+
+    def test_events(self, sshServerStandIn, unusedPort):
+
+        prober = ReadinessProber(connectTimeout=1, initialDelay=0.1)
+        prober.add("ready", sshServerStandIn[0], port=sshServerStandIn[1])
+        prober.add("closed", "127.0.0.1", port=unusedPort)
+
+        events = list(prober.events(timeout=2))
+        assert len(events) == 1
+        assert events[0].key == "ready"
+        assert events[0].banner == "SSH-2.0-OpenSSH_7.4"
+        assert "closed" in prober
+
+        ready, notReady = prober.wait(timeout=0.5)
+        assert ready == []
+        assert notReady == ["closed"]
+        assert len(prober) == 0
+
+    def test_getDelay(self):
+
+        prober = ReadinessProber(initialDelay=1, maximumDelay=8, backoffFactor=2, jitter=0.5)
+        for attempts, maximumDelay in [(1, 1), (2, 2), (3, 4), (4, 8), (10, 8)]:
+            delay = prober.getDelay(attempts)
+            assert maximumDelay / 2.0 <= delay <= maximumDelay
@@ -0,0 +1,25 @@
+"""
+Copyright (c) IBM 2015-2017. All Rights Reserved.
+Project name: storm-thunder
+This project is licensed under the MIT License, see LICENSE
+"""
+import logging
+import os
+import subprocess
+
+from storm.deployments.git import isRepository
+
+
+log = logging.getLogger(__name__)
+
+def test_isRepository(localClient, tmpdir):
+
+    subprocess.check_call(["git", "init", "--quiet", str(tmpdir.join("repository"))])
+    tmpdir.join("repository", "subdirectory").ensure(dir=True)
+    os.symlink(str(tmpdir.join("repository")), str(tmpdir.join("link")))
+
+    assert isRepository(localClient, str(tmpdir.join("repository")))
+    # repositories reached through symbolic links
+    assert isRepository(localClient, str(tmpdir.join("link")))
+    assert not isRepository(localClient, str(tmpdir.join("repository", "subdirectory")))
+    assert not isRepository(localClient, str(tmpdir.join("missing")))
@@ -0,0 +1,49 @@
+"""
+Copyright (c) IBM 2015-2017. All Rights Reserved.
+Project name: storm-thunder
+This project is licensed under the MIT License, see LICENSE
+"""
+import logging
+import subprocess
+
+from storm.deployments.node import AddPathsToBashProfile
+from storm.thunder import BaseNodeInfo
+from storm.thunder.script import ScriptBuilder
+
+
+log = logging.getLogger(__name__)
+
+PROFILE = """# PATH=/opt/commented
+PATH=$PATH:/opt/first:/opt/second
+export PATH="${PATH}:/opt/quoted"
+"""
+
+def test_addPathsToBashProfile(localClient, tmpdir):
+
+    for name in ["first", "quoted", "new"]:
+        tmpdir.mkdir(name)
+    paths = [str(tmpdir.join(name)) for name in ["first", "quoted", "new"]]
+    tmpdir.join("profile").write(PROFILE.replace("/opt", str(tmpdir)))
+
+    AddPathsToBashProfile(paths, profilePath="profile").run(BaseNodeInfo("node1", "10.0.0.1"), localClient, False)
+
+    # only paths that no PATH assignment contains yet are appended
+    assert tmpdir.join("profile").read() == PROFILE.replace("/opt", str(tmpdir)) + "export PATH=$PATH:{0}\n".format(paths[2])
+
+def test_addPathsToBashProfileScript(tmpdir):
+
+    tmpdir.mkdir("first")
+    tmpdir.mkdir("commented")
+    paths = [str(tmpdir.join("first")), str(tmpdir.join("commented"))]
+    tmpdir.join("profile").write(PROFILE.replace("/opt", str(tmpdir)))
+
+    builder = ScriptBuilder()
+    builder.addStep("paths")
+    AddPathsToBashProfile(paths, profilePath="profile").buildScript(BaseNodeInfo("node1", "10.0.0.1"), builder)
+    process = subprocess.Popen(["/bin/bash", "-c", builder.getCommand()], cwd=str(tmpdir),
+                               stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    process.communicate(builder.build())
+    assert process.returncode == 0
+
+    # commented assignments do not count
+    assert tmpdir.join("profile").read() == PROFILE.replace("/opt", str(tmpdir)) + "export PATH=$PATH:{0}\n".format(paths[1])
@@ -0,0 +1,142 @@
+"""
+Copyright (c) IBM 2015-2017. All Rights Reserved.
+Project name: storm-thunder
+This project is licensed under the MIT License, see LICENSE
+"""
+import datetime
+import logging
+import StringIO
+import zipfile
+
+from storm.thunder import BaseNodeInfo, DeploymentResult
+from storm.thunder.base import NodeDeploymentException
+from storm.thunder.relay import (RESULT_MARKER, STEP_MARKER,
+                                 createPackageArchive,
+                                 deployThroughRelays,
+                                 partitionNodes,
+                                 streamCommand)
+
+
+log = logging.getLogger(__name__)
+
+def test_createPackageArchive():
+
+    with zipfile.ZipFile(StringIO.StringIO(createPackageArchive())) as archive:
+        names = archive.namelist()
+    assert "storm/__init__.py" in names
+    assert "storm/thunder/relay.py" in names
+    assert "storm/deployments/node.py" in names
+    assert not [name for name in names if name.endswith(".pyc")]
+
+def test_partitionNodes():
+
+    nodes = [BaseNodeInfo("node{0}".format(index), "10.0.0.{0}".format(index)) for index in range(10)]
+    relays = [BaseNodeInfo("relay{0}".format(index), "10.0.1.{0}".format(index)) for index in range(3)]
+
+    subtrees = partitionNodes(nodes, relays)
+    assert [len(subtrees[relay.name]) for relay in relays] == [3, 3, 4]
+    assert [node for relay in relays for node in subtrees[relay.name]] == nodes
+
+def test_deployThroughRelays(monkeypatch):
+
+    nodes = [BaseNodeInfo("node{0}".format(index), "10.0.0.{0}".format(index)) for index in range(4)]
+    relays = [BaseNodeInfo("relay{0}".format(index), "10.0.1.{0}".format(index)) for index in range(2)]
+    now = datetime.datetime.utcnow()
+    results = {
+        node.name: DeploymentResult(NodeDeploymentException(), node, now, now)
+        for node in nodes
+    }
+
+    class FakeClient(object):
+
+        def __init__(self, hostname, **kwargs):
+            self.hostname = hostname
+
+        def close(self):
+            pass
+
+        def connect(self):
+            pass
+
+        def put(self, path, contents=None, mode=None):
+            pass
+
+    class FakeSerializable(object):
+
+        @staticmethod
+        def fromJSON(name):
+            return results[name]
+
+    class FakeTemporaryDirectory(object):
+
+        def __init__(self, client, prefix=None):
+            pass
+
+        def __enter__(self):
+            return "/tmp/relay"
+
+        def __exit__(self, exceptionType, exception, traceback):
+            pass
+
+    def streamCommand(client, command, lineCallback, errorLineCallback=None):
+        # two steps for the subtree of the relay, the second one is not finished on the second relay
+        subtree = ["node0", "node1"] if client.hostname == "10.0.1.0" else ["node2", "node3"]
+        for stepIndex in range(2):
+            for name in subtree:
+                lineCallback("{0} {1} {2}".format(RESULT_MARKER, stepIndex, name))
+            if stepIndex == 0 or client.hostname == "10.0.1.0":
+                lineCallback("{0} {1}".format(STEP_MARKER, stepIndex))
+        return 0
+
+    monkeypatch.setattr("storm.thunder.relay.AdvancedSSHClient", FakeClient)
+    monkeypatch.setattr("storm.thunder.relay.JSONSerializable", FakeSerializable)
+    monkeypatch.setattr("storm.thunder.relay.RemoteTemporaryDirectory", FakeTemporaryDirectory)
+    monkeypatch.setattr("storm.thunder.relay.streamCommand", streamCommand)
+
+    steps = []
+    deploymentResults = deployThroughRelays([NodeDeploymentException()], nodes, relays, callback=steps.append)
+
+    # steps are reported per relay subtree in the same form as for deploy
+    assert sorted(sorted(step.keys()) for step in steps) == [
+        ["node0", "node1"], ["node0", "node1"], ["node2", "node3"], ["node2", "node3"]
+    ]
+    assert [sorted(step.keys()) for step in deploymentResults.steps] == [["node0", "node1", "node2", "node3"]] * 2
+
+def test_streamCommand():
+
+    class FakeChannel(object):
+
+        def close(self):
+            pass
+
+        def exec_command(self, command):
+            self.command = command
+
+        def makefile(self, mode):
+            return StringIO.StringIO("{0} 0 node0\n{1} 0\n".format(RESULT_MARKER, STEP_MARKER))
+
+        def makefile_stderr(self, mode):
+            return StringIO.StringIO("2017-01-01 [INFO] deploying\r\n")
+
+        def recv_exit_status(self):
+            return 0
+
+    class FakeTransport(object):
+
+        def open_session(self):
+            return FakeChannel()
+
+    class FakeParamikoClient(object):
+
+        def get_transport(self):
+            return FakeTransport()
+
+    class FakeClient(object):
+        client = FakeParamikoClient()
+
+    lines = []
+    errorLines = []
+    assert streamCommand(FakeClient(), "relay", lines.append, errorLines.append) == 0
+    # log output of the relay is kept out of the result lines
+    assert lines == ["{0} 0 node0".format(RESULT_MARKER), "{0} 0".format(STEP_MARKER)]
+    assert errorLines == ["2017-01-01 [INFO] deploying"]
@@ -0,0 +1,85 @@
+"""
+Copyright (c) IBM 2015-2017. All Rights Reserved.
+Project name: storm-thunder
+This project is licensed under the MIT License, see LICENSE
+"""
+import logging
+import subprocess
+
+from storm.thunder.client import getEnsureHostsEntryCommand
+from storm.thunder.script import ScriptBuilder
+
+
+log = logging.getLogger(__name__)
+
+def runScript(builder):
+    """
+    Run the script of the builder locally and return its standard output
+    """
+    process = subprocess.Popen(["/bin/bash", "-c", builder.getCommand()], stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    stdout, _ = process.communicate(builder.build())
+    return stdout, process.returncode
+
+def test_scriptBuilder():
+
+    builder = ScriptBuilder()
+    builder.addStep("first")
+    builder.addCommand("echo 'first output'; echo 'first error' >&2", "first failed")
+    builder.addCommand("cd /tmp; pwd", "directory failed")
+    builder.addStep("second")
+    builder.addCommand("echo 'Nothing to do' >&2; exit 1", "second failed", ignoreStderrContaining="Nothing to do")
+    builder.addStep("third")
+    builder.addCommand("echo 'third output'; exit 3", "third failed")
+    builder.addCommand("echo 'not reached'", "fourth failed")
+    builder.addStep("fourth")
+    builder.addCommand("echo 'not reached'", "fifth failed")
+
+    stdout, status = runScript(builder)
+    assert status == 3
+
+    results = builder.parseOutput(stdout)
+    assert len(results) == 4
+
+    first, second, third, fourth = results
+    assert len(first) == 2
+    assert first[0].stdout == "first output\n"
+    assert first[0].stderr == "first error\n"
+    assert first[0].status == 0
+    assert not first[0].failed
+    assert first[1].stdout == "/tmp\n"
+    assert not first[1].failed
+
+    assert len(second) == 1
+    assert second[0].status == 1
+    assert not second[0].failed
+
+    assert len(third) == 1
+    assert third[0].errorMessage == "third failed"
+    assert third[0].stdout == "third output\n"
+    assert third[0].status == 3
+    assert third[0].failed
+
+    assert fourth == []
+
+def test_scriptBuilderDefinitions(tmpdir):
+
+    path = str(tmpdir.join("hosts"))
+    builder = ScriptBuilder()
+    builder.addStep("hosts")
+    for number in range(100):
+        builder.addCommand(getEnsureHostsEntryCommand(path, "10.0.0.{0}".format(number), ["node{0}".format(number)], builder=builder),
+                           "Could not add node{0}".format(number))
+    # state is kept across commands of the step
+    builder.addCommand("echo state > {0}".format(builder.getStateFileName("state")), "state failed")
+    builder.addCommand("cat {0}".format(builder.getStateFileName("state")), "state failed")
+
+    # the awk program is only defined once
+    script = builder.build()
+    assert script.count("ENVIRON") == getEnsureHostsEntryCommand(path, "10.0.0.1", ["node1"]).count("ENVIRON")
+
+    stdout, status = runScript(builder)
+    assert status == 0
+    results = builder.parseOutput(stdout)[0]
+    assert all(result.stdout == "changed\n" for result in results[:100])
+    assert results[-1].stdout == "state\n"
+    assert tmpdir.join("hosts").read() == "".join("10.0.0.{0} node{0}\n".format(number) for number in range(100))
@@ -0,0 +1,82 @@
+"""
+Copyright (c) IBM 2015-2017. All Rights Reserved.
+Project name: storm-thunder
+This project is licensed under the MIT License, see LICENSE
+"""
+import logging
+import os
+import subprocess
+
+import pytest
+
+from storm.deployments.software import (DeployPythonPackages,
+                                        getPythonPackageInfo,
+                                        getYumCommand)
+from storm.thunder import AdvancedSSHClient, BaseNodeInfo, ScriptBuilder
+
+
+log = logging.getLogger(__name__)
+
+class TestDeployPythonPackages(object):
+
+    def test_getPythonPackageInfo(self):
+
+        assert getPythonPackageInfo("/tmp/c4_utils-0.2.1-py2-none-any.whl") == ("c4-utils", "0.2.1")
+        assert getPythonPackageInfo("storm-thunder-1.0.dev3.tar.gz") == ("storm-thunder", "1.0.dev3")
+        assert getPythonPackageInfo("Paramiko-2.0.0.zip") == ("paramiko", "2.0.0")
+        with pytest.raises(ValueError):
+            getPythonPackageInfo("invalid.txt")
+
+    def test_skipInstalled(self, monkeypatch, mockAdvancedSSHClient, tmpdir):
+
+        commands = []
+        def run(self, cmd, timeout=None, pseudoTTY=False):
+            commands.append(cmd)
+            if cmd.endswith("freeze"):
+                return "c4-utils==0.2.1\nstorm-thunder==0.9\n", "", 0
+            return "", "", 0
+        monkeypatch.setattr("storm.thunder.client.AdvancedSSHClient.run", run)
+
+        materialized = []
+        def materialize(self, fileNames, directory):
+            materialized.extend(fileNames)
+            return [os.path.join(directory, os.path.basename(fileName)) for fileName in fileNames]
+        monkeypatch.setattr("storm.thunder.cache.RemoteArtifactCache.materialize", materialize)
+
+        packages = []
+        for fileName in ["c4_utils-0.2.1-py2-none-any.whl", "storm-thunder-1.0.tar.gz", "unversioned.tar.gz"]:
+            tmpdir.join(fileName).write(fileName)
+            packages.append(str(tmpdir.join(fileName)))
+
+        client = AdvancedSSHClient.__new__(AdvancedSSHClient)
+        node = BaseNodeInfo("test", "1.2.3.4")
+        deployment = DeployPythonPackages(packages)
+        deployment.run(node, client, False)
+
+        # only the package that is not installed yet and the one without version are materialized
+        assert materialized == packages[1:]
+        assert any("storm-thunder==1.0" in command and "unversioned.tar.gz" in command and "--force-reinstall" not in command
+                   for command in commands)
+
+def test_getYumCommand(tmpdir):
+
+    # yum that runs out of mirrors until its cache was cleaned twice
+    tmpdir.join("yum").write("""#!/bin/bash
+if [ "$1" = clean ]; then echo cleaned >> cleaned; exit 0; fi
+if [ $(cat cleaned 2> /dev/null | wc -l) -lt 2 ]; then echo "[Errno 256] No more mirrors to try." >&2; exit 1; fi
+echo "installed $*"
+""")
+    os.chmod(str(tmpdir.join("yum")), 0755)
+
+    builder = ScriptBuilder()
+    builder.addStep("install")
+    builder.addCommand(getYumCommand("install --assumeyes git", builder), "Could not install git")
+    environment = dict(os.environ, PATH="{0}:{1}".format(tmpdir, os.environ["PATH"]))
+    process = subprocess.Popen(["/bin/bash", "-c", builder.getCommand()], cwd=str(tmpdir), env=environment,
+                               stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    stdout, _ = process.communicate(builder.build())
+
+    result = builder.parseOutput(stdout)[0][0]
+    assert not result.failed
+    assert result.stdout == "installed install --assumeyes git\n"
+    assert tmpdir.join("cleaned").read() == "cleaned\ncleaned\n"
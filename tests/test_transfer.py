@@ -0,0 +1,183 @@
+"""
+Copyright (c) IBM 2015-2017. All Rights Reserved.
+Project name: storm-thunder
+This project is licensed under the MIT License, see LICENSE
+"""
+import logging
+import os
+import random
+import subprocess
+import tarfile
+
+from storm.thunder import agent
+from storm.thunder.transfer import (CollectionArchive,
+                                    collectFiles,
+                                    downloadBulk,
+                                    downloadCompressed,
+                                    getDelta,
+                                    getLocalManifest, getRemoteManifest,
+                                    isCompressible,
+                                    syncDirectory,
+                                    uploadBulk,
+                                    uploadCompressed,
+                                    uploadDelta)
+
+
+log = logging.getLogger(__name__)
+
+def test_bulkTransfer(localServerClient, tmpdir):
+
+    data = os.urandom(3 * 1024 * 1024 + 7)
+    tmpdir.join("local").write(data, mode="wb")
+
+    client = localServerClient
+    progress = []
+    assert uploadBulk(client, str(tmpdir.join("local")), str(tmpdir.join("remote")), callback=lambda transferred, total: progress.append(transferred)) == len(data)
+    assert tmpdir.join("remote").read(mode="rb") == data
+    assert progress[-1] == len(data)
+
+    assert downloadBulk(client, str(tmpdir.join("remote")), str(tmpdir.join("downloaded"))) == len(data)
+    assert tmpdir.join("downloaded").read(mode="rb") == data
+
+def test_collectFiles(localClient, tmpdir):
+
+    for nodeName in ["node1", "node2"]:
+        logs = tmpdir.join(nodeName, "logs").ensure(dir=True)
+        logs.join("shared.log").write("shared\n" * 1000)
+        logs.join("{0}.log".format(nodeName)).write("{0}\n".format(nodeName))
+        logs.join("nested", "app.log").ensure().write("app\n")
+        logs.join("other.txt").write("other\n")
+
+    archiveFileName = str(tmpdir.join("collected.tar.gz"))
+    with CollectionArchive(archiveFileName) as archive:
+        localClient.directory = str(tmpdir.join("node1"))
+        statistics = collectFiles(localClient, ["logs/*.log", "~/logs/nested"], archive, "node1")
+        assert statistics["files"] == 3
+        assert statistics["duplicates"] == 0
+        assert statistics["errors"] == []
+        assert statistics["transferredSize"] > 0
+
+        localClient.directory = str(tmpdir.join("node2"))
+        statistics = collectFiles(localClient, ["logs/*.log", "logs/missing*"], archive, "node2")
+        assert statistics["files"] == 1
+        assert statistics["duplicates"] == 1
+        assert statistics["errors"] == ["No files match 'logs/missing*'"]
+
+    with tarfile.open(archiveFileName) as collected:
+        members = {member.name: member for member in collected.getmembers()}
+        assert sorted(name for name, member in members.items() if not member.isdir()) == [
+            "node1/logs/nested/app.log", "node1/logs/node1.log", "node1/logs/shared.log",
+            "node2/logs/node2.log", "node2/logs/shared.log"
+        ]
+        assert members["node2/logs/shared.log"].islnk()
+        assert members["node2/logs/shared.log"].linkname == "node1/logs/shared.log"
+        assert collected.extractfile("node2/logs/node2.log").read() == "node2\n"
+
+    collected = tmpdir.mkdir("extracted")
+    subprocess.check_call(["tar", "-xzf", archiveFileName, "-C", str(collected)])
+    assert collected.join("node2", "logs", "shared.log").read() == "shared\n" * 1000
+
+def test_compressedTransfer(localClient, tmpdir):
+
+    contents = "".join("option.{0} = enabled\n".format(number % 100) for number in range(10000))
+    tmpdir.join("local").write(contents)
+    tmpdir.join("remote").write("old")
+    os.chmod(str(tmpdir.join("remote")), 0640)
+
+    client = localClient
+    transferredSize = uploadCompressed(client, str(tmpdir.join("local")), "~/remote")
+    assert transferredSize == client.sent
+    assert transferredSize < len(contents) / 5
+    assert tmpdir.join("remote").read() == contents
+    assert os.stat(str(tmpdir.join("remote"))).st_mode & 0777 == 0640
+    assert sorted(os.listdir(str(tmpdir))) == ["local", "remote"]
+
+    assert downloadCompressed(client, "remote", str(tmpdir.join("downloaded"))) < len(contents) / 5
+    assert tmpdir.join("downloaded").read() == contents
+
+def test_getDelta(tmpdir):
+
+    data = "".join(chr(random.randint(0, 255)) for _ in range(5 * 4096))
+    tmpdir.join("old").write(data, mode="wb")
+    # shift the blocks by inserting data and change the last block
+    tmpdir.join("new").write("inserted" + data[:4 * 4096] + "changed" + data[4 * 4096 + 7:], mode="wb")
+
+    signatures = agent.getBlockSignatures(str(tmpdir.join("old")), 4096)
+    assert len(signatures) == 5
+    delta = list(getDelta(str(tmpdir.join("new")), signatures, 4096))
+    assert delta == ["inserted", [0, 4], "changed" + data[4 * 4096 + 7:]]
+
+def test_isCompressible(tmpdir):
+
+    tmpdir.join("text.txt").write("text\n" * 10000)
+    assert isCompressible(str(tmpdir.join("text.txt")))
+
+    # compressed extensions, random contents and small files
+    tmpdir.join("text.whl").write("text\n" * 10000)
+    assert not isCompressible(str(tmpdir.join("text.whl")))
+    tmpdir.join("random").write(os.urandom(100000), mode="wb")
+    assert not isCompressible(str(tmpdir.join("random")))
+    tmpdir.join("small.txt").write("text\n")
+    assert not isCompressible(str(tmpdir.join("small.txt")))
+
+def test_syncDirectory(localClient, tmpdir):
+
+    local = tmpdir.mkdir("local")
+    local.join("bin").mkdir().join("run.sh").write("#!/bin/bash\n")
+    os.chmod(str(local.join("bin", "run.sh")), 0755)
+    local.join("lib", "python").ensure(dir=True).join("module.py").write("value = 1\n")
+    local.join("empty").mkdir()
+    local.join("README").write("readme\n")
+    os.symlink("bin/run.sh", str(local.join("run")))
+
+    client = localClient
+    assert syncDirectory(client, str(local), "~/remote")["sent"] == 8
+    assert getRemoteManifest(client, "remote") == getLocalManifest(str(local))
+
+    # nothing to do
+    assert syncDirectory(client, str(local), "remote") == {"deleted": 0, "sent": 0, "transferredSize": 0, "updated": 0}
+
+    # changed content, mode and modification time as well as extraneous remote files
+    local.join("lib", "python", "module.py").write("value = 20\n")
+    os.chmod(str(local.join("README")), 0600)
+    os.utime(str(local.join("bin", "run.sh")), (0, 0))
+    tmpdir.join("remote", "extra").mkdir().join("file").write("extra")
+    statistics = syncDirectory(client, str(local), "remote")
+    assert statistics["sent"] == 1
+    assert statistics["updated"] == 2
+    assert statistics["deleted"] == 0
+    assert tmpdir.join("remote", "lib", "python", "module.py").read() == "value = 20\n"
+    assert tmpdir.join("remote", "extra", "file").check()
+
+    assert syncDirectory(client, str(local), "remote", delete=True)["deleted"] == 1
+    assert getRemoteManifest(client, "remote") == getLocalManifest(str(local))
+
+def test_uploadDelta(localHelper, monkeypatch, tmpdir):
+
+    random.seed(0)
+    data = "".join(chr(random.randint(0, 255)) for _ in range(100000))
+    tmpdir.join("local").write(data[:50000] + "changed" + data[50000:], mode="wb")
+    tmpdir.join("remote").write(data, mode="wb")
+    os.chmod(str(tmpdir.join("remote")), 0640)
+
+    helper = localHelper
+    literalSize = uploadDelta(helper, str(tmpdir.join("local")), str(tmpdir.join("remote")))
+    assert tmpdir.join("remote").read(mode="rb") == tmpdir.join("local").read(mode="rb")
+    assert os.stat(str(tmpdir.join("remote"))).st_mode & 0777 == 0640
+    assert literalSize < 2 * 4096 + 100000 % 4096
+    assert sorted(os.listdir(str(tmpdir))) == ["local", "remote"]
+
+    # no remote file to start from
+    assert uploadDelta(helper, str(tmpdir.join("local")), str(tmpdir.join("missing"))) is None
+
+    # mostly changed files are not worth the delta, including partially sent patches
+    monkeypatch.setattr("storm.thunder.transfer.MAXIMUM_LITERAL_SIZE", 4096)
+    tmpdir.join("local").write(os.urandom(100000), mode="wb")
+    assert uploadDelta(helper, str(tmpdir.join("local")), str(tmpdir.join("remote"))) is None
+    assert tmpdir.join("remote").read(mode="rb") != tmpdir.join("local").read(mode="rb")
+    assert sorted(os.listdir(str(tmpdir))) == ["local", "remote"]
+
+    # large files are not worth the delta either
+    monkeypatch.setattr("storm.thunder.transfer.MAXIMUM_DELTA_FILE_SIZE", 50000)
+    tmpdir.join("local").write(data, mode="wb")
+    assert uploadDelta(helper, str(tmpdir.join("local")), str(tmpdir.join("remote"))) is None